@@ -1,7 +1,8 @@
-import machine
+import hal
 import uasyncio as asyncio
 import ulogging as logging
 import aadc
+import loopmon
 
 from ina219 import INA219
 from utils import singleton
@@ -13,6 +14,14 @@ CURRENT_SENSOR_SHUNT_OHMS = 0.1
 ACTUATOR_TIMEOUT = 20_000  # In milliseconds
 MAX_ADC_VALUE = pow(2, 16)
 
+OBSTACLE_SETTINGS = (
+    'actuator_obstacle_sma_window',
+    'actuator_obstacle_max_value_coefficient',
+    'actuator_obstacle_current',
+    'actuator_obstacle_reverse_distance',
+    'actuator_current_monitoring_interval',
+)
+
 
 def _convert_actuators_extension_to_adc(goal):
     return goal / settings.ACTUATOR_LENGTH * MAX_ADC_VALUE
@@ -49,29 +58,57 @@ class Actuator:
         self._settings = settings.PersistentSettings()
         self._avoiding_obstacle = False
 
-        self.position_adc_pin = machine.ADC(machine.Pin(settings.POSITION_ADC_PIN), atten=machine.ADC.ATTN_11DB)
+        self.last_current = 0.0
+        """
+        Last current in mA measured by the obstacle detection, 0 when not moving
+        """
+        self.current_sampled = asyncio.Event()
+        """
+        Pulsed after every measurement of the current and when the actuator stops
+        """
+
+        # Snapshot of the obstacle detection settings, refreshed only when some of them changes
+        self._obstacle_generation = 0
+        self._refresh_obstacle_settings()
+        self._settings.subscribe(self._refresh_obstacle_settings, OBSTACLE_SETTINGS)
+
+        self.position_adc_pin = hal.ADC(hal.Pin(settings.POSITION_ADC_PIN), atten=hal.ADC.ATTN_11DB)
         self.position_adc = aadc.AADC(self.position_adc_pin)
         self.position_adc.sense(False)  # Will make it to wait until the reading is in given range
 
-        self.in1 = machine.Pin(settings.ACTUATOR_IN1_PIN, machine.Pin.OUT)
-        self.in2 = machine.Pin(settings.ACTUATOR_IN2_PIN, machine.Pin.OUT)
+        self.in1 = hal.Pin(settings.ACTUATOR_IN1_PIN, hal.Pin.OUT)
+        self.in2 = hal.Pin(settings.ACTUATOR_IN2_PIN, hal.Pin.OUT)
         self.in1.off()
         self.in2.off()
 
-        i2c = machine.SoftI2C(machine.Pin(settings.ACTUATOR_CURRENT_SCL_PIN),
-                              machine.Pin(settings.ACTUATOR_CURRENT_SDA_PIN))
+        i2c = hal.SoftI2C(hal.Pin(settings.ACTUATOR_CURRENT_SCL_PIN), hal.Pin(settings.ACTUATOR_CURRENT_SDA_PIN))
         self.current_sensor = INA219(CURRENT_SENSOR_SHUNT_OHMS, i2c, log_level=logging.WARNING)
         self.current_sensor.configure()
 
     def start(self):
         asyncio.create_task(self._log_values())
 
+    def _refresh_obstacle_settings(self, *_):
+        s = self._settings
+        self._obstacle_current = s.actuator_obstacle_current
+        self._obstacle_max_current = s.actuator_obstacle_max_value_coefficient * s.actuator_obstacle_current
+        self._obstacle_sma_window = s.actuator_obstacle_sma_window
+        self._obstacle_reverse_distance = s.actuator_obstacle_reverse_distance
+        self._monitoring_interval = s.actuator_current_monitoring_interval
+        self._obstacle_generation += 1
+
     def is_extended(self):
         return self.position_adc_pin.read_u16() > ADC_PRECISION
 
     def get_position(self):
         return _convert_from_adc_to_actuators_extension(self.position_adc_pin.read_u16())
 
+    def get_direction(self):
+        return self._moving_direction
+
+    def get_current(self):
+        return self.current_sensor.current()
+
     async def go_back(self):
         self._log.info("Going back")
         return await self.go_to(0)
@@ -85,12 +122,13 @@ class Actuator:
         try:
             finished_move_event = asyncio.Event()
             while not finished_move_event.is_set():
-                move_task = asyncio.create_task(self._go_to(target, finished_move_event))
+                move_task = asyncio.create_task(loopmon.timed('actuator.go_to', self._go_to(target, finished_move_event)))
 
                 # _detect_obstacle cancels the move_task when obstacle is detected and specifies
                 # the new target value for the move
-                target = await asyncio.wait_for_ms(self._detect_obstacles(finished_move_event, move_task),
-                                                   ACTUATOR_TIMEOUT)
+                target = await asyncio.wait_for_ms(
+                    loopmon.timed('actuator.detect_obstacles', self._detect_obstacles(finished_move_event, move_task)),
+                    ACTUATOR_TIMEOUT)
 
                 if target is None:
                     break
@@ -110,8 +148,8 @@ class Actuator:
         where_to_move = MovingDirection.FORWARD if target > current_position else MovingDirection.BACKWARD
         adc_target = _convert_actuators_extension_to_adc(target)
 
-        self._log.info(
-            f"Going to target {target}mm. Current position {current_position}mm ==> Moving {where_to_move.upper()}")
+        self._log.info("Going to target %smm. Current position %smm ==> Moving %s",
+                       target, current_position, where_to_move.upper())
 
         if where_to_move == MovingDirection.FORWARD:
             self._go_forward()
@@ -120,7 +158,7 @@ class Actuator:
             self._go_back()
             await self.position_adc(0, adc_target + ADC_PRECISION)
 
-        self._log.debug(f"Finished the move {current_position}mm --> {target}mm")
+        self._log.debug("Finished the move %smm --> %smm", current_position, target)
         self._stop()
         finished_event.set()
 
@@ -137,13 +175,20 @@ class Actuator:
         self._moving_direction = MovingDirection.NONE
         self.in1.off()
         self.in2.off()
+        self._publish_current(0.0)
+
+    def _publish_current(self, current):
+        self.last_current = current
+        # Setting the event schedules all waiting tasks, so it can be cleared right away
+        self.current_sampled.set()
+        self.current_sampled.clear()
 
     def _get_obstacle_target(self, current_move_direction):
         target_retraction = _convert_from_adc_to_actuators_extension(self.position_adc_pin.read_u16())
         if current_move_direction == MovingDirection.FORWARD:
-            target_retraction -= self._settings.actuator_obstacle_reverse_distance
+            target_retraction -= self._obstacle_reverse_distance
         elif current_move_direction == MovingDirection.BACKWARD:
-            target_retraction += self._settings.actuator_obstacle_reverse_distance
+            target_retraction += self._obstacle_reverse_distance
         else:
             self._log_obstacle.error("We should be avoiding obstacle but we are not moving!")
 
@@ -153,12 +198,12 @@ class Actuator:
         if target_retraction > settings.ACTUATOR_LENGTH:
             return settings.ACTUATOR_LENGTH
 
-        self._log_obstacle.info(f"Reversing {self._settings.actuator_obstacle_reverse_distance}mm to {target_retraction}mm.")
+        self._log_obstacle.info("Reversing %smm to %smm.", self._obstacle_reverse_distance, target_retraction)
 
         return target_retraction
 
     async def _detect_obstacles(self, finished_move_event, move_task):
-        if not self._settings.actuator_obstacle_current:
+        if not self._obstacle_current:
             self._log_obstacle.warning("Obstacle current is not defined. No obstacle detection is happening.")
             await finished_move_event.wait()
             return
@@ -166,11 +211,20 @@ class Actuator:
         # SMA = Simple Moving Average
         sma_values = []
         sma_sum = 0
+        generation = None
 
         # We monitor the current only while actuator is moving which is signaled by this event
         while not finished_move_event.is_set():
+            # Settings are copied to locals and re-read only when they changed
+            if generation != self._obstacle_generation:
+                generation = self._obstacle_generation
+                obstacle_current = self._obstacle_current
+                max_allowed_current = self._obstacle_max_current
+                sma_window = self._obstacle_sma_window
+                monitoring_interval = self._monitoring_interval
+
             current = self.current_sensor.current()
-            max_allowed_current = self._settings.actuator_obstacle_max_value_coefficient * self._settings.actuator_obstacle_current
+            self._publish_current(current)
 
             if current > max_allowed_current:
                 current = max_allowed_current
@@ -179,14 +233,14 @@ class Actuator:
             sma_values.append(current)
 
             # We have filled the SMA window size
-            if len(sma_values) > self._settings.actuator_obstacle_sma_window:
+            while len(sma_values) > sma_window:
                 sma_sum -= sma_values.pop(0)
 
-            current_sma = sma_sum / self._settings.actuator_obstacle_sma_window
+            current_sma = sma_sum / sma_window
 
-            if current_sma > self._settings.actuator_obstacle_current:
+            if current_sma > obstacle_current:
                 self._log_obstacle.warning("Obstacle detected!")
-                self._log.debug(f"SMA(sum={sma_sum};values={sma_values})")
+                self._log.debug("SMA(sum=%s;values=%s)", sma_sum, sma_values)
 
                 current_move_direction = self._moving_direction
                 move_task.cancel()  # We stop the current _go_to() coroutine
@@ -203,7 +257,7 @@ class Actuator:
                     await asyncio.sleep_ms(1000)
                     return self._get_obstacle_target(current_move_direction)
 
-            await asyncio.sleep_ms(self._settings.actuator_current_monitoring_interval)
+            await asyncio.sleep_ms(monitoring_interval)
 
         return None  # None represents no new target
 
@@ -213,6 +267,6 @@ class Actuator:
 
         while True:
             reading = self.position_adc_pin.read_u16()
-            self._log.debug(
-                f"Extended: {_convert_from_adc_to_actuators_extension(reading)}mm (raw: {reading}); Current: {self.current_sensor.current()}mA")
+            self._log.debug("Extended: %smm (raw: %s); Current: %smA",
+                            _convert_from_adc_to_actuators_extension(reading), reading, self.current_sensor.current())
             await asyncio.sleep_ms(1200)
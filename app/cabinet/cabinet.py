@@ -1,16 +1,22 @@
-import machine
-import onewire
-import ds18x20
+import hal
+import ubinascii
 import ulogging as logging
 import uasyncio as asyncio
+from utime import ticks_ms, ticks_diff
 
 from cabinet import settings
 from cabinet.actuator import Actuator
-from cabinet.fan import Fan
+from cabinet.fan import Fan, FanController, INVALID_TEMP
+from btn import IrqPushbutton
 from utils import singleton
 
 TEMP_RETRIES = 4
 TEMP_RETRIES_INTERVAL = 500
+TEMP_CONVERSION_TIME = 750
+TEMP_MAX_AGE = 1000
+"""
+Readings younger than this are returned without new conversion, so concurrent readers share one conversion
+"""
 POSITION_TARGET_TOLERANCE_CM = 1
 """
 Defines how much the actuator's position can be off the extension target
@@ -25,31 +31,61 @@ class Cabinet:
         self._actuator = Actuator()
         self._log = logging.getLogger('Cabinet')
 
-        self._usb_trigger = machine.Pin(settings.USB_TRIGGER_PIN, machine.Pin.OUT)
+        self._usb_trigger = hal.Pin(settings.USB_TRIGGER_PIN, hal.Pin.OUT)
         self._usb_trigger.off()
 
         self._fan = Fan()
         self._fan.off()
+        self._fan_control = FanController()
+
+        self._temp = hal.DS18X20(hal.OneWire(hal.Pin(settings.TEMP_PIN)))
+        self._temp_sensors = []  # (name, ROM)
+        self._temp_primary = None
+        self._temp_lock = asyncio.Lock()  # Only one conversion can run on the bus at a time
+        self._temps = {}
+        self._temps_time = None
+        self.last_temp = None
+        """
+        Last successfully read temperature of the primary sensor
+        """
+
+        self._button = None
+
+    async def start(self):
+        """
+        Starts the hardware, yielding between the steps so the network connection started
+        beforehand progresses meanwhile.
+        """
+        self._actuator.start()
+        await asyncio.sleep_ms(0)
+        self._fan.start()
 
-        self._temp = ds18x20.DS18X20(onewire.OneWire(machine.Pin(settings.TEMP_PIN)))
-        self._temp_rom = None
+        # Physical button gives local control even when MQTT is not available
+        self._button = IrqPushbutton(hal.Pin(settings.BUTTON_PIN, hal.Pin.IN, hal.Pin.PULL_UP), sense=1)
+        self._button.press_func(self.trigger)
+        await asyncio.sleep_ms(0)
 
-    def start(self):
-        self._actuator.start()
+        for rom in self._temp.scan():
+            rom_hex = ubinascii.hexlify(rom).decode()
+            name = settings.TEMP_SENSORS.get(rom_hex, rom_hex)
+            self._log.info('Found temperature sensor %s (%s)', name, rom_hex)
+            self._temp_sensors.append((name, rom))
 
-        roms = self._temp.scan()
-        if len(roms) == 0:
+        if not self._temp_sensors:
             self._log.error("No temperature sensor found!")
-        elif len(roms) != 1:
-            self._log.error("Found more then one sensor!")
+        elif settings.TEMP_PRIMARY_SENSOR in [sensor[0] for sensor in self._temp_sensors]:
+            self._temp_primary = settings.TEMP_PRIMARY_SENSOR
         else:
-            self._log.info(f'Found {roms[0]} temperature sensor')
-            self._temp_rom = roms[0]
+            self._temp_primary = self._temp_sensors[0][0]
 
         # This is in case of crash to recover the proper setting during booting up
         if self.is_on():
             asyncio.create_task(self.turn_on())
 
+    @property
+    def actuator(self):
+        return self._actuator
+
     def is_on(self):
         position = self._actuator.get_position()
         target = self._settings.actuator_target
@@ -72,7 +108,7 @@ class Cabinet:
         self._usb_trigger.on()
         successful = await self._actuator.go_to(self._settings.actuator_target)
         self._moving = False
-        self._fan.set(50)
+        self._fan_control.start(self.get_temp)
 
         if successful:
             self._log.info("Successfully opened cabinet")
@@ -91,6 +127,7 @@ class Cabinet:
         self._usb_trigger.off()
         successful = await self._actuator.go_back()
         self._moving = False
+        self._fan_control.stop()
         self._fan.off()
 
         if successful:
@@ -100,20 +137,62 @@ class Cabinet:
 
         return successful
 
+    @property
+    def temp_sensors(self):
+        """
+        Names of the found temperature sensors
+        """
+        return [sensor[0] for sensor in self._temp_sensors]
+
+    @property
+    def primary_temp_sensor(self):
+        return self._temp_primary
+
     async def get_temp(self):
-        if self._temp_rom is None:
-            return -100
-
-        for _ in range(TEMP_RETRIES):
-            try:
-                self._temp.convert_temp()
-                await asyncio.sleep_ms(750)
-                temp = self._temp.read_temp(self._temp_rom)
-                self._log.info(f'Current temperature {temp}')
-                return temp
-            except Exception:
-                pass
-            await asyncio.sleep_ms(TEMP_RETRIES_INTERVAL)
-
-        self._log.error(f'After {TEMP_RETRIES} retries, it was not possible to get temperature')
-        return -100
+        """
+        Returns temperature of the primary sensor
+        """
+        return (await self.get_temps()).get(self._temp_primary, INVALID_TEMP)
+
+    async def get_temps(self):
+        """
+        Returns temperatures of all sensors as dict keyed by the sensor's name, INVALID_TEMP marks failed reading.
+        All sensors are converted at once by single broadcast command, so the conversion time is paid only once.
+        """
+        if not self._temp_sensors:
+            return {}
+
+        async with self._temp_lock:
+            if self._temps_time is not None and ticks_diff(ticks_ms(), self._temps_time) < TEMP_MAX_AGE:
+                return self._temps
+
+            temps = {}
+            for _ in range(TEMP_RETRIES):
+                try:
+                    self._temp.convert_temp()  # Skip ROM command addresses all sensors
+                except Exception:
+                    await asyncio.sleep_ms(TEMP_RETRIES_INTERVAL)
+                    continue
+
+                await asyncio.sleep_ms(TEMP_CONVERSION_TIME)
+                failed = False
+                for name, rom in self._temp_sensors:
+                    try:
+                        temps[name] = self._temp.read_temp(rom)
+                    except Exception:
+                        failed = True
+                if not failed:
+                    break
+                await asyncio.sleep_ms(TEMP_RETRIES_INTERVAL)
+
+            for name, _ in self._temp_sensors:
+                if name not in temps:
+                    self._log.error('After %s retries, it was not possible to get temperature of %s', TEMP_RETRIES, name)
+                    temps[name] = INVALID_TEMP
+
+            self._log.info('Current temperatures %s', temps)
+            if temps[self._temp_primary] != INVALID_TEMP:
+                self.last_temp = temps[self._temp_primary]
+            self._temps = temps
+            self._temps_time = ticks_ms()
+            return temps
@@ -1,25 +1,80 @@
-import machine
+import hal
 import ulogging as logging
+import uasyncio as asyncio
+import loopmon
+from utime import ticks_ms, ticks_diff
 
 from utils import singleton
 from cabinet import settings
+from cabinet.fan_regulator import FanRegulator
 
 PWM_FREQ = 5000
 MAX_DUTY_VALUE = pow(2, 16)
 
+TACH_PULSES_PER_REVOLUTION = 2
+RPM_INTERVAL = 1000  # In milliseconds
+SPIN_UP_TIME = 3000  # In milliseconds
+"""
+Time after starting the fans before their RPM is checked
+"""
+STALL_TIME = 2000  # In milliseconds
+"""
+How long the fans have to report no rotation while powered to be pronounced stalled
+"""
+
+FAN_CONTROL_INTERVAL = 10_000  # In milliseconds
+INVALID_TEMP = -100
+FAN_FALLBACK_DUTY = 50
+"""
+Duty cycle used while the temperature can not be read
+"""
+
+REGULATOR_SETTINGS = (
+    'fan_target_temperature',
+    'fan_hysteresis',
+    'fan_kp',
+    'fan_ki',
+    'fan_kd',
+    'fan_min_duty',
+    'fan_max_step',
+)
+
 
 @singleton
 class Fan:
     def __init__(self):
         self._log = logging.getLogger('Fan')
 
-        fan_pin = machine.Pin(settings.FAN_PWM_PIN, machine.Pin.OUT)
-        self._pwm = machine.PWM(fan_pin, freq=PWM_FREQ)
+        fan_pin = hal.Pin(settings.FAN_PWM_PIN, hal.Pin.OUT)
+        self._pwm = hal.PWM(fan_pin, freq=PWM_FREQ)
         self.duty_cycle = 0
 
+        self.rpm = 0
+        """
+        Measured speed of the fans
+        """
+        self.stalled = False
+        """
+        Fans are powered but do not rotate
+        """
+        self._pulses = 0
+        self._started = ticks_ms()
+        self._stalled_since = None
+
+        self._tach = hal.Pin(settings.FAN_TACH_PIN, hal.Pin.IN, hal.Pin.PULL_UP)
+        self._tach.irq(self._count_pulse, hal.Pin.IRQ_FALLING, hard=True)
+
+    def start(self):
+        asyncio.create_task(loopmon.timed('fan.measure_rpm', self._measure_rpm()))
+
+    def _count_pulse(self, _):  # Hard ISR: no allocations
+        self._pulses += 1
+
     def set(self, duty_cycle):
+        if not self.duty_cycle and duty_cycle:
+            self._started = ticks_ms()
         self.duty_cycle = duty_cycle
-        self._log.info(f'Setting fan to {duty_cycle}%')
+        self._log.info('Setting fan to %s%%', duty_cycle)
         pwm = ((self.duty_cycle * MAX_DUTY_VALUE)//100)-1
         self._pwm.duty_u16(pwm if pwm > 0 else 0)
 
@@ -27,3 +82,97 @@ class Fan:
         self._log.info('Setting fan to 0%')
         self.duty_cycle = 0
         self._pwm.duty_u16(0)
+
+    async def _measure_rpm(self):
+        last = ticks_ms()
+        while True:
+            await asyncio.sleep_ms(RPM_INTERVAL)
+
+            irq_state = hal.disable_irq()
+            pulses = self._pulses
+            self._pulses = 0
+            hal.enable_irq(irq_state)
+
+            now = ticks_ms()
+            self.rpm = pulses * 60_000 // (TACH_PULSES_PER_REVOLUTION * max(ticks_diff(now, last), 1))
+            last = now
+            self._check_stall(now)
+
+    def _check_stall(self, now):
+        if self.rpm or not self.duty_cycle or ticks_diff(now, self._started) < SPIN_UP_TIME:
+            self._stalled_since = None
+            if self.stalled:
+                self._log.info('Fans are rotating again')
+                self.stalled = False
+            return
+
+        if self._stalled_since is None:
+            self._stalled_since = now
+        elif not self.stalled and ticks_diff(now, self._stalled_since) >= STALL_TIME:
+            self._log.error('Fans are stalled! Powered at %s%% but not rotating', self.duty_cycle)
+            self.stalled = True
+
+
+@singleton
+class FanController:
+    """
+    Regulates the fans based on the temperature while the cabinet is turned on.
+    """
+
+    def __init__(self):
+        self._log = logging.getLogger('FanControl')
+        self._fan = Fan()
+        self._settings = settings.PersistentSettings()
+        self._regulator = FanRegulator(0, 0, 0, 0, 0, 0, 1)
+        self._refresh_settings()
+        self._settings.subscribe(self._refresh_settings, REGULATOR_SETTINGS)
+        self._task = None
+
+    def _refresh_settings(self, *_):
+        s = self._settings
+        regulator = self._regulator
+        regulator.target = s.fan_target_temperature
+        regulator.hysteresis = s.fan_hysteresis
+        regulator.min_duty = s.fan_min_duty
+        regulator.max_step = s.fan_max_step
+        regulator.pid.kp = s.fan_kp
+        regulator.pid.ki = s.fan_ki
+        regulator.pid.kd = s.fan_kd
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def start(self, read_temp):
+        """
+        Starts the regulation with temperatures from the `read_temp` coroutine function.
+        """
+        if self._task is None:
+            self._log.info('Starting temperature based regulation')
+            self._regulator.reset()
+            self._task = asyncio.create_task(loopmon.timed('fan.control', self._run(read_temp)))
+
+    def stop(self):
+        if self._task is not None:
+            self._log.info('Stopping temperature based regulation')
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self, read_temp):
+        last = ticks_ms()
+        while True:
+            temp = await read_temp()
+            now = ticks_ms()
+
+            if temp == INVALID_TEMP:
+                self._log.warning('No temperature, falling back to %s%%', FAN_FALLBACK_DUTY)
+                self._regulator.reset()
+                self._regulator.duty = FAN_FALLBACK_DUTY
+                duty = FAN_FALLBACK_DUTY
+            else:
+                duty = self._regulator.update(temp, ticks_diff(now, last) / 1000)
+            last = now
+
+            if duty != self._fan.duty_cycle:
+                self._fan.set(duty)
+            await asyncio.sleep_ms(FAN_CONTROL_INTERVAL)
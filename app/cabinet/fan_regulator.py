@@ -0,0 +1,55 @@
+# Plain Python (no MicroPython specific imports), so it can be also used by host tools.
+from pid import PID
+
+
+class FanRegulator:
+    """
+    Computes the fans' duty cycle from the temperature.
+
+    The fans start when the temperature gets above `target + hysteresis` and stop only once it falls
+    below `target - hysteresis`, so they do not toggle around the target. While running, the PID output
+    is kept above the minimal duty cycle the fans reliably spin with and every change of the duty cycle
+    is limited to `max_step` percents per update.
+    """
+
+    def __init__(self, target, hysteresis, kp, ki, kd, min_duty, max_step):
+        self.pid = PID(kp, ki, kd, 0, 100)
+        self.target = target
+        self.hysteresis = hysteresis
+        self.min_duty = min_duty
+        self.max_step = max_step
+        self.running = False
+        self.duty = 0
+
+    def reset(self):
+        self.pid.reset()
+        self.running = False
+        self.duty = 0
+
+    def update(self, temp, dt):
+        """
+        Returns the new duty cycle in percents for temperature measured `dt` seconds after the previous one.
+        """
+        error = temp - self.target  # Cooling is reverse acting: higher temperature needs more output
+
+        if not self.running and error > self.hysteresis:
+            self.running = True
+        elif self.running and error < -self.hysteresis:
+            self.running = False
+            self.pid.reset()
+
+        if self.running:
+            output = self.pid.update(error, dt)
+            if output < self.min_duty:
+                output = self.min_duty
+        else:
+            output = 0
+
+        # Stopping is not rate limited as there is no reason to spin the fans when not needed
+        if output and abs(output - self.duty) > self.max_step:
+            output = self.duty + self.max_step if output > self.duty else self.duty - self.max_step
+            if output < self.min_duty:
+                output = self.min_duty
+
+        self.duty = round(output)
+        return self.duty
@@ -1,7 +1,10 @@
 import math
-import ujson, machine
+import ujson
+import hal
 import ulogging as logging
 import uasyncio as asyncio
+import loopmon
+import memmon
 from mqtt_as import MQTTClient, config
 from uota import UOta
 
@@ -23,6 +26,12 @@ TEMP_STATE_INTERVAL = 2000
 FAN_STATE_INTERVAL = 2000
 # FW_VERSIONS_STATE_INTERVAL = 15*60*1000
 FW_VERSIONS_STATE_INTERVAL = 60_000
+LOOP_STATS_INTERVAL = 60_000
+LOOP_LAG_WARNING = 100  # In milliseconds
+MEM_STATS_INTERVAL = 60_000
+MEM_LOW_WATER = 16_384  # Free heap in bytes under which a warning is raised
+MEM_LOW_LARGEST = 4_096  # Block in bytes that has to fit into the heap, a warning is raised otherwise
+MEM_LARGEST_EVERY = 10  # Largest free block is measured with every n-th heap report as it takes many allocations
 CABINET_AVAILABILITY_TOPIC = "projector_cabinet/availability"
 
 # Main on/off cabinet switch
@@ -33,6 +42,9 @@ SWITCH_COMMAND_TOPIC = "projector_cabinet/switch/set"
 # Temperature sensor
 TEMP_DISCOVERY_TOPIC = "homeassistant/sensor/projector_cabinet/temp/config"
 TEMP_STATE_TOPIC = "projector_cabinet/temp/state"
+# Additional temperature sensors, formatted with the sensor's name
+TEMP_SENSOR_DISCOVERY_TOPIC = "homeassistant/sensor/projector_cabinet/temp_{}/config"
+TEMP_SENSOR_STATE_TOPIC = "projector_cabinet/temp/{}/state"
 
 # Actuator target
 TARGET_DISCOVERY_TOPIC = "homeassistant/number/projector_cabinet/target/config"
@@ -50,12 +62,36 @@ FANS_POWER_STATE_TOPIC = "projector_cabinet/fans/state"
 FANS_SPEED_STATE_TOPIC = "projector_cabinet/fans/speed/state"
 FANS_COMMAND_TOPIC = "projector_cabinet/fans/set"
 FANS_SPEED_COMMAND_TOPIC = "projector_cabinet/fans/speed/set"
+FANS_RPM_DISCOVERY_TOPIC = "homeassistant/sensor/projector_cabinet/fans_rpm/config"
+FANS_RPM_STATE_TOPIC = "projector_cabinet/fans/rpm/state"
+FANS_STALL_DISCOVERY_TOPIC = "homeassistant/binary_sensor/projector_cabinet/fans_stall/config"
+FANS_STALL_STATE_TOPIC = "projector_cabinet/fans/stall/state"
 
 # Firmware update
 FW_DISCOVERY_TOPIC = "homeassistant/update/projector_cabinet/fw/config"
 FW_STATE_TOPIC = "projector_cabinet/fw/state"
 FW_COMMAND_TOPIC = "projector_cabinet/fw/update"
 
+# Firmware delivery in chunks (see tools/mqtt_fw_publisher.py)
+FW_CHUNK_BEGIN_TOPIC = "projector_cabinet/fw/chunk/begin"
+FW_CHUNK_DATA_TOPIC = "projector_cabinet/fw/chunk/data"
+FW_CHUNK_ACK_TOPIC = "projector_cabinet/fw/chunk/ack"
+
+# Boot diagnostics
+BOOT_DISCOVERY_TOPIC = "homeassistant/sensor/projector_cabinet/boot/config"
+BOOT_STATE_TOPIC = "projector_cabinet/boot/state"
+BOOT_ATTRIBUTES_TOPIC = "projector_cabinet/boot/attributes"
+
+# Event loop diagnostics
+LOOP_DISCOVERY_TOPIC = "homeassistant/sensor/projector_cabinet/loop_lag/config"
+LOOP_STATE_TOPIC = "projector_cabinet/loop_lag/state"
+LOOP_ATTRIBUTES_TOPIC = "projector_cabinet/loop_lag/attributes"
+
+# Heap diagnostics
+MEM_DISCOVERY_TOPIC = "homeassistant/sensor/projector_cabinet/heap/config"
+MEM_STATE_TOPIC = "projector_cabinet/heap/state"
+MEM_ATTRIBUTES_TOPIC = "projector_cabinet/heap/attributes"
+
 # Local configuration
 config['ssid'] = secrets.WIFI_SSID
 config['wifi_pw'] = secrets.WIFI_PASS
@@ -76,6 +112,8 @@ class MQTT:
         MQTTClient.DEBUG = True
         self._client = MQTTClient(config, self._logger)
         self._state_loops = []
+        self._boot_phases = None
+        self._mem_low = False
         self._topics_commands_mapping = {
             SWITCH_COMMAND_TOPIC: self._handle_switch_command,
             FW_COMMAND_TOPIC: self._handle_fw_command,
@@ -83,6 +121,7 @@ class MQTT:
             EXTENSION_COMMAND_TOPIC: self._handle_extension_command,
             FANS_COMMAND_TOPIC: self._handle_fans_command,
             FANS_SPEED_COMMAND_TOPIC: self._handle_fans_command,
+            FW_CHUNK_BEGIN_TOPIC: self._handle_fw_chunk_begin,
         }
 
         # Cabinet state related components
@@ -90,55 +129,130 @@ class MQTT:
         self._updater = UOta(SRC_REPO, logger=logging.getLogger('UOta'))
         self._settings = settings.PersistentSettings()
         self._fan = fan.Fan()
+        self._fan_control = fan.FanController()
         self._actuator = actuator.Actuator()
 
+    def set_boot_phases(self, phases):
+        """
+        Stores the boot phases as list of (phase, milliseconds since reset) tuples
+        that are published as diagnostic once connected to the broker. When the connection
+        came up already during the boot, they are published right away.
+        """
+        self._boot_phases = phases
+        if self._client.isconnected():
+            asyncio.create_task(self._publish_boot_phases())
+
+    async def _publish_boot_phases(self):
+        if self._boot_phases is None:
+            return
+
+        attributes = {phase: timestamp for phase, timestamp in self._boot_phases}
+        attributes["version"] = self._updater.get_current_version()
+        await self._client.publish(BOOT_ATTRIBUTES_TOPIC, ujson.dumps(attributes), True)
+        await self._client.publish(BOOT_STATE_TOPIC, str(self._boot_phases[-1][1]), True)
+
     async def _handle_switch_command(self, msg):
         if msg == "ON":
             await self._cabinet.turn_on()
         elif msg == "OFF":
             await self._cabinet.turn_off()
         else:
-            self._logger.error(f'Handling switch command, but got unknown command: {msg}')
+            self._logger.error('Handling switch command, but got unknown command: %s', msg)
 
         await self._client.publish(SWITCH_STATE_TOPIC, "ON" if self._cabinet.is_on() else "OFF")
 
     async def _handle_fw_command(self, msg):
         self._logger.info("Got command to install new firmware!")
-        if msg == "install" and self._updater.download_update():
+        if msg == "install" and await self._updater.download_update():
             self._logger.info(
                 'Received install new firmware command and new version is available. Marking for install and restarting.')
-            machine.reset()
+            self._settings.flush()
+            logging.flush()
+            hal.reset()
+
+    async def _handle_fw_chunk_begin(self, msg):
+        try:
+            info = ujson.loads(msg)
+            self._logger.info("Got firmware %s to be transferred over MQTT", info.get('version'))
+            next_seq = await self._updater.begin_chunked_update(info)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self._logger.error("Invalid firmware announcement: %s", e)
+            await self._publish_fw_chunk_ack(-1, "invalid")
+            return
+        await self._ack_fw_chunk(next_seq)
+
+    async def _handle_fw_chunk(self, msg):
+        """
+        Chunk payload is 4 bytes big-endian sequence number followed by the chunk's data.
+        Every chunk is acknowledged with the next expected sequence number, which is
+        the flow control for the publisher.
+        """
+        seq = int.from_bytes(msg[:4], 'big')
+        await self._ack_fw_chunk(self._updater.write_chunk(seq, memoryview(msg)[4:]))
+
+    async def _ack_fw_chunk(self, next_seq):
+        if not self._updater.is_chunked_update_received():
+            await self._publish_fw_chunk_ack(next_seq)
+            return
+
+        if self._updater.finish_chunked_update():
+            await self._publish_fw_chunk_ack(next_seq, "done")
+            self._logger.info('Firmware received over MQTT. Restarting to install it.')
+            self._settings.flush()
+            logging.flush()
+            hal.reset()
+        else:
+            await self._publish_fw_chunk_ack(-1, "hash_mismatch")
+
+    async def _publish_fw_chunk_ack(self, next_seq, status=None):
+        payload = {"next": next_seq}
+        if status is not None:
+            payload["status"] = status
+        elif next_seq < 0:
+            payload["status"] = "rejected"
+        await self._client.publish(FW_CHUNK_ACK_TOPIC, ujson.dumps(payload), False, 1)
 
     async def _handle_target_command(self, msg):
-        self._logger.info(f"Setting new extension target: {msg}cm")
-        self._settings.actuator_target = int(msg)
+        self._logger.info("Setting new extension target: %scm", msg)
+        try:
+            self._settings.actuator_target = int(msg)
+        except ValueError as e:
+            self._logger.error("Invalid extension target: %s", e)
+        await self._client.publish(TARGET_STATE_TOPIC, str(self._settings.actuator_target))
 
     async def _handle_extension_command(self, msg):
-        self._logger.info(f"Move to extension: {msg}cm")
+        self._logger.info("Move to extension: %scm", msg)
         await self._actuator.go_to(int(msg))
         await self._client.publish(EXTENSION_STATE_TOPIC, str(math.floor(self._actuator.get_position())))
 
     async def _handle_fans_command(self, msg):
+        # Turning fans on hands them to the temperature regulation, explicit speed overrides it
         if msg == "ON":
-            self._fan.set(50)  # We don't persist duty cycle so we don't know what was the speed before turning it off
+            self._fan_control.start(self._cabinet.get_temp)
         elif msg == "OFF":
+            self._fan_control.stop()
             self._fan.off()
         elif "speed" in msg:
             obj = ujson.loads(msg)
+            self._fan_control.stop()
             self._fan.set(int(obj["speed"]))
         else:
-            self._logger.error(f"Unknown fan command {msg}")
+            self._logger.error("Unknown fan command %s", msg)
 
     async def _messages(self):
         async for topic, msg, retained in self._client.queue:
             topic = topic.decode()
+            if topic == FW_CHUNK_DATA_TOPIC:  # Binary payload
+                await self._handle_fw_chunk(msg)
+                continue
+
             msg = msg.decode()
-            self._logger.debug(f'Topic "{topic}" got message "{msg}"')
+            self._logger.debug('Topic "%s" got message "%s"', topic, msg)
 
             if topic in self._topics_commands_mapping:
                 await self._topics_commands_mapping[topic](msg)
             else:
-                self._logger.error(f'Unknown topic "{topic}"!')
+                self._logger.error('Unknown topic "%s"!', topic)
 
     async def _down(self):
         while True:
@@ -161,17 +275,30 @@ class MQTT:
             await self._client.subscribe(EXTENSION_COMMAND_TOPIC, 1)
             await self._client.subscribe(FANS_COMMAND_TOPIC, 1)
             await self._client.subscribe(FANS_SPEED_COMMAND_TOPIC, 1)
+            await self._client.subscribe(FW_CHUNK_BEGIN_TOPIC, 1)
+            await self._client.subscribe(FW_CHUNK_DATA_TOPIC, 1)
             await self._client.publish(CABINET_AVAILABILITY_TOPIC, "online")
             await self._client.publish(SWITCH_STATE_TOPIC, "ON" if self._cabinet.is_on() else "OFF")
             await self._client.publish(TARGET_STATE_TOPIC, str(self._settings.actuator_target))
-            self._state_loops.append(asyncio.create_task(self._read_temp()))
-            self._state_loops.append(asyncio.create_task(self._read_fw_version()))
-            self._state_loops.append(asyncio.create_task(self._read_fans_duty_cycle()))
-            self._state_loops.append(asyncio.create_task(self._read_extension()))
+            await self._publish_boot_phases()
+            if self._updater.chunked_update_in_progress:  # Resume interrupted transfer
+                await self._publish_fw_chunk_ack(self._updater.next_chunk_seq)
+            self._state_loops.append(asyncio.create_task(loopmon.timed('mqtt.read_temp', self._read_temp())))
+            self._state_loops.append(asyncio.create_task(loopmon.timed('mqtt.read_fw_version', self._read_fw_version())))
+            self._state_loops.append(asyncio.create_task(loopmon.timed('mqtt.read_fans_duty_cycle', self._read_fans_duty_cycle())))
+            self._state_loops.append(asyncio.create_task(loopmon.timed('mqtt.read_extension', self._read_extension())))
+            self._state_loops.append(asyncio.create_task(self._publish_loop_stats()))
+            self._state_loops.append(asyncio.create_task(self._publish_mem_stats()))
 
     async def _read_temp(self):  # send temperature data
         while True:
-            await self._client.publish(TEMP_STATE_TOPIC, str(await self._cabinet.get_temp()))
+            temps = await self._cabinet.get_temps()
+            primary = self._cabinet.primary_temp_sensor
+            if not temps:  # No sensor was found, the main entity reports the failure as any failed reading
+                temps = {primary: fan.INVALID_TEMP}
+            for name, temp in temps.items():
+                topic = TEMP_STATE_TOPIC if name == primary else TEMP_SENSOR_STATE_TOPIC.format(name)
+                await self._client.publish(topic, str(temp))
             await asyncio.sleep_ms(TEMP_STATE_INTERVAL)
 
     async def _read_extension(self):  # send current actuator's extension
@@ -183,13 +310,38 @@ class MQTT:
         while True:
             await self._client.publish(FANS_POWER_STATE_TOPIC, "ON" if self._fan.duty_cycle > 0 else "OFF")
             await self._client.publish(FANS_SPEED_STATE_TOPIC, str(self._fan.duty_cycle))
+            await self._client.publish(FANS_RPM_STATE_TOPIC, str(self._fan.rpm))
+            await self._client.publish(FANS_STALL_STATE_TOPIC, "ON" if self._fan.stalled else "OFF")
             await asyncio.sleep_ms(FAN_STATE_INTERVAL)
 
+    async def _publish_loop_stats(self):
+        while True:
+            await asyncio.sleep_ms(LOOP_STATS_INTERVAL)
+            stats = loopmon.stats()
+            if stats['max'] > LOOP_LAG_WARNING:
+                self._logger.warning('Event loop was blocked for %sms, longest task step: %s (%sms)',
+                                     stats['max'], stats.get('worst_task'), stats.get('worst_task_max'))
+            await self._client.publish(LOOP_ATTRIBUTES_TOPIC, ujson.dumps(stats))
+            await self._client.publish(LOOP_STATE_TOPIC, str(stats['p99']))
+
+    async def _publish_mem_stats(self):
+        reports = 0
+        while True:
+            stats = memmon.stats(MEM_LOW_WATER, MEM_LOW_LARGEST, reports % MEM_LARGEST_EVERY == 0)
+            reports += 1
+            if stats['low'] and not self._mem_low:
+                self._logger.warning('Heap is low: %sB free, block of %sB fits: %s', stats['free'], MEM_LOW_LARGEST,
+                                     stats['block_fits'])
+            self._mem_low = stats['low']
+            await self._client.publish(MEM_ATTRIBUTES_TOPIC, ujson.dumps(stats))
+            await self._client.publish(MEM_STATE_TOPIC, str(stats['free']))
+            await asyncio.sleep_ms(MEM_STATS_INTERVAL)
+
     async def _read_fw_version(self):  # poll if new fw update is available
         while True:
             json_payload = ujson.dumps({
                 "installed_version": self._updater.get_current_version(),
-                "latest_version": self._updater.get_latest_version(),
+                "latest_version": await self._updater.get_latest_version(),
             })
             await self._client.publish(FW_STATE_TOPIC, json_payload)
             await asyncio.sleep_ms(FW_VERSIONS_STATE_INTERVAL)
@@ -203,7 +355,7 @@ class MQTT:
             "availability_topic": CABINET_AVAILABILITY_TOPIC,
             "device": DEVICE_DEFINITION,
         }
-        self._logger.info(f'Announcing cabinet capability on topic: {SWITCH_DISCOVERY_TOPIC}')
+        self._logger.info('Announcing cabinet capability on topic: %s', SWITCH_DISCOVERY_TOPIC)
         await self._client.publish(SWITCH_DISCOVERY_TOPIC, ujson.dumps(switch_discovery_payload))
 
         temp_discovery_payload = {
@@ -216,9 +368,27 @@ class MQTT:
             "availability_topic": CABINET_AVAILABILITY_TOPIC,
             "device": DEVICE_DEFINITION,
         }
-        self._logger.info(f'Announcing cabinet capability on topic: {TEMP_DISCOVERY_TOPIC}')
+        self._logger.info('Announcing cabinet capability on topic: %s', TEMP_DISCOVERY_TOPIC)
         await self._client.publish(TEMP_DISCOVERY_TOPIC, ujson.dumps(temp_discovery_payload))
 
+        for name in self._cabinet.temp_sensors:
+            if name == self._cabinet.primary_temp_sensor:  # Reported by the main temperature entity
+                continue
+
+            discovery_topic = TEMP_SENSOR_DISCOVERY_TOPIC.format(name)
+            sensor_discovery_payload = {
+                "name": f"Cabinet's temperature {name}",
+                "unique_id": f"projector_cabinet_temp_{name}",
+                "state_class": "measurement",
+                "device_class": "temperature",
+                "native_unit_of_measurement": "C",
+                "state_topic": TEMP_SENSOR_STATE_TOPIC.format(name),
+                "availability_topic": CABINET_AVAILABILITY_TOPIC,
+                "device": DEVICE_DEFINITION,
+            }
+            self._logger.info('Announcing cabinet capability on topic: %s', discovery_topic)
+            await self._client.publish(discovery_topic, ujson.dumps(sensor_discovery_payload))
+
         target_discovery_payload = {
             "name": "Extension target",
             "unique_id": "projector_cabinet_target",
@@ -233,7 +403,7 @@ class MQTT:
             "availability_topic": CABINET_AVAILABILITY_TOPIC,
             "device": DEVICE_DEFINITION,
         }
-        self._logger.info(f'Announcing cabinet capability on topic: {TARGET_DISCOVERY_TOPIC}')
+        self._logger.info('Announcing cabinet capability on topic: %s', TARGET_DISCOVERY_TOPIC)
         await self._client.publish(TARGET_DISCOVERY_TOPIC, ujson.dumps(target_discovery_payload))
 
         extension_discovery_payload = {
@@ -250,7 +420,7 @@ class MQTT:
             "availability_topic": CABINET_AVAILABILITY_TOPIC,
             "device": DEVICE_DEFINITION,
         }
-        self._logger.info(f'Announcing cabinet capability on topic: {EXTENSION_DISCOVERY_TOPIC}')
+        self._logger.info('Announcing cabinet capability on topic: %s', EXTENSION_DISCOVERY_TOPIC)
         await self._client.publish(EXTENSION_DISCOVERY_TOPIC, ujson.dumps(extension_discovery_payload))
 
         fans_discovery_payload = {
@@ -266,9 +436,33 @@ class MQTT:
             "availability_topic": CABINET_AVAILABILITY_TOPIC,
             "device": DEVICE_DEFINITION,
         }
-        self._logger.info(f'Announcing cabinet capability on topic: {FANS_DISCOVERY_TOPIC}')
+        self._logger.info('Announcing cabinet capability on topic: %s', FANS_DISCOVERY_TOPIC)
         await self._client.publish(FANS_DISCOVERY_TOPIC, ujson.dumps(fans_discovery_payload))
 
+        fans_rpm_discovery_payload = {
+            "name": "Cabinet fans speed",
+            "unique_id": "projector_cabinet_fans_rpm",
+            "unit_of_measurement": "RPM",
+            "state_class": "measurement",
+            "icon": "mdi:fan",
+            "state_topic": FANS_RPM_STATE_TOPIC,
+            "availability_topic": CABINET_AVAILABILITY_TOPIC,
+            "device": DEVICE_DEFINITION,
+        }
+        self._logger.info('Announcing cabinet capability on topic: %s', FANS_RPM_DISCOVERY_TOPIC)
+        await self._client.publish(FANS_RPM_DISCOVERY_TOPIC, ujson.dumps(fans_rpm_discovery_payload))
+
+        fans_stall_discovery_payload = {
+            "name": "Cabinet fans stalled",
+            "unique_id": "projector_cabinet_fans_stall",
+            "device_class": "problem",
+            "state_topic": FANS_STALL_STATE_TOPIC,
+            "availability_topic": CABINET_AVAILABILITY_TOPIC,
+            "device": DEVICE_DEFINITION,
+        }
+        self._logger.info('Announcing cabinet capability on topic: %s', FANS_STALL_DISCOVERY_TOPIC)
+        await self._client.publish(FANS_STALL_DISCOVERY_TOPIC, ujson.dumps(fans_stall_discovery_payload))
+
         update_discovery_payload = {
             "name": "Cabinet's device update",
             "unique_id": "projector_cabinet_fw",
@@ -279,10 +473,54 @@ class MQTT:
             "availability_topic": CABINET_AVAILABILITY_TOPIC,
             "device": DEVICE_DEFINITION,
         }
-        self._logger.info(f'Announcing cabinet capability on topic: {FW_DISCOVERY_TOPIC}')
+        self._logger.info('Announcing cabinet capability on topic: %s', FW_DISCOVERY_TOPIC)
         await self._client.publish(FW_DISCOVERY_TOPIC, ujson.dumps(update_discovery_payload))
 
+        boot_discovery_payload = {
+            "name": "Cabinet's boot time",
+            "unique_id": "projector_cabinet_boot",
+            "entity_category": "diagnostic",
+            "device_class": "duration",
+            "unit_of_measurement": "ms",
+            "state_topic": BOOT_STATE_TOPIC,
+            "json_attributes_topic": BOOT_ATTRIBUTES_TOPIC,
+            "availability_topic": CABINET_AVAILABILITY_TOPIC,
+            "device": DEVICE_DEFINITION,
+        }
+        self._logger.info('Announcing cabinet capability on topic: %s', BOOT_DISCOVERY_TOPIC)
+        await self._client.publish(BOOT_DISCOVERY_TOPIC, ujson.dumps(boot_discovery_payload))
+
+        loop_discovery_payload = {
+            "name": "Cabinet's event loop lag",
+            "unique_id": "projector_cabinet_loop_lag",
+            "entity_category": "diagnostic",
+            "device_class": "duration",
+            "unit_of_measurement": "ms",
+            "state_class": "measurement",
+            "state_topic": LOOP_STATE_TOPIC,
+            "json_attributes_topic": LOOP_ATTRIBUTES_TOPIC,
+            "availability_topic": CABINET_AVAILABILITY_TOPIC,
+            "device": DEVICE_DEFINITION,
+        }
+        self._logger.info('Announcing cabinet capability on topic: %s', LOOP_DISCOVERY_TOPIC)
+        await self._client.publish(LOOP_DISCOVERY_TOPIC, ujson.dumps(loop_discovery_payload))
+
+        mem_discovery_payload = {
+            "name": "Cabinet's free heap",
+            "unique_id": "projector_cabinet_heap",
+            "entity_category": "diagnostic",
+            "device_class": "data_size",
+            "unit_of_measurement": "B",
+            "state_class": "measurement",
+            "state_topic": MEM_STATE_TOPIC,
+            "json_attributes_topic": MEM_ATTRIBUTES_TOPIC,
+            "availability_topic": CABINET_AVAILABILITY_TOPIC,
+            "device": DEVICE_DEFINITION,
+        }
+        self._logger.info('Announcing cabinet capability on topic: %s', MEM_DISCOVERY_TOPIC)
+        await self._client.publish(MEM_DISCOVERY_TOPIC, ujson.dumps(mem_discovery_payload))
+
     async def start(self):
         await self._client.connect()
-        for coroutine in (self._up, self._down, self._messages):
-            asyncio.create_task(coroutine())
+        for name, coroutine in (('mqtt.up', self._up), ('mqtt.down', self._down), ('mqtt.messages', self._messages)):
+            asyncio.create_task(loopmon.timed(name, coroutine()))
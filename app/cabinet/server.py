@@ -1,56 +1,118 @@
-import uasyncio
-import utemplate.recompile
-import picoweb
-import machine
-from cabinet import cabinet, settings
+import uos
+import uasyncio as asyncio
+import ujson
+import ulogging as logging
+import hal
+import uhttpd
+from cabinet import cabinet, settings, telemetry
 
-persisted_settings = settings.PersistentSettings()
-app = picoweb.WebApp(__name__)
+HTTP_PORT = 8080 if hal.SIMULATED else 80  # Unprivileged port on the host
+STATIC_DIR = hal.FS_ROOT + '/app/cabinet/static'
+FILE_CHUNK_SIZE = 1024
 
-#  `utemplate.source` package compiles the templates and later on changes are not visible
-#  for development there is `utemplate.recompile` package which is more compute and memory intense though
-app.template_loader = utemplate.source.Loader(__name__.split(".", 1)[0], "templates")
+CONTENT_TYPES = {
+    'html': 'text/html',
+    'js': 'application/javascript',
+    'css': 'text/css',
+}
+"""
+Content types of the uncompressed assets, the compressed ones have them in `static_assets`
+"""
 
+persisted_settings = settings.PersistentSettings()
+app = uhttpd.Server()
+log = logging.getLogger('Server')
 
-@app.route("/")
-def homepage(req, resp):
-    cab = cabinet.Cabinet()
-    messages = []
+# Written data are copied to the socket or its out buffer, so the buffer can be shared by all connections
+_file_buf = bytearray(FILE_CHUNK_SIZE)
 
-    if req.method == "POST":
-        yield from req.read_form_data()
 
-        for config_key, config_value_string in req.form.items():
+def _set_settings(form, errors):
+    with persisted_settings.batch():  # Single flash write for the whole form
+        for config_key, config_value_string in form.items():
             try:
                 parsed = int(config_value_string)
-                setattr(persisted_settings, config_key, parsed)
-                print(f"Set {config_key} to value {parsed}")
             except ValueError:
                 try:
                     parsed = float(config_value_string.replace(",", "."))
-                    setattr(persisted_settings, config_key, parsed)
-                    print(f"Set {config_key} to value {parsed}")
                 except ValueError:
-                    messages.append(("danger", f"Error parsing config key {config_key} with value {config_value_string}"))
+                    errors.append(f"Error parsing config key {config_key} with value {config_value_string}")
+                    continue
+
+            try:
+                setattr(persisted_settings, config_key, parsed)
+                log.info("Set %s to value %s", config_key, parsed)
+            except (AttributeError, ValueError) as e:
+                errors.append(str(e))
+
+
+async def _send_json(writer, data):
+    await uhttpd.send(writer, ujson.dumps(data), content_type='application/json')
+
+
+def _uncompressed_assets():
+    assets = {}
+    for name in uos.listdir(STATIC_DIR):
+        if not name.endswith('.gz'):
+            content_type = CONTENT_TYPES.get(name.rpartition('.')[2], 'application/octet-stream')
+            assets['/' if name == 'index.html' else '/' + name] = (name, content_type, None)
+    return assets
+
 
-        messages.append(("success", "Configuration updated!"))
+try:
+    # Generated together with the compressed assets by `tools/build_static.py`
+    from cabinet.static_assets import ASSETS
+except ImportError:  # Sources uploaded without building the assets
+    log.warning('Compressed assets were not built, serving the uncompressed ones')
+    ASSETS = _uncompressed_assets()
+
+
+async def static(req, writer):
+    name, content_type, etag = ASSETS[req.path]
+    if etag is None:
+        await uhttpd.send_file(writer, f'{STATIC_DIR}/{name}', _file_buf, content_type)
     else:
-        req.parse_qs()
+        await uhttpd.send_gzipped(req, writer, f'{STATIC_DIR}/{name}', _file_buf, content_type, etag)
+
+
+for path in ASSETS:
+    app.route(path)(static)
+
+
+@app.route("/api/settings", methods=("GET", "POST"))
+async def api_settings(req, writer):
+    errors = []
+    if req.method == "POST":
+        _set_settings(await req.form(), errors)
+
+    await _send_json(writer, {
+        "settings": {key: getattr(persisted_settings, key) for key in persisted_settings.keys()},
+        "errors": errors,
+    })
+
+
+@app.route("/api/trigger", methods=("POST",))
+async def api_trigger(req, writer):
+    log.info("Triggering actuator")
+    asyncio.create_task(cabinet.Cabinet().trigger())
+    await uhttpd.send(writer, b'', 204, None)
+
+
+@app.route("/api/reboot", methods=("POST",))
+async def api_reboot(req, writer):
+    log.warning("Cabinet is restarting!")
+    await uhttpd.send(writer, b'', 204, None)
 
-        if "go" in req.form:
-            messages.append(("primary", "Actuator is going for it!"))
-            print("Triggering actuator")
-            uasyncio.create_task(cab.trigger())
+    persisted_settings.flush()
+    logging.flush()
+    await asyncio.sleep_ms(100)  # Let the response leave before resetting
+    hal.reset()
 
-        elif "reboot" in req.form:
-            messages.append(("warning", "Cabinet is restarting!"))
-            yield from picoweb.start_response(resp, content_type="text/html")
-            yield from app.render_template(resp, "homepage.tpl", (persisted_settings, messages))
-            machine.reset()
 
-    yield from picoweb.start_response(resp, content_type="text/html")
-    yield from app.render_template(resp, "homepage.tpl", (persisted_settings, messages))
+@app.route("/telemetry", streaming=True)
+async def telemetry_stream(req, writer):
+    await telemetry.Telemetry().stream(writer)
 
 
-def start():
-    app.run(debug=True, host="0.0.0.0", port=80)
+async def start():
+    await app.start(port=HTTP_PORT)
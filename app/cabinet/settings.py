@@ -1,5 +1,9 @@
-import ujson
 import os
+import hal
+import ustruct as struct
+import uasyncio as asyncio
+import loopmon
+from utime import ticks_add, ticks_diff, ticks_ms
 from utils import singleton
 
 # Pins settings
@@ -12,6 +16,21 @@ POSITION_ADC_PIN = 36
 ACTUATOR_CURRENT_SCL_PIN = 22
 ACTUATOR_CURRENT_SDA_PIN = 21
 FAN_PWM_PIN = 14
+FAN_TACH_PIN = 35
+BUTTON_PIN = 32
+
+TEMP_SENSORS = {
+    # 'ROM in hex': 'name', for example:
+    # '28ff641e0b160360': 'exhaust',
+}
+"""
+Names of the DS18X20 sensors on the OneWire bus. Sensors not listed here are named by their ROM.
+"""
+
+TEMP_PRIMARY_SENSOR = None
+"""
+Name of the sensor used for the fans regulation and the main temperature entity, first found sensor when None
+"""
 
 """
 Defines the maximal extension of the actuator's arm.
@@ -19,7 +38,65 @@ In millimeters.
 """
 ACTUATOR_LENGTH = 200
 
-PERSISTENT_SETTINGS_PATH = '/data/setting.json'
+PERSISTENT_SETTINGS_PATH = hal.FS_ROOT + '/data/settings.bin'
+LEGACY_SETTINGS_PATH = hal.FS_ROOT + '/data/setting.json'
+
+FLUSH_DEBOUNCE_MS = 500
+"""
+Changes are written to flash once no other change came in this period.
+"""
+
+SETTINGS_MAGIC = b'CABS'
+SETTINGS_VERSION = 1
+"""
+Version of the binary layout. New fields are only appended to the SCHEMA (older files are then
+loaded with defaults for the missing fields), the version has to be bumped for any other change.
+"""
+
+_HEADER_FORMAT = '<4sBB'  # Magic, version, number of fields
+
+SCHEMA = (
+    # (name, struct format, min, max)
+    ('actuator_target', 'H', 0, ACTUATOR_LENGTH),
+    ('actuator_obstacle_sma_window', 'B', 1, 100),
+    ('actuator_obstacle_max_value_coefficient', 'f', 1.0, 10.0),
+    ('actuator_obstacle_current', 'H', 0, 5000),
+    ('actuator_obstacle_reverse_distance', 'B', 0, ACTUATOR_LENGTH),
+    ('actuator_current_monitoring_interval', 'H', 10, 10_000),
+    ('projector_number_of_samples', 'H', 1, 65535),
+    ('projector_reading_interval_ms', 'H', 10, 60_000),
+    ('projector_calibration', 'f', 0.0, 10.0),
+    ('projector_sma_window', 'B', 1, 100),
+    ('fan_target_temperature', 'f', 15.0, 60.0),
+    ('fan_hysteresis', 'f', 0.0, 10.0),
+    ('fan_kp', 'f', 0.0, 100.0),
+    ('fan_ki', 'f', 0.0, 10.0),
+    ('fan_kd', 'f', 0.0, 100.0),
+    ('fan_min_duty', 'B', 0, 100),
+    ('fan_max_step', 'B', 1, 100),
+)
+"""
+Typed fields of the PersistentSettings in the order of the binary layout
+"""
+
+_FIELDS = {field[0]: field for field in SCHEMA}
+
+
+def _coerce(field, value):
+    """
+    Converts the value into the field's type and checks its bounds. Raises ValueError for invalid values.
+    """
+    name, fmt, low, high = field
+    if fmt == 'f':
+        value = float(value)
+    else:
+        if isinstance(value, float) and value != int(value):
+            raise ValueError(f'{name} must be integer, got {value}')
+        value = int(value)
+
+    if not low <= value <= high:
+        raise ValueError(f'{name} must be between {low} and {high}, got {value}')
+    return value
 
 
 @singleton
@@ -73,32 +150,207 @@ class PersistentSettings:
     Number of readings for the Simple Moving Average Window
     """
 
+    fan_target_temperature = 32.0
+    """
+    Temperature in °C the fans regulate the cabinet to
+    """
+
+    fan_hysteresis = 1.0
+    """
+    Fans start above `fan_target_temperature + fan_hysteresis` and stop below `fan_target_temperature - fan_hysteresis`
+    """
+
+    fan_kp = 20.0
+    """
+    Proportional gain of the fans' PID in percents of duty cycle per °C
+    """
+
+    fan_ki = 0.02
+    """
+    Integral gain of the fans' PID in percents of duty cycle per °C and second
+    """
+
+    fan_kd = 0.0
+    """
+    Derivative gain of the fans' PID in percents of duty cycle per °C/s
+    """
+
+    fan_min_duty = 20
+    """
+    Minimal duty cycle in percents the fans reliably spin with
+    """
+
+    fan_max_step = 10
+    """
+    Maximal change of the fans' duty cycle in percents per regulation step
+    """
+
     def __init__(self):
+        self._booting = True
+        self._batch_depth = 0
+        self._dirty = False
+        self._flush_deadline = 0
+        self._flush_task = None
+        self._writes = 0
+        self._subscribers = []
+
+        if not self._load():
+            self._migrate_legacy()
+        self._booting = False
+
+    def __setattr__(self, key, value):
+        if key.startswith('_'):
+            super().__setattr__(key, value)
+            return
+
+        field = _FIELDS.get(key)
+        if field is None:
+            raise AttributeError(f'Unknown setting {key}')
+        value = _coerce(field, value)
+        if value == getattr(self, key):
+            return
+        super().__setattr__(key, value)
+
+        if self._booting:
+            return
+
+        self._dirty = True
+        if not self._batch_depth:
+            self._schedule_flush()
+
+        for keys, callback in self._subscribers:
+            if keys is None or key in keys:
+                callback(key, value)
+
+    def subscribe(self, callback, keys=None):
+        """
+        Registers `callback(key, value)` called after a setting changes. When `keys` are specified,
+        the callback is called only for changes of those settings.
+        """
+        self._subscribers.append((keys, callback))
+
+    def keys(self):
+        return [field[0] for field in SCHEMA]
+
+    def _load(self):
         try:
             os.stat(PERSISTENT_SETTINGS_PATH)
-            with open(PERSISTENT_SETTINGS_PATH) as f:
-                self._booting = True
-                data = dict(ujson.load(f))
-                for key, value in data.items():
-                    setattr(self, key, value)
-                self._booting = False
-                print("=> Loaded setting: ", data)
         except OSError:
+            # Replacing the file on FAT (see `flush()`) was interrupted between the removal and the rename
+            try:
+                os.rename(PERSISTENT_SETTINGS_PATH + '.tmp', PERSISTENT_SETTINGS_PATH)
+                print("=> Recovered settings from interrupted write")
+            except OSError:
+                pass
+
+        try:
+            with open(PERSISTENT_SETTINGS_PATH, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return False
+
+        header_size = struct.calcsize(_HEADER_FORMAT)
+        try:
+            magic, version, count = struct.unpack_from(_HEADER_FORMAT, data)
+            if magic != SETTINGS_MAGIC or version != SETTINGS_VERSION or count > len(SCHEMA):
+                raise ValueError('unsupported layout')
+            values = struct.unpack_from('<' + ''.join([field[1] for field in SCHEMA[:count]]), data, header_size)
+        except ValueError as e:
+            print("=> Invalid settings, using defaults:", e)
+            return True
+
+        for field, value in zip(SCHEMA, values):
+            self._set_loaded(field[0], value)
+        print("=> Loaded settings")
+        return True
+
+    def _migrate_legacy(self):
+        import ujson
+        try:
+            with open(LEGACY_SETTINGS_PATH) as f:
+                data = dict(ujson.load(f))
+        except (OSError, ValueError):
             print("=> No settings loaded")
+            return
 
-    def __setattr__(self, key, value):
-        super().__setattr__(key, value)
+        for key, value in data.items():
+            if key in _FIELDS:
+                self._set_loaded(key, value)
+
+        self._dirty = True
+        self.flush()
+        os.remove(LEGACY_SETTINGS_PATH)
+        print("=> Migrated settings from JSON: ", data)
 
+    def _set_loaded(self, key, value):
         try:
-            if self._booting or key == '_booting':
-                return
-        except AttributeError:
-            pass
+            setattr(self, key, value)
+        except ValueError as e:
+            print("=> Ignoring invalid setting:", e)
+
+    def batch(self):
+        """
+        Context manager that groups several changes into single write:
+
+            with settings.batch():
+                settings.a = 1
+                settings.b = 2
+        """
+        return _Batch(self)
 
+    def _schedule_flush(self):
+        self._flush_deadline = ticks_add(ticks_ms(), FLUSH_DEBOUNCE_MS)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(loopmon.timed('settings.flush', self._flush_later()))
+
+    async def _flush_later(self):
         try:
-            os.mkdir('/data')
+            while True:
+                remaining = ticks_diff(self._flush_deadline, ticks_ms())
+                if remaining <= 0:
+                    break
+                await asyncio.sleep_ms(remaining)
+            self.flush()
+        finally:
+            self._flush_task = None
+
+    def flush(self):
+        """
+        Writes pending changes into temporary file that then replaces the settings. Where the rename
+        can not replace the file (FAT), the old one is removed first and `_load()` recovers
+        the temporary file if the write is interrupted in between.
+        """
+        if not self._dirty:
+            return
+
+        try:
+            os.mkdir(PERSISTENT_SETTINGS_PATH[:PERSISTENT_SETTINGS_PATH.rfind('/')])
         except OSError:
             pass
 
-        with open(PERSISTENT_SETTINGS_PATH, mode='w') as f:
-            ujson.dump(self.__dict__, f)
+        tmp_path = PERSISTENT_SETTINGS_PATH + '.tmp'
+        with open(tmp_path, mode='wb') as f:
+            f.write(struct.pack(_HEADER_FORMAT, SETTINGS_MAGIC, SETTINGS_VERSION, len(SCHEMA)))
+            f.write(struct.pack('<' + ''.join([field[1] for field in SCHEMA]),
+                                *[getattr(self, field[0]) for field in SCHEMA]))
+        try:
+            os.rename(tmp_path, PERSISTENT_SETTINGS_PATH)
+        except OSError:  # FAT does not allow renaming over existing file
+            os.remove(PERSISTENT_SETTINGS_PATH)
+            os.rename(tmp_path, PERSISTENT_SETTINGS_PATH)
+        self._dirty = False
+        self._writes += 1
+
+
+class _Batch:
+    def __init__(self, persistent_settings):
+        self._settings = persistent_settings
+
+    def __enter__(self):
+        self._settings._batch_depth += 1
+        return self._settings
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._settings._batch_depth -= 1
+        if not self._settings._batch_depth and self._settings._dirty:
+            self._settings._schedule_flush()
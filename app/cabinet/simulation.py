@@ -0,0 +1,110 @@
+"""
+Model of the cabinet's hardware for the simulated `hal` backend, so the firmware can run on a Linux host.
+
+- The actuator moves while one of the H-bridge inputs is on and reports its position to the ADC.
+  Its current (with a little noise) gets into the INA219 registers. The end stops cut the motor's power.
+- The fans' PWM duty cycle sets their speed and so the tachometer pulses.
+- The cabinet is a single heat capacity heated by the projector while the USB trigger is on and cooled
+  passively and by the fans, the same model as `tools/fan_simulation.py`. The intake sensor reads the ambient.
+
+The model advances by fixed steps and its noise is pseudo-random with a fixed seed, so every run with
+the same commands gives the same readings.
+"""
+
+import hal_sim
+import ulogging as logging
+from micropython import const
+
+from cabinet import settings
+from cabinet.actuator import CURRENT_SENSOR_SHUNT_OHMS, MAX_ADC_VALUE
+from cabinet.fan import MAX_DUTY_VALUE, TACH_PULSES_PER_REVOLUTION
+
+STEP_MS = const(50)
+ACTUATOR_TRAVEL_TIME = 10  # In seconds for the whole length
+ACTUATOR_CURRENT = 0.35  # In amps while moving
+ACTUATOR_CURRENT_NOISE = 0.05  # Fraction of the current
+SUPPLY_VOLTAGE = 12
+FAN_MAX_RPM = 3000
+
+HEAT_CAPACITY = 20_000  # J/K
+H_PASSIVE = 3  # W/K
+H_FANS = 25  # W/K at 100 % duty cycle
+T_AMBIENT = 24.0
+PROJECTOR_LOAD = 150  # W
+
+CABINET_SENSOR_ROM = b'\x28\x53\x49\x4d\x00\x00\x00\x01'
+INTAKE_SENSOR_ROM = b'\x28\x53\x49\x4d\x00\x00\x00\x02'
+
+INA219_ADDRESS = const(0x40)
+_REG_SHUNT_VOLTAGE = const(0x01)
+_REG_BUS_VOLTAGE = const(0x02)
+_REG_CURRENT = const(0x04)
+_REG_CALIBRATION = const(0x05)
+
+
+class CabinetModel:
+    def __init__(self, seed=1):
+        self._log = logging.getLogger('Simulation')
+        self._seed = seed
+        self.position = 0
+        """
+        Extension of the actuator in the units of `settings.ACTUATOR_LENGTH`
+        """
+        self.temp = T_AMBIENT
+        self._pulses = 0
+        self._timer = None
+
+    def start(self):
+        self._log.info('Simulating the cabinet hardware with %s ms steps', STEP_MS)
+        bus_voltage = (SUPPLY_VOLTAGE * 1000 // 4) << 3
+        hal_sim.set_register(INA219_ADDRESS, _REG_BUS_VOLTAGE, bus_voltage.to_bytes(2, 'big'))
+        self._update_sensors(0)
+        self._timer = hal_sim.Timer(-1)
+        self._timer.init(period=STEP_MS, callback=self.step)
+
+    def stop(self):
+        self._timer.deinit()
+
+    def _noise(self):
+        # Linear congruential generator, returns value in <-1, 1)
+        self._seed = (self._seed * 1103515245 + 12345) & 0x7FFFFFFF
+        return self._seed / 0x40000000 - 1
+
+    def step(self, _=None):
+        dt = STEP_MS / 1000
+
+        direction = hal_sim.level(settings.ACTUATOR_IN1_PIN) - hal_sim.level(settings.ACTUATOR_IN2_PIN)
+        current = 0
+        if direction:
+            position = self.position + direction * settings.ACTUATOR_LENGTH * dt / ACTUATOR_TRAVEL_TIME
+            self.position = min(max(position, 0), settings.ACTUATOR_LENGTH)
+            if 0 < self.position < settings.ACTUATOR_LENGTH:
+                current = ACTUATOR_CURRENT * (1 + ACTUATOR_CURRENT_NOISE * self._noise())
+
+        duty = hal_sim.duty(settings.FAN_PWM_PIN) * 100 / MAX_DUTY_VALUE
+        self._pulses += FAN_MAX_RPM * duty / 100 * TACH_PULSES_PER_REVOLUTION * dt / 60
+        pulses = int(self._pulses)
+        self._pulses -= pulses
+        hal_sim.pulse(settings.FAN_TACH_PIN, pulses)
+
+        load = PROJECTOR_LOAD if hal_sim.level(settings.USB_TRIGGER_PIN) else 0
+        cooling = (H_PASSIVE + H_FANS * duty / 100) * (self.temp - T_AMBIENT)
+        self.temp += (load - cooling) * dt / HEAT_CAPACITY
+
+        self._update_sensors(current)
+
+    def _update_sensors(self, current):
+        reading = int(self.position / settings.ACTUATOR_LENGTH * MAX_ADC_VALUE)
+        hal_sim.set_analog(settings.POSITION_ADC_PIN, min(reading, MAX_ADC_VALUE - 1))
+
+        # Registers as the INA219 computes them, the current register is scaled by the written calibration
+        shunt_voltage = current * CURRENT_SENSOR_SHUNT_OHMS
+        calibration = hal_sim.register(INA219_ADDRESS, _REG_CALIBRATION)
+        calibration = int.from_bytes(calibration, 'big') if calibration else 0
+        hal_sim.set_register(INA219_ADDRESS, _REG_SHUNT_VOLTAGE, int(shunt_voltage / 0.00001).to_bytes(2, 'big'))
+        hal_sim.set_register(INA219_ADDRESS, _REG_CURRENT,
+                             int(shunt_voltage * calibration / 0.04096).to_bytes(2, 'big'))
+
+        # DS18X20 has resolution of 1/16 °C
+        hal_sim.set_temperature(settings.TEMP_PIN, CABINET_SENSOR_ROM, round(self.temp * 16) / 16)
+        hal_sim.set_temperature(settings.TEMP_PIN, INTAKE_SENSOR_ROM, T_AMBIENT)
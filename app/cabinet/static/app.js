@@ -0,0 +1,94 @@
+"use strict";
+
+function showMessage(level, text) {
+    const alert = document.createElement("div");
+    alert.className = "alert alert-" + level;
+    alert.setAttribute("role", "alert");
+    alert.textContent = text;
+    document.getElementById("messages").replaceChildren(alert);
+}
+
+function renderSettings(settings) {
+    const fields = document.getElementById("fields");
+    fields.replaceChildren();
+    for (const [key, value] of Object.entries(settings)) {
+        const group = document.createElement("div");
+        group.className = "mb-3";
+
+        const label = document.createElement("label");
+        label.className = "form-label";
+        label.htmlFor = key;
+        label.textContent = key[0].toUpperCase() + key.replaceAll("_", " ").slice(1);
+
+        const input = document.createElement("input");
+        input.className = "form-control";
+        input.type = "text";
+        input.id = key;
+        input.name = key;
+        input.value = value;
+
+        group.append(label, input);
+        fields.append(group);
+    }
+}
+
+async function api(method, path, body) {
+    const response = await fetch(path, {method, body});
+    if (!response.ok) {
+        throw new Error(path + " failed with " + response.status);
+    }
+    return response.status === 204 ? null : response.json();
+}
+
+async function loadSettings() {
+    const data = await api("GET", "/api/settings");
+    renderSettings(data.settings);
+}
+
+async function saveSettings(event) {
+    event.preventDefault();
+    const data = await api("POST", "/api/settings", new URLSearchParams(new FormData(event.target)));
+    renderSettings(data.settings);
+    if (data.errors.length) {
+        showMessage("danger", data.errors.join("; "));
+    } else {
+        showMessage("success", "Configuration updated!");
+    }
+}
+
+let telemetry = null;
+
+function toggleTelemetry(event) {
+    const button = event.target;
+    if (telemetry) {
+        telemetry.close();
+        telemetry = null;
+        button.textContent = "Start";
+        return;
+    }
+    telemetry = new EventSource("/telemetry");
+    telemetry.onmessage = (e) => {
+        const sample = JSON.parse(e.data);
+        for (const key of ["position", "current", "direction", "temperature"]) {
+            document.getElementById("t-" + key).textContent = sample[key];
+        }
+    };
+    button.textContent = "Stop";
+}
+
+function handleErrors(handler) {
+    return (event) => handler(event).catch((error) => showMessage("danger", error.message));
+}
+
+document.getElementById("settings").addEventListener("submit", handleErrors(saveSettings));
+document.getElementById("telemetry").addEventListener("click", toggleTelemetry);
+document.getElementById("trigger").addEventListener("click", handleErrors(async () => {
+    await api("POST", "/api/trigger");
+    showMessage("primary", "Actuator is going for it!");
+}));
+document.getElementById("reboot").addEventListener("click", handleErrors(async () => {
+    await api("POST", "/api/reboot");
+    showMessage("warning", "Cabinet is restarting!");
+}));
+
+handleErrors(loadSettings)();
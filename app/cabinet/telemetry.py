@@ -0,0 +1,93 @@
+import uasyncio as asyncio
+import ulogging as logging
+from utime import ticks_ms
+
+import uhttpd
+from cabinet import cabinet
+from cabinet.actuator import MovingDirection
+from utils import singleton
+
+TELEMETRY_IDLE_PERIOD_MS = 500
+"""
+Sampling period while the actuator does not move. During a move, sample is taken whenever
+the obstacle detection measures the current (see `actuator_current_monitoring_interval`).
+"""
+
+TELEMETRY_BUFFER_SIZE = 16
+"""
+Number of samples kept for clients. A client lagging more than this skips to the newest sample.
+"""
+
+TELEMETRY_MAX_CLIENTS = 4
+
+
+@singleton
+class Telemetry:
+    """
+    Samples the actuator and temperature into a ring buffer shared by all streaming clients.
+    The current is not measured here, the sample carries the last one measured by the actuator.
+    Sampling runs only while some client is connected. Every client reads the buffer at its own pace,
+    so a slow client only misses samples and never delays the sampler or the control loop.
+    """
+
+    def __init__(self):
+        self._cabinet = cabinet.Cabinet()
+        self._samples = [None] * TELEMETRY_BUFFER_SIZE
+        self._seq = 0  # Sequence number of the next sample
+        self._new_sample = asyncio.Event()
+        self._clients = 0
+        self._task = None
+        self._log = logging.getLogger('Telemetry')
+
+    def _sample(self):
+        actuator = self._cabinet.actuator
+        return '{"t":%d,"position":%.1f,"current":%.1f,"direction":"%s","temperature":%s}' % (
+            ticks_ms(), actuator.get_position(), actuator.last_current, actuator.get_direction(),
+            'null' if self._cabinet.last_temp is None else self._cabinet.last_temp)
+
+    async def _run(self):
+        actuator = self._cabinet.actuator
+        try:
+            while self._clients:
+                self._samples[self._seq % TELEMETRY_BUFFER_SIZE] = self._sample()
+                self._seq += 1
+                # Setting the event schedules all waiting clients, so it can be cleared right away
+                self._new_sample.set()
+                self._new_sample.clear()
+                if actuator.get_direction() == MovingDirection.NONE:
+                    await asyncio.sleep_ms(TELEMETRY_IDLE_PERIOD_MS)
+                else:
+                    await actuator.current_sampled.wait()
+        finally:
+            self._task = None
+
+    async def stream(self, writer):
+        """
+        Streams the samples as Server-Sent Events until the client disconnects.
+        """
+        if self._clients >= TELEMETRY_MAX_CLIENTS:
+            await uhttpd.send(writer, b'', 429, None)
+            return
+
+        self._clients += 1
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+        try:
+            await uhttpd.start_response(writer, content_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+            seq = self._seq
+            while True:
+                if seq == self._seq:
+                    await self._new_sample.wait()
+                if self._seq - seq > TELEMETRY_BUFFER_SIZE:
+                    seq = self._seq - 1
+
+                writer.write('data: ')
+                writer.write(self._samples[seq % TELEMETRY_BUFFER_SIZE])
+                writer.write('\n\n')
+                seq += 1
+                await writer.drain()
+        except OSError:
+            self._log.debug('Client disconnected')
+        finally:
+            self._clients -= 1
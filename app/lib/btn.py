@@ -4,13 +4,9 @@
 # Released under the MIT License (MIT) - see LICENSE file
 
 import uasyncio as asyncio
+from utime import ticks_add, ticks_diff, ticks_ms
 from utils import Delay_ms, launch
 
-try:
-    from machine import TouchPad
-except ImportError:
-    pass
-
 
 class Pushbutton:
     debounce_ms = 50
@@ -128,3 +124,33 @@ class Pushbutton:
 
     def deinit(self):
         self._run.cancel()
+
+
+# Variant of the Pushbutton which does not poll the pin. The pin's IRQ wakes up the task
+# so an idle button costs no CPU time. Debouncing is done by timestamp of the last edge:
+# the state is sampled only once the contact did not bounce for `debounce_ms`.
+class IrqPushbutton(Pushbutton):
+    def __init__(self, pin, suppress=False, sense=None):
+        self._flag = asyncio.ThreadSafeFlag()
+        self._edge = ticks_ms()  # Time of the last edge
+        super().__init__(pin, suppress, sense)
+        pin.irq(self._irq, pin.IRQ_RISING | pin.IRQ_FALLING)
+
+    def _irq(self, _):  # May run as hard ISR: no allocations
+        self._edge = ticks_ms()
+        self._flag.set()
+
+    async def _go(self):
+        while True:
+            await self._flag.wait()
+            # Every bounce moves the edge timestamp, so wait until the pin settles
+            while True:
+                dt = ticks_diff(ticks_add(self._edge, Pushbutton.debounce_ms), ticks_ms())
+                if dt <= 0:
+                    break
+                await asyncio.sleep_ms(dt)
+            self._check(self.rawstate())
+
+    def deinit(self):
+        self._pin.irq(handler=None)
+        super().deinit()
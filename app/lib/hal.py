@@ -0,0 +1,21 @@
+"""
+Hardware abstraction layer.
+
+All the hardware access of the firmware (pins, ADC, PWM, I2C, OneWire, timers, RTC, WiFi and reset)
+goes through this module, so the firmware does not depend on the ESP32. The backend is chosen by the
+platform: on the ESP32 (`hal_esp32`) the names are directly the classes and functions of `machine`,
+`onewire`, `ds18x20` and `network`, so the layer costs nothing. Anywhere else (the unix port) the simulated
+backend `hal_sim` is used, which lets the whole application boot on a Linux host.
+
+    import hal
+    led = hal.Pin(2, hal.Pin.OUT)
+
+MIT license; Copyright (c) 2023 Adam Uhlir
+"""
+
+import sys
+
+if sys.platform == 'esp32':
+    from hal_esp32 import *
+else:
+    from hal_sim import *
@@ -0,0 +1,14 @@
+"""
+ESP32 backend of `hal`. Re-exports the MicroPython's own drivers without any wrapping.
+"""
+
+from machine import Pin, ADC, PWM, SoftI2C, Timer, RTC, disable_irq, enable_irq, reset, unique_id
+from onewire import OneWire
+from ds18x20 import DS18X20
+from network import WLAN, STA_IF, STAT_CONNECTING
+
+SIMULATED = False
+FS_ROOT = ''
+"""
+Prefix of the absolute paths of the firmware's files (`FS_ROOT + '/app'`)
+"""
@@ -0,0 +1,278 @@
+"""
+Simulated backend of `hal` for running the firmware on the unix port.
+
+The peripherals keep their state in the module level registers below. A model of the device (like
+`cabinet/simulation.py`) reads the outputs (pin levels, PWM duty cycles) and drives the inputs (pin levels
+and edges, ADC readings, I2C registers, temperatures) with the functions at the end of this module.
+Nothing here depends on the host's clock or randomness, so the same calls always give the same readings.
+
+Interrupt handlers are called synchronously by the model from the event loop, so `disable_irq()`
+has nothing to disable. `reset()` ends the process and WiFi is always connected through the host's network.
+
+MIT license; Copyright (c) 2023 Adam Uhlir
+"""
+
+import sys
+import uasyncio as asyncio
+
+SIMULATED = True
+FS_ROOT = '.'
+"""
+Files of the firmware are used from the current directory, which should be the repository's root
+"""
+
+STA_IF = 0
+STAT_CONNECTING = 1001
+STAT_GOT_IP = 1010
+
+_levels = {}  # Pin id -> 0 or 1
+_irqs = {}  # Pin id -> (handler, trigger, pin)
+_analog = {}  # Pin id -> ADC reading
+_duty = {}  # Pin id -> PWM duty cycle
+_registers = {}  # (I2C address, register) -> bytes
+_temperatures = {}  # OneWire pin id -> {ROM: temperature}
+_rtc_memory = b''
+
+
+class Pin:
+    IN = 1
+    OUT = 3
+    OPEN_DRAIN = 7
+    PULL_DOWN = 1
+    PULL_UP = 2
+    IRQ_RISING = 1
+    IRQ_FALLING = 2
+
+    def __init__(self, pin_id, mode=-1, pull=-1, value=None):
+        self.id = pin_id
+        if value is not None:
+            _levels[pin_id] = 1 if value else 0
+        elif pin_id not in _levels:
+            _levels[pin_id] = 1 if pull == Pin.PULL_UP else 0
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+    def value(self, value=None):
+        if value is None:
+            return _levels[self.id]
+        set_level(self.id, value)
+
+    def on(self):
+        set_level(self.id, 1)
+
+    def off(self):
+        set_level(self.id, 0)
+
+    def irq(self, handler=None, trigger=3, hard=False):
+        if handler is None:
+            _irqs.pop(self.id, None)
+        else:
+            _irqs[self.id] = (handler, trigger, self)
+
+
+class ADC:
+    ATTN_0DB = 0
+    ATTN_2_5DB = 1
+    ATTN_6DB = 2
+    ATTN_11DB = 3
+
+    def __init__(self, pin, atten=ATTN_0DB):
+        self._id = pin.id
+
+    def read_u16(self):
+        return _analog.get(self._id, 0)
+
+
+class PWM:
+    def __init__(self, pin, freq=5000, duty_u16=0):
+        self._id = pin.id
+        self._freq = freq
+        _duty[self._id] = duty_u16
+
+    def freq(self, value=None):
+        if value is None:
+            return self._freq
+        self._freq = value
+
+    def duty_u16(self, value=None):
+        if value is None:
+            return _duty[self._id]
+        _duty[self._id] = value
+
+    def deinit(self):
+        _duty[self._id] = 0
+
+
+class SoftI2C:
+    """
+    Registers that were never written read as zeros, so every address answers.
+    """
+
+    def __init__(self, scl, sda, freq=400_000, timeout=50_000):
+        pass
+
+    def readfrom_mem(self, addr, memaddr, nbytes):
+        data = _registers.get((addr, memaddr), b'')
+        return data[:nbytes] + bytes(nbytes - len(data))
+
+    def writeto_mem(self, addr, memaddr, buf):
+        _registers[(addr, memaddr)] = bytes(buf)
+
+
+class OneWire:
+    def __init__(self, pin):
+        self.pin_id = pin.id
+
+    def scan(self):
+        return [bytearray(rom) for rom in sorted(_temperatures.get(self.pin_id, ()))]
+
+
+class DS18X20:
+    def __init__(self, onewire):
+        self._ow = onewire
+        self._converted = {}
+
+    def scan(self):
+        return [rom for rom in self._ow.scan() if rom[0] in (0x10, 0x22, 0x28)]
+
+    def convert_temp(self):
+        # Sensors latch the temperature when converting, later changes are read only after next conversion
+        self._converted = dict(_temperatures.get(self._ow.pin_id, {}))
+
+    def read_temp(self, rom):
+        return self._converted[bytes(rom)]
+
+
+class Timer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, timer_id=-1, **kwargs):
+        self._task = None
+        if kwargs:
+            self.init(**kwargs)
+
+    def init(self, mode=PERIODIC, period=-1, callback=None):
+        self.deinit()
+        self._task = asyncio.create_task(self._run(mode, period, callback))
+
+    async def _run(self, mode, period, callback):
+        while True:
+            await asyncio.sleep_ms(period)
+            callback(self)
+            if mode == Timer.ONE_SHOT:
+                self._task = None
+                return
+
+    def deinit(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class RTC:
+    """
+    Memory is kept only while the process runs.
+    """
+
+    def memory(self, data=None):
+        global _rtc_memory
+        if data is None:
+            return _rtc_memory
+        _rtc_memory = bytes(data)
+
+
+class WLAN:
+    def __init__(self, interface=STA_IF):
+        pass
+
+    def active(self, value=None):
+        if value is None:
+            return True
+
+    def connect(self, ssid=None, key=None):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def isconnected(self):
+        return True
+
+    def status(self, param=None):
+        return STAT_GOT_IP
+
+    def config(self, *args, **kwargs):
+        pass
+
+    def ifconfig(self):
+        return '127.0.0.1', '255.0.0.0', '127.0.0.1', '127.0.0.1'
+
+
+def disable_irq():
+    return 0
+
+
+def enable_irq(state):
+    pass
+
+
+def reset():
+    print('=> Reset of the simulated hardware, exiting')
+    sys.exit(1)
+
+
+def unique_id():
+    return b'SIMCAB'
+
+
+# Model's side of the peripherals
+
+def level(pin_id):
+    return _levels.get(pin_id, 0)
+
+
+def set_level(pin_id, value):
+    """
+    Sets the level of the pin and calls its interrupt handler on the matching edge.
+    """
+    value = 1 if value else 0
+    previous = _levels.get(pin_id, 0)
+    _levels[pin_id] = value
+    irq = _irqs.get(pin_id)
+    if irq is not None and value != previous and irq[1] & (Pin.IRQ_RISING if value else Pin.IRQ_FALLING):
+        irq[0](irq[2])
+
+
+def pulse(pin_id, count=1):
+    """
+    Generates the falling edges of `count` pulses on the input pin (like the fans' tachometer).
+    """
+    irq = _irqs.get(pin_id)
+    if irq is not None and irq[1] & Pin.IRQ_FALLING:
+        for _ in range(count):
+            irq[0](irq[2])
+
+
+def duty(pin_id):
+    return _duty.get(pin_id, 0)
+
+
+def set_analog(pin_id, reading):
+    _analog[pin_id] = reading
+
+
+def register(addr, memaddr):
+    return _registers.get((addr, memaddr))
+
+
+def set_register(addr, memaddr, data):
+    _registers[(addr, memaddr)] = bytes(data)
+
+
+def set_temperature(pin_id, rom, temperature):
+    """
+    Adds the DS18X20 sensor with given ROM to the OneWire bus or updates its temperature.
+    """
+    _temperatures.setdefault(pin_id, {})[bytes(rom)] = temperature
@@ -0,0 +1,142 @@
+"""
+Event loop monitoring.
+
+The lag monitor is a task that repeatedly sleeps for a fixed interval and records how late it woke up.
+That is the time other tasks ran without yielding to the loop, so every other task (like the actuator's
+obstacle detection) can be delayed by the same amount.
+
+To find out which task is responsible, coroutines can be wrapped with `timed()`, which records the time
+spent in every step of the coroutine (between two awaits). Wrapping is enabled with `start(task_timing=True)`,
+otherwise `timed()` returns the coroutine unchanged so it costs nothing.
+
+MIT license; Copyright (c) 2023 Adam Uhlir
+"""
+
+import uarray as array
+import uasyncio as asyncio
+from micropython import const
+from utime import ticks_us, ticks_diff
+
+LAG_INTERVAL_MS = const(100)
+LAG_SAMPLES = const(256)
+LAG_BUCKETS_MS = (1, 5, 10, 50, 100, 500)
+"""
+Upper bounds of the lag histogram buckets, the last bucket counts the lags above the last bound
+"""
+
+_samples = array.array('i', bytes(4 * LAG_SAMPLES))  # Ring of the lags in microseconds
+_count = 0
+_max_lag = 0
+_task = None
+_task_timing = False
+_tasks = {}  # name -> [steps, total us, max us]
+
+
+def start(task_timing=False):
+    global _task, _task_timing
+    _task_timing = task_timing
+    if _task is None:
+        _task = asyncio.create_task(_monitor())
+
+
+async def _monitor():
+    global _count, _max_lag
+    while True:
+        before = ticks_us()
+        await asyncio.sleep_ms(LAG_INTERVAL_MS)
+        lag = ticks_diff(ticks_us(), before) - LAG_INTERVAL_MS * 1000
+        if lag < 0:
+            lag = 0
+        _samples[_count % LAG_SAMPLES] = lag
+        _count += 1
+        if lag > _max_lag:
+            _max_lag = lag
+
+
+def timed(name, coro):
+    """
+    Wraps the coroutine to record time of its steps under the name. Use as:
+
+        asyncio.create_task(loopmon.timed('mqtt.read_temp', self._read_temp()))
+    """
+    if not _task_timing:
+        return coro
+
+    stats = _tasks.get(name)
+    if stats is None:
+        stats = _tasks[name] = [0, 0, 0]
+    return _timed(coro, stats)
+
+
+def _timed(coro, stats):
+    # In MicroPython coroutines are generators, so the wrapper drives the coroutine step by step
+    # and passes the values (and exceptions like CancelledError) between it and the loop.
+    value = None
+    error = None
+    while True:
+        start = ticks_us()
+        try:
+            if error is None:
+                request = coro.send(value)
+            else:
+                request = coro.throw(error)
+        except StopIteration as e:
+            _record(stats, ticks_diff(ticks_us(), start))
+            return e.value
+        except BaseException:
+            _record(stats, ticks_diff(ticks_us(), start))
+            raise
+        _record(stats, ticks_diff(ticks_us(), start))
+
+        value = None
+        error = None
+        try:
+            value = yield request
+        except BaseException as e:
+            error = e
+
+
+def _record(stats, elapsed):
+    stats[0] += 1
+    stats[1] += elapsed
+    if elapsed > stats[2]:
+        stats[2] = elapsed
+
+
+def stats(reset=True):
+    """
+    Returns dict with the lag percentiles, maximum (in milliseconds) and histogram (counts of the lags
+    per LAG_BUCKETS_MS) over the last samples and the task with the longest step.
+    With `reset` the maximums and task statistics start over.
+    """
+    global _max_lag
+    n = _count if _count < LAG_SAMPLES else LAG_SAMPLES
+    lags = sorted(_samples[:n]) if n else [0]
+    histogram = [0] * (len(LAG_BUCKETS_MS) + 1)
+    bucket = 0
+    for lag in lags[:n]:  # Sorted, so the buckets are filled in order
+        while bucket < len(LAG_BUCKETS_MS) and lag > LAG_BUCKETS_MS[bucket] * 1000:
+            bucket += 1
+        histogram[bucket] += 1
+    res = {
+        'p50': lags[len(lags) // 2] / 1000,
+        'p99': lags[min(len(lags) - 1, len(lags) * 99 // 100)] / 1000,
+        'max': _max_lag / 1000,
+        'histogram': histogram,
+    }
+
+    worst = None
+    for name, (steps, total, longest) in _tasks.items():
+        if steps and (worst is None or longest > _tasks[worst][2]):
+            worst = name
+    if worst is not None:
+        steps, total, longest = _tasks[worst]
+        res['worst_task'] = worst
+        res['worst_task_max'] = longest / 1000
+        res['worst_task_avg'] = total / steps / 1000
+
+    if reset:
+        _max_lag = 0
+        for task_stats in _tasks.values():
+            task_stats[0] = task_stats[1] = task_stats[2] = 0
+    return res
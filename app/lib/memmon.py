@@ -0,0 +1,89 @@
+"""
+Heap monitoring.
+
+Besides the free and allocated heap it checks whether a block of given size can still be allocated,
+which is what decides whether a bigger allocation (like an MQTT packet or a download buffer) succeeds.
+Fragmented heap has plenty of free memory but only small free blocks.
+
+MicroPython prints the heap details of `micropython.mem_info()` only to the console, so the exact largest
+free block is found by `largest_free_block()` with a binary search of the biggest allocation that succeeds.
+That costs roughly log2(free / 16) allocations, every failed one running a collection, so `stats()`
+measures it only when asked to and reports the last measured value otherwise. The low heap check tries
+only a single allocation of the required size on every call.
+
+MIT license; Copyright (c) 2023 Adam Uhlir
+"""
+
+import gc
+
+_BLOCK = 16  # Allocation granularity of the MicroPython's heap
+
+_min_free = None
+_largest = None
+
+
+def apply_gc_policy(fraction=4):
+    """
+    Sets `gc.threshold` to collect once `1/fraction` of the currently free heap gets allocated, so the
+    collections run sooner and take shorter than when the heap gets exhausted. `None` disables the threshold.
+    """
+    if fraction is None:
+        gc.threshold(-1)
+    else:
+        gc.collect()
+        gc.threshold(gc.mem_free() // fraction + gc.mem_alloc())
+
+
+def largest_free_block():
+    """
+    Returns size of the largest free block in bytes. Slow, see the module's description.
+    """
+    gc.collect()
+    low = 0
+    high = gc.mem_free() // _BLOCK
+    while low < high:
+        mid = (low + high + 1) // 2
+        try:
+            block = bytearray(mid * _BLOCK - _BLOCK)  # Leaves space for the object's header
+            del block
+            low = mid
+        except MemoryError:
+            high = mid - 1
+    return low * _BLOCK
+
+
+def _fits(size):
+    # Heap was just collected, so the failed allocation collects it only once more
+    try:
+        block = bytearray(size)
+        del block
+        return True
+    except MemoryError:
+        return False
+
+
+def stats(low_water=0, low_largest=0, measure_largest=False):
+    """
+    Returns dict with free and allocated heap, whether a block of `low_largest` bytes can be allocated,
+    the largest free block (last measured one, when `measure_largest` is not set) and the lowest free heap
+    seen by the calls. `low` is set when free heap is under `low_water` or the block does not fit.
+    """
+    global _min_free, _largest
+    gc.collect()
+    free = gc.mem_free()
+    alloc = gc.mem_alloc()
+    fits = _fits(low_largest) if low_largest else True
+    if measure_largest:
+        _largest = largest_free_block()
+
+    if _min_free is None or free < _min_free:
+        _min_free = free
+
+    return {
+        'free': free,
+        'alloc': alloc,
+        'block_fits': fits,
+        'largest': _largest,
+        'min_free': _min_free,
+        'low': free < low_water or not fits,
+    }
@@ -19,8 +19,7 @@ from uerrno import EINPROGRESS, ETIMEDOUT
 
 gc.collect()
 from micropython import const
-from machine import unique_id
-import network
+from hal import unique_id, WLAN, STA_IF, STAT_CONNECTING
 
 gc.collect()
 from sys import platform
@@ -166,7 +165,7 @@ class MQTT_base:
         if self.server is None:
             raise ValueError("no server specified.")
         self._sock = None
-        self._sta_if = network.WLAN(network.STA_IF)
+        self._sta_if = WLAN(STA_IF)
         self._sta_if.active(True)
 
         self.newpid = pid_gen()
@@ -184,7 +183,7 @@ class MQTT_base:
         self._lw_retain = retain
 
     def dprint(self, msg, *args):
-        self._logger.debug(msg % args)
+        self._logger.debug(msg, *args)
 
     def _timeout(self, t):
         return ticks_diff(ticks_ms(), t) > self._response_time
@@ -573,7 +572,7 @@ class MQTTClient(MQTT_base):
             if s.isconnected():
                 break
             if ESP32:
-                if s.status() != network.STAT_CONNECTING:  # 1001
+                if s.status() != STAT_CONNECTING:  # 1001
                     break
             elif PYBOARD:  # No symbolic constants in network
                 if not 1 <= s.status() <= 2:
@@ -594,19 +593,19 @@ class MQTTClient(MQTT_base):
             s.connect()  # ESP8266 remembers connection.
             for _ in range(60):
                 if (
-                    s.status() != network.STAT_CONNECTING
+                    s.status() != STAT_CONNECTING
                 ):  # Break out on fail or success. Check once per sec.
                     break
                 await asyncio.sleep(1)
             if (
-                s.status() == network.STAT_CONNECTING
+                s.status() == STAT_CONNECTING
             ):  # might hang forever awaiting dhcp lease renewal or something else
                 s.disconnect()
                 await asyncio.sleep(1)
             if not s.isconnected() and self._ssid is not None and self._wifi_pw is not None:
                 s.connect(self._ssid, self._wifi_pw)
                 while (
-                    s.status() == network.STAT_CONNECTING
+                    s.status() == STAT_CONNECTING
                 ):  # Break out on fail or success. Check once per sec.
                     await asyncio.sleep(1)
         else:
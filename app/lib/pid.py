@@ -0,0 +1,46 @@
+# Plain Python (no MicroPython specific imports), so it can be also used by host tools.
+
+
+class PID:
+    """
+    PID controller with output limits. The integral term is frozen while the output is saturated
+    in the direction of the error (conditional integration), so it does not wind up.
+    """
+
+    def __init__(self, kp, ki, kd, out_min=0, out_max=100):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.out_min = out_min
+        self.out_max = out_max
+        self.reset()
+
+    def reset(self):
+        self._integral = 0.0
+        self._last_error = None
+
+    def update(self, error, dt):
+        """
+        Returns output for the error (setpoint - measured value, or the reverse for
+        reverse acting processes like cooling) measured `dt` seconds after the previous one.
+        """
+        derivative = 0.0
+        if self._last_error is not None and dt > 0:
+            derivative = (error - self._last_error) / dt
+        self._last_error = error
+
+        integral = self._integral + error * dt
+        output = self.kp * error + self.ki * integral + self.kd * derivative
+
+        if output > self.out_max:
+            output = self.out_max
+            if error < 0:
+                self._integral = integral
+        elif output < self.out_min:
+            output = self.out_min
+            if error > 0:
+                self._integral = integral
+        else:
+            self._integral = integral
+
+        return output
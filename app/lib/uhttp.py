@@ -0,0 +1,200 @@
+"""
+Minimal asynchronous HTTP(S) client built on top of uasyncio streams.
+
+Unlike `urequests` it never blocks the event loop while waiting for the network,
+as every read is awaited on the stream and bounded by a timeout.
+
+MIT license; Copyright (c) 2023 Adam Uhlir
+"""
+
+import sys
+import uasyncio as asyncio
+from micropython import const
+
+DEFAULT_TIMEOUT_MS = const(10_000)
+MAX_REDIRECTS = const(5)
+
+_REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+_NATIVE_TLS = sys.implementation.version >= (1, 21)
+"""
+`open_connection` accepts `ssl` argument only since MicroPython v1.21
+"""
+
+
+class HTTPError(Exception):
+    pass
+
+
+class Response:
+    def __init__(self, reader, writer, status, headers, timeout_ms):
+        self._reader = reader
+        self._writer = writer
+        self._timeout_ms = timeout_ms
+        self.status = status
+        self.headers = headers
+
+        length = headers.get('content-length')
+        try:
+            self.content_length = None if length is None else int(length)
+        except ValueError:
+            raise HTTPError(f'Invalid Content-Length: {length}')
+        self._remaining = self.content_length
+
+    async def readinto(self, buf):
+        """
+        Reads the body into the passed buffer and returns number of bytes read.
+        Returns 0 when the whole body was consumed.
+        """
+        if self._remaining == 0:
+            return 0
+
+        if self._remaining is not None and len(buf) > self._remaining:
+            buf = memoryview(buf)[:self._remaining]
+
+        n = await asyncio.wait_for_ms(self._reader.readinto(buf), self._timeout_ms)
+        if not n:
+            if self._remaining:
+                raise HTTPError('Connection closed before whole body was received')
+            return 0
+
+        if self._remaining is not None:
+            self._remaining -= n
+        return n
+
+    async def read(self):
+        """
+        Reads the whole body. Intended only for small payloads like JSON responses.
+        """
+        if self._remaining is None:
+            return await asyncio.wait_for_ms(self._reader.read(-1), self._timeout_ms)
+
+        data = await asyncio.wait_for_ms(self._reader.readexactly(self._remaining), self._timeout_ms)
+        self._remaining = 0
+        return data
+
+    async def json(self):
+        import ujson
+        return ujson.loads(await self.read())
+
+    async def close(self):
+        self._writer.close()
+        await self._writer.wait_closed()
+
+
+def _parse_url(url):
+    try:
+        proto, _, host, path = url.split('/', 3)
+    except ValueError:
+        proto, _, host = url.split('/', 2)
+        path = ''
+
+    if proto == 'http:':
+        port = 80
+    elif proto == 'https:':
+        port = 443
+    else:
+        raise ValueError('Unsupported protocol: ' + proto)
+
+    if ':' in host:
+        host, port = host.split(':', 1)
+        port = int(port)
+
+    return proto == 'https:', host, port, '/' + path
+
+
+async def _read_head(reader, timeout_ms):
+    line = await asyncio.wait_for_ms(reader.readline(), timeout_ms)
+    parts = line.split(None, 2)
+    if len(parts) < 2 or not parts[0].startswith(b'HTTP/'):
+        raise HTTPError(f'Invalid status line: {line}')
+    try:
+        status = int(parts[1])
+    except ValueError:
+        raise HTTPError(f'Invalid status line: {line}')
+
+    headers = {}
+    while True:
+        line = await asyncio.wait_for_ms(reader.readline(), timeout_ms)
+        if not line or line == b'\r\n':
+            break
+        try:
+            key, _, value = line.decode().partition(':')
+        except UnicodeError:
+            raise HTTPError('Invalid header line')
+        headers[key.strip().lower()] = value.strip()
+
+    return status, headers
+
+
+async def _open_tls_connection(host, port):
+    if _NATIVE_TLS:
+        return await asyncio.open_connection(host, port, ssl=True)
+
+    import ussl
+
+    # The handshake is deferred to the first read/write, which the non-blocking stream retries until it is done
+    stream, _ = await asyncio.open_connection(host, port)
+    try:
+        sock = ussl.wrap_socket(stream.s, server_hostname=host, do_handshake=False)
+    except BaseException:
+        await stream.wait_closed()
+        raise
+    stream = asyncio.StreamReader(sock)
+    return stream, stream
+
+
+async def request(method, url, headers=None, timeout_ms=DEFAULT_TIMEOUT_MS, redirects=MAX_REDIRECTS):
+    """
+    Performs HTTP/1.0 request (so no chunked transfer encoding has to be handled) and returns
+    `Response` once the status line and headers are received. The caller is responsible
+    for closing the response.
+
+    Redirects are followed up to the `redirects` limit.
+    """
+    use_ssl, host, port, path = _parse_url(url)
+
+    try:
+        if use_ssl:
+            reader, writer = await asyncio.wait_for_ms(_open_tls_connection(host, port), timeout_ms)
+        else:
+            reader, writer = await asyncio.wait_for_ms(asyncio.open_connection(host, port), timeout_ms)
+    except (TypeError, ValueError) as e:  # TLS not supported by the firmware
+        raise HTTPError(f'Failed to connect to {host}:{port}: {e}')
+
+    try:
+        writer.write(f'{method} {path} HTTP/1.0\r\nHost: {host}\r\n'.encode())
+        if headers:
+            for key, value in headers.items():
+                writer.write(f'{key}: {value}\r\n'.encode())
+        writer.write(b'\r\n')
+        await asyncio.wait_for_ms(writer.drain(), timeout_ms)
+
+        status, response_headers = await _read_head(reader, timeout_ms)
+    except BaseException:
+        writer.close()
+        await writer.wait_closed()
+        raise
+
+    if status in _REDIRECT_STATUSES and 'location' in response_headers:
+        writer.close()
+        await writer.wait_closed()
+
+        if redirects <= 0:
+            raise HTTPError('Too many redirects')
+
+        try:
+            return await request(method, response_headers['location'], headers, timeout_ms, redirects - 1)
+        except ValueError:  # Unparsable location
+            raise HTTPError(f'Invalid redirect location: {response_headers["location"]}')
+
+    try:
+        return Response(reader, writer, status, response_headers, timeout_ms)
+    except HTTPError:
+        writer.close()
+        await writer.wait_closed()
+        raise
+
+
+async def get(url, headers=None, timeout_ms=DEFAULT_TIMEOUT_MS):
+    return await request('GET', url, headers, timeout_ms)
@@ -0,0 +1,344 @@
+"""
+Minimal HTTP/1.0 server built on top of `uasyncio.start_server`.
+
+Requests are read line by line through a fixed buffer and responses are streamed in chunks,
+so the memory needed by a request does not depend on the size of the served page nor on what
+the client sends. The heap is bounded by:
+
+ - MAX_CONNECTIONS concurrently handled connections (others get 503 right away); long-lived
+   streaming routes are not counted once their request was read and limit their clients themselves
+ - MAX_LINE_SIZE of the request line and of each header, longer lines are rejected with 400
+   (only headers in KEPT_HEADERS are kept)
+ - MAX_BODY_SIZE of the request body (only urlencoded forms are parsed)
+
+With the defaults a request costs at most ~4 kB on top of the stream objects
+(see "Memory budget" in README.md).
+
+MIT license; Copyright (c) 2023 Adam Uhlir
+"""
+
+import uasyncio as asyncio
+import ulogging as logging
+import uzlib
+from micropython import const
+
+MAX_CONNECTIONS = const(2)
+MAX_LINE_SIZE = const(512)
+MAX_BODY_SIZE = const(2048)
+REQUEST_TIMEOUT_MS = const(5_000)
+GZIP_WINDOW_BITS = const(10)
+"""
+Window of the pre-gzipped files (see tools/build_static.py), allocated when decompressing them
+"""
+
+KEPT_HEADERS = ('content-length', 'if-none-match', 'accept-encoding')
+"""
+Headers used by the server and the handlers, the others are dropped while reading the request
+"""
+
+_STATUSES = {
+    200: 'OK',
+    204: 'No Content',
+    304: 'Not Modified',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    406: 'Not Acceptable',
+    413: 'Payload Too Large',
+    429: 'Too Many Requests',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable',
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+def unquote(s):
+    s = s.replace('+', ' ')
+    if '%' not in s:
+        return s
+
+    parts = s.split('%')
+    res = bytearray(parts[0].encode())
+    for part in parts[1:]:
+        try:
+            res.append(int(part[:2], 16))
+            res.extend(part[2:].encode())
+        except ValueError:
+            res.extend(b'%' + part.encode())
+    return res.decode()
+
+
+def parse_qs(s):
+    res = {}
+    for pair in s.split('&'):
+        if not pair:
+            continue
+        key, _, value = pair.partition('=')
+        res[unquote(key)] = unquote(value)
+    return res
+
+
+class Request:
+    def __init__(self, reader, method, path, query, headers):
+        self.reader = reader
+        self.method = method
+        self.path = path
+        self.query = query
+        """
+        Parsed query string
+        """
+        self.headers = headers
+        """
+        Request's headers with lowercased keys
+        """
+
+    async def form(self):
+        """
+        Reads and parses urlencoded body of the request.
+        """
+        length = int(self.headers.get('content-length', 0))
+        if length > MAX_BODY_SIZE:
+            raise HTTPError(413)
+        if not length:
+            return {}
+
+        body = await asyncio.wait_for_ms(self.reader.readexactly(length), REQUEST_TIMEOUT_MS)
+        return parse_qs(body.decode())
+
+
+class _Reader:
+    """
+    Reads the request head through a buffer of MAX_LINE_SIZE, so no line is allocated before
+    its length is checked. Data buffered past the head are returned first by `readexactly`.
+    """
+
+    def __init__(self, reader):
+        self._reader = reader
+        self._buf = bytearray(MAX_LINE_SIZE)
+        self._mv = memoryview(self._buf)
+        self._start = 0  # Unread data are buf[start:end]
+        self._end = 0
+
+    async def readline(self):
+        """
+        Returns the next line without its terminator, None at the end of the stream.
+        Raises HTTPError(400) for line that does not fit the buffer.
+        """
+        buf = self._buf
+        i = self._start
+        while True:
+            while i < self._end:
+                if buf[i] == 10:  # \n
+                    end = i - 1 if i > self._start and buf[i - 1] == 13 else i  # Without \r
+                    try:
+                        line = str(buf[self._start:end], 'utf-8')
+                    except UnicodeError:
+                        raise HTTPError(400)
+                    self._start = i + 1
+                    return line
+
+                i += 1
+
+            if self._start:  # Moves the partial line to the start to make room for the rest
+                n = self._end - self._start
+                buf[:n] = self._mv[self._start:self._end]
+                self._start = 0
+                i = self._end = n
+            if self._end == len(buf):
+                raise HTTPError(400)
+
+            n = await self._reader.readinto(self._mv[self._end:])
+            if not n:
+                return None
+            self._end += n
+
+    async def readexactly(self, n):
+        buffered = min(n, self._end - self._start)
+        data = bytes(self._mv[self._start:self._start + buffered])
+        self._start += buffered
+        if buffered < n:
+            data += await self._reader.readexactly(n - buffered)
+        return data
+
+
+async def _read_request(stream):
+    reader = _Reader(stream)
+    line = await reader.readline()
+    if line is None:
+        raise HTTPError(400)
+
+    parts = line.split()
+    if len(parts) != 3:
+        raise HTTPError(400)
+    method, target, _ = parts
+    path, _, query = target.partition('?')
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        key, _, value = line.partition(':')
+        key = key.strip().lower()
+        if key in KEPT_HEADERS:
+            headers[key] = value.strip()
+
+    return Request(reader, method, path, parse_qs(query), headers)
+
+
+async def start_response(writer, status=200, content_type='text/html', headers=None):
+    writer.write(f'HTTP/1.0 {status} {_STATUSES.get(status, "")}\r\n')
+    if content_type:
+        writer.write(f'Content-Type: {content_type}\r\n')
+    if headers:
+        for key, value in headers.items():
+            writer.write(f'{key}: {value}\r\n')
+    writer.write(b'\r\n')
+    await writer.drain()
+
+
+async def send(writer, body, status=200, content_type='text/html', headers=None):
+    """
+    Sends whole response with small in-memory body.
+    """
+    if isinstance(body, str):
+        body = body.encode()
+    hdrs = {'Content-Length': len(body)}
+    if headers:
+        hdrs.update(headers)
+    await start_response(writer, status, content_type, hdrs)
+    writer.write(body)
+    await writer.drain()
+
+
+async def stream(writer, chunks):
+    """
+    Writes the chunks produced by an iterable (like a compiled template) one by one,
+    waiting for each to be sent so only a single chunk is buffered at a time.
+    """
+    for chunk in chunks:
+        if chunk:
+            writer.write(chunk)
+            await writer.drain()
+
+
+async def send_file(writer, path, buf, content_type, headers=None):
+    """
+    Streams a file through the passed buffer, so no memory is allocated per chunk.
+    """
+    with open(path, 'rb') as f:
+        hdrs = {'Content-Length': f.seek(0, 2)}
+        f.seek(0)
+        if headers:
+            hdrs.update(headers)
+        await start_response(writer, 200, content_type, hdrs)
+        await _copy(writer, f, buf)
+
+
+async def _copy(writer, f, buf):
+    mv = memoryview(buf)
+    while True:
+        n = f.readinto(buf)
+        if not n:
+            break
+        writer.write(mv[:n])
+        await writer.drain()
+
+
+async def send_gzipped(request, writer, path, buf, content_type, etag):
+    """
+    Serves pre-gzipped static file which is validated by its ETag, so browsers
+    revalidating their cached copy get just the 304 response. Clients not accepting gzip
+    get the file decompressed.
+    """
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+    if request.headers.get('if-none-match') == etag:
+        await send(writer, b'', 304, None, headers)
+        return
+
+    if 'gzip' not in request.headers.get('accept-encoding', ''):
+        # Decompressed while sending, the length is not known upfront so the body ends by closing the connection
+        with open(path, 'rb') as f:
+            del headers['ETag']  # Belongs to the compressed representation
+            await start_response(writer, 200, content_type, headers)
+            await _copy(writer, uzlib.DecompIO(f, 16 + GZIP_WINDOW_BITS), buf)
+        return
+
+    headers['Content-Encoding'] = 'gzip'
+    await send_file(writer, path, buf, content_type, headers)
+
+
+class Server:
+    def __init__(self, max_connections=MAX_CONNECTIONS):
+        self._routes = {}
+        self._max_connections = max_connections
+        self._connections = 0
+        self._server = None
+        self._log = logging.getLogger('HTTP')
+
+    def route(self, path, methods=('GET',), streaming=False):
+        """
+        Decorator registering `async def handler(request, writer)` for the path.
+        Streaming handlers hold the connection open, so they do not occupy the connection slots.
+        """
+
+        def decorator(handler):
+            self._routes[path] = (methods, handler, streaming)
+            return handler
+
+        return decorator
+
+    async def start(self, host='0.0.0.0', port=80):
+        self._server = await asyncio.start_server(self._handle, host, port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        if self._connections >= self._max_connections:
+            try:
+                await send(writer, b'', 503, None)
+            finally:
+                await self._close(writer)
+            return
+
+        self._connections += 1
+        counted = True
+        try:
+            request = await asyncio.wait_for_ms(_read_request(reader), REQUEST_TIMEOUT_MS)
+
+            route = self._routes.get(request.path)
+            if route is None:
+                raise HTTPError(404)
+            if request.method not in route[0]:
+                raise HTTPError(405)
+
+            if route[2]:
+                self._connections -= 1
+                counted = False
+            await route[1](request, writer)
+        except HTTPError as e:
+            await send(writer, b'', e.status, None)
+        except asyncio.TimeoutError:
+            self._log.warning('Request timed out')
+        except Exception as e:
+            self._log.error('Error handling request: %s', e)
+        finally:
+            if counted:
+                self._connections -= 1
+            await self._close(writer)
+
+    async def _close(self, writer):
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except OSError:
+            pass
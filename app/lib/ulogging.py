@@ -7,6 +7,8 @@
 
 
 import sys
+import ustruct as struct
+import uasyncio as asyncio
 
 CRITICAL = 50
 ERROR = 40
@@ -14,6 +16,7 @@ WARNING = 30
 INFO = 20
 DEBUG = 10
 NOTSET = 0
+_DISABLED = const(1000)  # Threshold above all levels
 
 S_EMERG = const(0)
 S_ALERT = const(1)
@@ -26,6 +29,15 @@ S_DEBUG = const(7)
 
 F_USER = const(1)
 
+# Binary encoding of syslog datagrams, see tools/log_table.py and tools/log_decoder.py
+_BINARY_MAGIC = const(0xB1)
+_TEXT_MSG_ID = const(0xFFFF)  # Record for message without ID carrying the formatted text
+
+# Crash log ring that survives reset in RTC memory (max. 2048 B on ESP32)
+_CRASH_MAGIC = const(0xC5)
+_CRASH_HEADER = const(4)
+_CRASH_SLOT = const(128)
+
 _level_dict = {
     CRITICAL: "CRIT",
     ERROR: "ERROR",
@@ -45,23 +57,190 @@ _syslog_mapping = {
 _stream = sys.stderr
 
 
-def _send_to_syslog(level, msg, facility=F_USER):
+def _enqueue_syslog(level, msg):
+    """
+    Stores the record into the ring, from where it is sent by the background task.
+    When the ring is full, the oldest record is dropped.
+    """
+    global _ring_head, _ring_count, _seq, _dropped
     if _socket is None:
         return
 
-    data = "<%d>projector_cabinet: %s" % (_syslog_mapping.get(level) + (facility << 3), msg)
+    size = len(_ring_msgs)
+    idx = (_ring_head + _ring_count) % size
+    if _ring_count == size:
+        _ring_head = (_ring_head + 1) % size
+        _dropped += 1
+    else:
+        _ring_count += 1
+    _ring_levels[idx] = level
+    _ring_msgs[idx] = msg
+    _seq += 1
+    _syslog_event.set()
+
+
+def _pack_arg(arg):
+    if isinstance(arg, int) and not isinstance(arg, bool) and -0x80000000 <= arg <= 0x7FFFFFFF:
+        return b"i" + struct.pack("<i", arg)
+    if isinstance(arg, float):
+        return b"f" + struct.pack("<f", arg)
+    data = (arg if isinstance(arg, str) else str(arg)).encode()[:255]
+    return b"s" + bytes((len(data),)) + data
+
+
+def _pack_record(level, msg, args, facility=F_USER):
+    """
+    Packs the record as: priority (u8), sequence number (u32), message ID (u16), number of arguments (u8)
+    and type-tagged arguments. Messages without ID are sent as formatted text argument.
+    """
+    msg_id = _msg_ids.get(msg)
+    if msg_id is None:
+        msg_id = _TEXT_MSG_ID
+        args = (msg % args if args else msg,)
+
+    header = struct.pack("<BIHB", _syslog_mapping.get(level) + (facility << 3), _seq, msg_id, len(args))
+    return header + b"".join([_pack_arg(arg) for arg in args])
 
+
+def _drain_syslog(max_records, facility=F_USER):
+    """
+    Pops up to `max_records` records from the ring and formats them into single datagram.
+    Every record carries its sequence number so dropped records are visible as gaps.
+    """
+    global _ring_head, _ring_count
+    seq = _seq - _ring_count
+    parts = []
+    while _ring_count and len(parts) < max_records:
+        msg = _ring_msgs[_ring_head]
+        if _msg_ids is None:
+            msg = "<%d>projector_cabinet: #%d %s" % (
+                _syslog_mapping.get(_ring_levels[_ring_head]) + (facility << 3), seq, msg)
+        parts.append(msg)
+        _ring_msgs[_ring_head] = None
+        _ring_head = (_ring_head + 1) % len(_ring_msgs)
+        _ring_count -= 1
+        seq += 1
+
+    if _msg_ids is None:
+        return "\n".join(parts).encode()
+    return _binary_header + b"".join(parts)
+
+
+def _send_to_syslog(data):
     try:
-        _socket.send(data.encode())
+        _socket.send(data)
+        return True
     except Exception as e:
-        error(f"Error while sending logs to syslog: {e}")
+        # Not logging the error as it would be queued for syslog again
+        print("[ERROR] Error while sending logs to syslog: %s" % e, file=_stream)
+        return False
+
+
+async def _syslog_sender():
+    global _dropped
+    while True:
+        await _syslog_event.wait()
+        _syslog_event.clear()
+        while _ring_count:
+            _send_to_syslog(_drain_syslog(_syslog_batch))
+            await asyncio.sleep_ms(0)
+
+        if _dropped:
+            # Queued once the ring is empty, so reporting it does not drop another record
+            msg = "Dropped %d syslog records because the queue was full"
+            _enqueue_syslog(WARNING, msg % _dropped if _msg_ids is None else _pack_record(WARNING, msg, (_dropped,)))
+            _dropped = 0
+
+
+def _crash_log_write(level, msg):
+    # Only the reference is kept, the records are encoded into `_crash_buf` when persisted
+    global _crash_next, _crash_count
+    _crash_levels[_crash_next] = level
+    _crash_msgs[_crash_next] = msg
+    _crash_next = (_crash_next + 1) % _crash_slots
+    if _crash_count < _crash_slots:
+        _crash_count += 1
+
+
+def persist_crash_log():
+    """
+    Stores the last log records into RTC memory, which survives the reset of the machine.
+    Intended to be called right before resetting because of unhandled exception.
+    """
+    if _crash_buf is None:
+        return
+
+    import hal
+    for slot in range(_crash_slots):
+        msg = _crash_msgs[slot]
+        if msg is None:
+            continue
+        off = _CRASH_HEADER + slot * _CRASH_SLOT
+        try:
+            data = msg.encode()
+        except MemoryError:  # The crash can be caused by exhausted heap
+            data = b"<out of memory>"
+        size = min(len(data), _CRASH_SLOT - 2)
+        _crash_buf[off] = _crash_levels[slot]
+        _crash_buf[off + 1] = size
+        _crash_buf[off + 2:off + 2 + size] = memoryview(data)[:size]
+
+    _crash_buf[0] = _CRASH_MAGIC
+    _crash_buf[1] = _crash_slots
+    _crash_buf[2] = _crash_next
+    _crash_buf[3] = _crash_count
+    hal.RTC().memory(_crash_buf)
+
+
+def recover_crash_log():
+    """
+    Returns list of (level, message) records persisted before the last reset.
+    They stay in RTC memory until `clear_crash_log()`, so they are not lost when reporting them fails.
+    """
+    import hal
+    rtc = hal.RTC()
+    data = rtc.memory()
+    if len(data) < _CRASH_HEADER or data[0] != _CRASH_MAGIC:
+        return []
+
+    slots, next_slot, count = data[1], data[2], data[3]
+    records = []
+    for i in range(count):
+        off = _CRASH_HEADER + ((next_slot - count + i) % slots) * _CRASH_SLOT
+        try:
+            records.append((data[off], str(data[off + 2:off + 2 + data[off + 1]], "utf-8")))
+        except (IndexError, UnicodeError):
+            pass
+
+    return records
+
+
+def clear_crash_log():
+    import hal
+    hal.RTC().memory(b"")
+
+
+def flush():
+    """
+    Synchronously sends all the queued syslog records. Useful before resetting the machine.
+    Returns False if sending of any of them failed.
+    """
+    sent = True
+    while _socket is not None and _ring_count:
+        sent = _send_to_syslog(_drain_syslog(_syslog_batch)) and sent
+    return sent
 
 
 class Logger:
     level = NOTSET
+    syslog_level = None
+    """
+    Threshold for sending the records to syslog. None means using the global threshold
+    """
 
     def __init__(self, name):
         self.name = name
+        self._update_thresholds()
 
     def _level_str(self, level):
         l = _level_dict.get(level)
@@ -69,32 +248,66 @@ class Logger:
             return l
         return "LVL%s" % level
 
+    def _update_thresholds(self):
+        # Thresholds are cached so the disabled log call costs only a single comparison
+        self._console_threshold = self.level or _level
+        if _socket is None:
+            self._syslog_threshold = _DISABLED
+        elif self.syslog_level is not None:
+            self._syslog_threshold = self.syslog_level
+        elif _syslog_level is not None:
+            # Global threshold does not enable records of the logger that has its own higher level
+            self._syslog_threshold = max(_syslog_level, self.level)
+        else:
+            self._syslog_threshold = self._console_threshold
+        self._threshold = min(self._console_threshold, self._syslog_threshold)
+
     def setLevel(self, level):
         self.level = level
+        self._update_thresholds()
+
+    def setSyslogLevel(self, level):
+        """
+        Sets syslog threshold of this logger, None resets it to the global threshold.
+        """
+        self.syslog_level = level
+        self._update_thresholds()
 
     def isEnabledFor(self, level):
-        return level >= (self.level or _level)
+        return level >= self._threshold
 
     def log(self, level, msg, *args):
-        if args:
-            msg = msg % args
-
-        if _syslog_send_all:
-            _send_to_syslog(level, msg)
-
-        if level >= (self.level or _level):
-            not _syslog_send_all and _send_to_syslog(level, msg)
+        if level < self._threshold:
+            return
+
+        if level >= self._syslog_threshold:
+            if _msg_ids is None:
+                if args:
+                    msg = msg % args
+                    args = None
+                _enqueue_syslog(level, msg)
+            else:  # Binary encoding does not need the message to be formatted
+                _enqueue_syslog(level, _pack_record(level, msg, args))
+
+        if level >= self._console_threshold:
+            if args:
+                msg = msg % args
             if self.name is None:
                 _stream.write("[%s]" % (self._level_str(level)))
             else:
                 _stream.write("[%s][%s]" % (self._level_str(level), self.name))
             print(msg, file=_stream)
 
+            if _crash_buf is not None:
+                _crash_log_write(level, msg)
+
     def debug(self, msg, *args):
-        self.log(DEBUG, msg, *args)
+        if DEBUG >= self._threshold:
+            self.log(DEBUG, msg, *args)
 
     def info(self, msg, *args):
-        self.log(INFO, msg, *args)
+        if INFO >= self._threshold:
+            self.log(INFO, msg, *args)
 
     def warning(self, msg, *args):
         self.log(WARNING, msg, *args)
@@ -116,7 +329,42 @@ class Logger:
 _level = INFO
 _loggers = {}
 _socket = None
-_syslog_send_all = True
+_syslog_level = NOTSET
+_syslog_batch = 8
+_msg_ids = None
+_binary_header = None
+_syslog_event = None
+_syslog_task = None
+
+_crash_buf = None
+_crash_levels = None
+_crash_msgs = None
+_crash_slots = 0
+_crash_next = 0
+_crash_count = 0
+
+# Ring of records waiting to be sent to syslog
+_ring_levels = None
+_ring_msgs = None
+_ring_head = 0
+_ring_count = 0
+_seq = 0
+_dropped = 0
+
+
+def _update_loggers():
+    for logger in _loggers.values():
+        logger._update_thresholds()
+
+
+def setSyslogLevel(level):
+    """
+    Sets global syslog threshold used by loggers without their own one.
+    None means using the console level of each logger.
+    """
+    global _syslog_level
+    _syslog_level = level
+    _update_loggers()
 
 
 def getLogger(name):
@@ -139,15 +387,34 @@ def error(msg, *args):
     getLogger(None).error(msg, *args)
 
 
-def basicConfig(level=INFO, filename=None, stream=None, format=None, syslog=None, syslog_send_all=True):
+def basicConfig(level=INFO, filename=None, stream=None, format=None, syslog=None, syslog_send_all=False,
+                syslog_queue=32, syslog_batch=8, syslog_binary=False, crash_log=0):
     """
     Syslog option takes tuple: (IP, port)
-    If specified than syslog formatted messages are sent there over UDP
-
-    syslog_send_all defines if all logs no matter level should be sent to syslog. Default True
+    If specified than syslog formatted messages are sent there over UDP by background uasyncio task
+
+    syslog_send_all defines if all logs no matter the global level should be sent to syslog. Loggers with
+    their own level still send only records at or above it. Default False, so disabled records are not formatted
+    Use setSyslogLevel() for finer control over what is sent to syslog.
+    syslog_queue defines how many records can wait for sending, the oldest are dropped when full. Default 32
+    syslog_batch defines how many newline-separated records are packed into one datagram. Default 8
+    Records dropped from the full queue are reported by a warning record sent after the queue is drained.
+    syslog_binary enables compact binary encoding using message IDs from `log_ids` module generated
+    by tools/log_table.py. The datagrams have to be decoded by tools/log_decoder.py. Default False
+
+    crash_log defines how many of the last records printed to console are referenced in memory
+    for `persist_crash_log()`. Records are truncated to 126 bytes, at most 15 fit RTC memory. Default 0
     """
-    global _level, _stream, _socket, _syslog_send_all
+    global _level, _stream, _socket, _syslog_level, _syslog_batch, _syslog_event, _syslog_task
+    global _ring_levels, _ring_msgs, _ring_head, _ring_count, _msg_ids, _binary_header
+    global _crash_buf, _crash_levels, _crash_msgs, _crash_slots, _crash_next, _crash_count
     _level = level
+    if crash_log and crash_log != _crash_slots:
+        _crash_slots = crash_log
+        _crash_buf = bytearray(_CRASH_HEADER + crash_log * _CRASH_SLOT)
+        _crash_levels = bytearray(crash_log)
+        _crash_msgs = [None] * crash_log
+        _crash_next = _crash_count = 0
     if stream:
         _stream = stream
     if filename is not None:
@@ -160,4 +427,22 @@ def basicConfig(level=INFO, filename=None, stream=None, format=None, syslog=None
         _addr = socket.getaddrinfo(syslog[0], syslog[1])[0][-1]
         _socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         _socket.connect(_addr)
-        _syslog_send_all = syslog_send_all
+        _syslog_level = NOTSET if syslog_send_all else None
+        _syslog_batch = syslog_batch
+
+        if syslog_binary:
+            try:
+                from log_ids import MESSAGE_IDS, TABLE_HASH
+                _msg_ids = MESSAGE_IDS
+                _binary_header = struct.pack("<BH", _BINARY_MAGIC, TABLE_HASH)
+            except ImportError:
+                print("logging.basicConfig: log_ids module not found, using text syslog encoding")
+
+        _ring_levels = [0] * syslog_queue
+        _ring_msgs = [None] * syslog_queue
+        _ring_head = _ring_count = 0
+        if _syslog_task is None:
+            _syslog_event = asyncio.Event()
+            _syslog_task = asyncio.create_task(_syslog_sender())
+
+    _update_loggers()
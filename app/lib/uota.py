@@ -7,39 +7,79 @@ MIT license; Copyright (c) 2023 Adam Uhlir
 
 import gc
 import uos
-import urequests
+import ujson
 import uzlib
+import uhashlib
+import ubinascii
+import uasyncio as asyncio
+import uhttp
 import utarfile as tarfile
 from micropython import const
+from utime import ticks_ms, ticks_diff
 
 GZDICT_SZ = const(31)
+DOWNLOAD_CHUNK_SIZE = const(4096)
+HTTP_TIMEOUT_MS = const(15_000)
+DOWNLOAD_RETRIES = const(3)
+DOWNLOAD_RETRY_DELAY_MS = const(5_000)
+HTTP_HEADERS = {"User-Agent": "MicroPython uOta"}
+MPY_MANIFEST = 'mpy_manifest.txt'
+PARTIAL_SUFFIX = '.part'
+PARTIAL_INFO_SUFFIX = '.part.json'
+CHUNKED_TRANSFER_TIMEOUT_MS = const(300_000)
+"""
+Chunked transfer without any chunk for this long is abandoned, so it does not block other transfers forever
+"""
+
+
+def _range_start(content_range):
+    # "bytes <start>-<end>/<size>"
+    try:
+        return int(content_range.split(' ', 1)[1].split('-', 1)[0])
+    except (AttributeError, IndexError, ValueError):
+        return None
 
 
 class Logging:
-    def critical(self, entry):
-        print('CRITICAL: ' + entry)
+    def critical(self, entry, *args):
+        print('CRITICAL: ' + (entry % args if args else entry))
 
-    def error(self, entry):
-        print('ERROR: ' + entry)
+    def error(self, entry, *args):
+        print('ERROR: ' + (entry % args if args else entry))
 
-    def warning(self, entry):
-        print('WARNING: ' + entry)
+    def warning(self, entry, *args):
+        print('WARNING: ' + (entry % args if args else entry))
 
-    def info(self, entry):
-        print('INFO: ' + entry)
+    def info(self, entry, *args):
+        print('INFO: ' + (entry % args if args else entry))
 
-    def debug(self, entry):
-        print('DEBUG: ' + entry)
+    def debug(self, entry, *args):
+        print('DEBUG: ' + (entry % args if args else entry))
 
 
 class UOta:
     def __init__(self, github_repo, release_tar_name="source.tar.gz", logger=None, version_file='version.txt',
-                 excluded_files=None):
+                 excluded_files=None, chunk_size=DOWNLOAD_CHUNK_SIZE, timeout_ms=HTTP_TIMEOUT_MS):
         self.repo = github_repo.rstrip('/').replace('https://github.com/', '')
         self.release_tar_name = release_tar_name
         self.version_file_path = version_file
         self.logger = logger or Logging()
         self.excluded_files = set(excluded_files or [])
+        self.timeout_ms = timeout_ms
+
+        # Single buffer reused for all the downloads and extraction in order not to fragment the heap
+        self._buf = bytearray(chunk_size)
+
+        # State of the partially received firmware image
+        self._partial_hash = None
+        self._partial_offset = 0
+
+        # Info about the firmware transfer that is received in chunks
+        self._chunked_info = None
+        self._chunked_time = None
+
+        # Transfer owning the partial image: None, 'http' or 'chunked'. Only one can run at a time.
+        self._transfer = None
 
     def check_free_space(self, min_free_space: int) -> bool:
         """
@@ -66,78 +106,323 @@ class UOta:
         except OSError as e:  # File does not exists
             return '0.0.0'
         except Exception as e:
-            self.logger.debug(f'Version retrieving error: {e}')
+            self.logger.debug('Version retrieving error: %s', e)
             return '0.0.0'
 
-    def get_latest_version(self):
-        info = self.get_latest_version_info()
+    async def get_latest_version(self):
+        info = await self.get_latest_version_info()
         return "0.0.0" if info is None else info["version"]
 
-    def get_latest_version_info(self):
-        response = urequests.get(
-            'https://api.github.com/repos/{}/releases/latest'.format(self.repo),
-            headers={"User-Agent": "MicroPython uOta"})
+    async def get_latest_version_info(self):
+        try:
+            response = await uhttp.get('https://api.github.com/repos/{}/releases/latest'.format(self.repo),
+                                       headers=HTTP_HEADERS, timeout_ms=self.timeout_ms)
+        except (OSError, asyncio.TimeoutError, uhttp.HTTPError) as e:
+            self.logger.error("Failed to fetch the latest release: %s", e)
+            return None
 
         try:
-            release_json = response.json()
+            release_json = await response.json()
             release_json["tag_name"]
         except (ValueError, KeyError):
             self.logger.error("Release not found!")
-            self.logger.debug(f"Response content: {response.text}")
-            response.close()
             return None
+        except (OSError, asyncio.TimeoutError, uhttp.HTTPError) as e:
+            self.logger.error("Failed to read the latest release: %s", e)
+            return None
+        finally:
+            await response.close()
 
-        self.logger.info(f"Found latest release with version: {release_json['tag_name']}")
+        self.logger.info("Found latest release with version: %s", release_json['tag_name'])
 
         try:
             release_asset = next(filter(lambda asset: asset["name"] == self.release_tar_name, release_json["assets"]))
         except StopIteration:
-            self.logger.error(f"Release does not contain release asset {self.release_tar_name}!")
-            response.close()
+            self.logger.error("Release does not contain release asset %s!", self.release_tar_name)
             return None
 
+        # GitHub provides digest in the form of "sha256:<hex>", older releases might not have it
+        digest = release_asset.get("digest") or ""
+
         return {
             "version": release_json['tag_name'],
             "size": release_asset["size"],
+            "sha256": digest[7:] if digest.startswith("sha256:") else None,
             "url": release_asset["browser_download_url"]
         }
 
-    def check_for_update(self) -> bool:
+    async def check_for_update(self) -> bool:
         gc.collect()
 
-        remote_version = self.get_latest_version()
+        remote_version = await self.get_latest_version()
         local_version = self.get_current_version()
 
         return remote_version > local_version
 
-    def download_update(self) -> bool:
+    async def download_update(self, retries=DOWNLOAD_RETRIES) -> bool:
         """
         Check for available updates, download new firmware if available and return True/False whether
         it's ready to be installed, there is enough free space.
+
+        Interrupted downloads are resumed from the already downloaded part, both on retries within
+        this call and on later calls.
         """
         gc.collect()
 
-        latest_release_info = self.get_latest_version_info()
+        latest_release_info = await self.get_latest_version_info()
+        if latest_release_info is None:
+            return False
+
         remote_version = latest_release_info["version"]
         local_version = self.get_current_version()
 
         if remote_version > local_version:
-            self.logger.info(f'New version {remote_version} is available')
+            self.logger.info('New version %s is available', remote_version)
+            if self._transfer_running():
+                self.logger.warning('Another firmware transfer is running, not downloading')
+                return False
             if not self.check_free_space(latest_release_info["size"]):
                 self.logger.error('Not enough free space for the new firmware')
                 return False
 
-            response = urequests.get(latest_release_info["url"],
-                                     headers={"User-Agent": "MicroPython uOta"})
-            with open(self.release_tar_name, 'wb') as f:
+            info = {
+                "version": remote_version,
+                "size": latest_release_info["size"],
+                "sha256": latest_release_info["sha256"],
+            }
+            self._transfer = 'http'
+            try:
+                for attempt in range(retries + 1):
+                    if attempt:
+                        self.logger.info('Retrying download (%d/%d)', attempt, retries)
+                        await asyncio.sleep_ms(DOWNLOAD_RETRY_DELAY_MS * attempt)
+
+                    if await self._download(latest_release_info["url"], info):
+                        return self._finish_partial(info)
+            finally:
+                self._transfer = None
+
+        return False
+
+    def _transfer_running(self):
+        if self._transfer == 'chunked' and ticks_diff(ticks_ms(), self._chunked_time) > CHUNKED_TRANSFER_TIMEOUT_MS:
+            self.logger.warning('Abandoning stalled firmware transfer over MQTT')
+            self._chunked_info = None
+            self._transfer = None
+        return self._transfer is not None
+
+    async def _download(self, url, info) -> bool:
+        """
+        Streams the `url` into the partial image, continuing from where a previous attempt stopped
+        using `Range` request. Every chunk is awaited so the event loop keeps running during the whole
+        download. The partial image is kept on failure so the next attempt can resume it.
+        """
+        offset = await self._resume_partial(info)
+        headers = {}
+        headers.update(HTTP_HEADERS)
+        if offset:
+            self.logger.info('Resuming download at %d B', offset)
+            headers["Range"] = f'bytes={offset}-'
+
+        try:
+            response = await uhttp.get(url, headers=headers, timeout_ms=self.timeout_ms)
+        except (OSError, asyncio.TimeoutError, uhttp.HTTPError) as e:
+            self.logger.error('Failed to start download of %s: %s', url, e)
+            return False
+
+        try:
+            if response.status == 416:
+                if offset == info["size"]:  # Already downloaded completely
+                    return True
+                self.logger.warning('Server refused to resume at %d B, downloading from start', offset)
+                self._restart_partial(info)
+                return False
+
+            if response.status == 200 and offset:
+                self.logger.warning('Server does not support range requests, downloading from start')
+                offset = self._restart_partial(info)
+            elif response.status == 206 and _range_start(response.headers.get('content-range')) != offset:
+                self.logger.error('Server resumed at other offset than requested %d B, downloading from start', offset)
+                self._restart_partial(info)
+                return False
+            elif response.status not in (200, 206):
+                self.logger.error('Download of %s failed with status %d', url, response.status)
+                return False
+
+            buf = memoryview(self._buf)
+            with open(self.release_tar_name + PARTIAL_SUFFIX, 'ab') as f:
                 while True:
-                    chunk = response.raw.read(512)
-                    if not chunk:
+                    n = await response.readinto(self._buf)
+                    if not n:
                         break
-                    f.write(chunk)
-            return True
+                    f.write(buf[:n])
+                    self._partial_hash.update(buf[:n])
+                    self._partial_offset += n
+        except (OSError, asyncio.TimeoutError, uhttp.HTTPError) as e:
+            self.logger.error('Download of %s failed at %d B: %s', url, self._partial_offset, e)
+            return False
+        finally:
+            await response.close()
 
-        return False
+        return True
+
+    @property
+    def chunked_update_in_progress(self):
+        return self._chunked_info is not None
+
+    @property
+    def next_chunk_seq(self):
+        if self._chunked_info is None:
+            return -1
+        return self._partial_offset // self._chunked_info["chunk_size"]
+
+    async def begin_chunked_update(self, info) -> int:
+        """
+        Prepares for receiving firmware image in sequenced chunks of `info["chunk_size"]` bytes.
+        `info` has to contain also `size` and `sha256` of the whole image.
+
+        If partial image with the same hash was already received (e.g. before reconnect or reboot),
+        the transfer is resumed. Returns sequence number of the next expected chunk.
+        Raises ValueError (or KeyError, TypeError) for malformed `info`.
+        """
+        for key in ("size", "chunk_size"):
+            if not isinstance(info[key], int) or info[key] <= 0:
+                raise ValueError(f'Invalid {key}: {info[key]}')
+        if not isinstance(info["sha256"], str) or len(info["sha256"]) != 64:
+            raise ValueError('Invalid sha256')
+
+        if self._transfer == 'http':
+            self.logger.warning('Firmware is being downloaded over HTTP, rejecting the transfer')
+            return -1
+
+        self._chunked_info = None  # No chunks are accepted until the partial image is resumed
+        if not self.check_free_space(info["size"]):
+            self.logger.error('Not enough free space for the new firmware')
+            self._transfer = None
+            return -1
+
+        self._transfer = 'chunked'
+        self._chunked_time = ticks_ms()
+        offset = await self._resume_partial(info)
+        if offset % info["chunk_size"] and offset != info["size"]:  # Chunk was not fully written
+            offset = self._restart_partial(info)
+
+        if offset:
+            self.logger.info('Resuming firmware transfer at %d B', offset)
+        else:
+            self.logger.info('Starting firmware transfer of %d B', info["size"])
+
+        self._chunked_info = info
+        return self.next_chunk_seq
+
+    def write_chunk(self, seq, data) -> int:
+        """
+        Appends chunk to the partial image. Chunks that are not the next expected one
+        (duplicates, out of order) are ignored. Returns sequence number of the next expected chunk.
+        """
+        if self._chunked_info is None:
+            return -1
+
+        expected = self.next_chunk_seq
+        if seq != expected:
+            self.logger.debug('Ignoring chunk %d, expecting %d', seq, expected)
+            return expected
+
+        if self._partial_offset + len(data) > self._chunked_info["size"]:
+            self.logger.error('Chunk %d exceeds the announced firmware size', seq)
+            return expected
+
+        with open(self.release_tar_name + PARTIAL_SUFFIX, 'ab') as f:
+            f.write(data)
+        self._partial_hash.update(data)
+        self._partial_offset += len(data)
+        self._chunked_time = ticks_ms()
+        return expected + 1
+
+    def is_chunked_update_received(self) -> bool:
+        return self._chunked_info is not None and self._partial_offset == self._chunked_info["size"]
+
+    def finish_chunked_update(self) -> bool:
+        info = self._chunked_info
+        self._chunked_info = None
+        self._transfer = None
+        return self._finish_partial(info)
+
+    def _read_partial_info(self):
+        try:
+            with open(self.release_tar_name + PARTIAL_INFO_SUFFIX) as f:
+                return ujson.load(f)
+        except (OSError, ValueError):
+            return None
+
+    async def _resume_partial(self, info) -> int:
+        """
+        Continues the partial image if it belongs to the same `info`, otherwise starts a new one.
+        The already received data is fed into the running hash, yielding to the event loop after every
+        block as the image can be large. Returns the offset to continue from.
+        """
+        if self._read_partial_info() != info:
+            return self._restart_partial(info)
+
+        try:
+            size = uos.stat(self.release_tar_name + PARTIAL_SUFFIX)[6]
+        except OSError:
+            return self._restart_partial(info)
+
+        if size > info["size"]:
+            return self._restart_partial(info)
+
+        self._partial_hash = uhashlib.sha256()
+        buf = memoryview(self._buf)
+        with open(self.release_tar_name + PARTIAL_SUFFIX, 'rb') as f:
+            while True:
+                n = f.readinto(self._buf)
+                if not n:
+                    break
+                self._partial_hash.update(buf[:n])
+                await asyncio.sleep_ms(0)
+        self._partial_offset = size
+        return size
+
+    def _restart_partial(self, info) -> int:
+        with open(self.release_tar_name + PARTIAL_INFO_SUFFIX, 'w') as f:
+            ujson.dump(info, f)
+        open(self.release_tar_name + PARTIAL_SUFFIX, 'wb').close()
+        self._partial_hash = uhashlib.sha256()
+        self._partial_offset = 0
+        return 0
+
+    def _finish_partial(self, info) -> bool:
+        """
+        Verifies size and hash (when known) of the received image and moves it where
+        `install_new_firmware` expects it. Mismatching image is discarded.
+        """
+        digest = ubinascii.hexlify(self._partial_hash.digest()).decode()
+        size = self._partial_offset
+        self._partial_hash = None
+        self._partial_offset = 0
+
+        if size != info["size"]:
+            self.logger.error('Firmware size mismatch! Expected %d B, got %d B', info["size"], size)
+            self._remove_partial()
+            return False
+
+        if info["sha256"] is not None and digest != info["sha256"]:
+            self.logger.error('Firmware hash mismatch! Expected %s, got %s', info["sha256"], digest)
+            self._remove_partial()
+            return False
+
+        uos.rename(self.release_tar_name + PARTIAL_SUFFIX, self.release_tar_name)
+        uos.remove(self.release_tar_name + PARTIAL_INFO_SUFFIX)
+        self.logger.info('Firmware received and verified')
+        return True
+
+    def _remove_partial(self):
+        for suffix in (PARTIAL_SUFFIX, PARTIAL_INFO_SUFFIX):
+            try:
+                uos.remove(self.release_tar_name + suffix)
+            except OSError:
+                pass
 
     def install_new_firmware(self):
         """
@@ -151,19 +436,21 @@ class UOta:
             self.logger.info('No new firmware file found in flash.')
             return False
 
+        previous_modules = self._read_manifest()
+
         with open(self.release_tar_name, 'rb') as f1:
             f2 = uzlib.DecompIO(f1, GZDICT_SZ)
-            f3 = tarfile.TarFile(fileobj=f2)
+            f3 = tarfile.TarFile(fileobj=f2, buf=self._buf)
             for _file in f3:
                 file_name = _file.name
                 if file_name in self.excluded_files:
                     item_type = 'directory' if file_name.endswith('/') else 'file'
-                    self.logger.info(f'Skipping excluded {item_type} {file_name}')
+                    self.logger.info('Skipping excluded %s %s', item_type, file_name)
                     continue
 
                 if file_name.endswith('/'):  # is a directory
                     try:
-                        self.logger.debug(f'Creating directory {file_name} ... ')
+                        self.logger.debug('Creating directory %s ... ', file_name)
                         uos.mkdir(file_name[:-1])  # without trailing slash or fail with errno 2
                         self.logger.debug('ok')
                     except OSError as e:
@@ -174,13 +461,47 @@ class UOta:
                     continue
                 file_obj = f3.extractfile(_file)
                 with open(file_name, 'wb') as f_out:
-                    written_bytes = 0
-                    while True:
-                        buf = file_obj.read(512)
-                        if not buf:
-                            break
-                        written_bytes += f_out.write(buf)
-                    self.logger.info(f'File {file_name} ({written_bytes} B) written to flash')
+                    written_bytes = file_obj.copyto(f_out)
+                    self.logger.info('File %s (%d B) written to flash', file_name, written_bytes)
 
         uos.remove(self.release_tar_name)
+        self._cleanup_modules(previous_modules)
         return True
+
+    def _read_manifest(self):
+        """
+        Returns mapping of installed `.mpy` files to the hash of their source as recorded
+        in the manifest generated during the release build.
+        """
+        modules = {}
+        try:
+            with open(MPY_MANIFEST) as f:
+                for line in f:
+                    source_hash, _, path = line.strip().partition(' ')
+                    if path:
+                        modules[path] = source_hash
+        except OSError:
+            pass
+        return modules
+
+    def _cleanup_modules(self, previous_modules):
+        """
+        Post-install step that removes `.py` files shadowing the freshly installed bytecode
+        (MicroPython prefers `.py` over `.mpy` and would compile them on every boot) and `.mpy`
+        files of the previous release that are no longer part of the firmware.
+        """
+        installed_modules = self._read_manifest()
+
+        for path in installed_modules:
+            self._remove_file(path[:-4] + '.py', 'shadowing source')
+
+        for path in previous_modules:
+            if path not in installed_modules:
+                self._remove_file(path, 'stale module')
+
+    def _remove_file(self, path, reason):
+        try:
+            uos.remove(path)
+            self.logger.info('Removed %s %s', reason, path)
+        except OSError:
+            pass
@@ -19,6 +19,7 @@ _S_IFREG = const(0o100000)
 _S_IFDIR = const(0o040000)
 
 _BLOCKSIZE = const(512)  # length of processing blocks
+_DEFAULT_BUFSIZE = const(4096)  # size of the buffer used for copying and skipping file contents
 
 
 def _roundup(val, align):
@@ -26,10 +27,11 @@ def _roundup(val, align):
 
 
 class FileSection:
-    def __init__(self, f, content_len, aligned_len):
+    def __init__(self, f, content_len, aligned_len, buf=None):
         self.f = f
         self.content_len = content_len
         self.align = aligned_len - content_len
+        self.buf = buf
 
     def read(self, sz=65536):
         if self.content_len == 0:
@@ -50,14 +52,41 @@ class FileSection:
         self.content_len -= sz
         return sz
 
+    def copyto(self, f_out):
+        """
+        Copies the remaining content into `f_out` through the shared buffer, without allocating
+        new objects for every chunk. Returns number of written bytes.
+        """
+        buf = self.buf or bytearray(_DEFAULT_BUFSIZE)
+        mv = memoryview(buf)
+        written = 0
+        while True:
+            sz = self.readinto(buf)
+            if not sz:
+                break
+            written += f_out.write(mv[:sz])
+        return written
+
     def skip(self):
         sz = self.content_len + self.align
-        if sz:
-            buf = bytearray(16)
-            while sz:
-                s = min(sz, 16)
-                self.f.readinto(buf, s)
-                sz -= s
+        if not sz:
+            return
+
+        # Seekable streams (plain files) can jump over the content directly
+        try:
+            self.f.seek(sz, 1)
+            self.content_len = self.align = 0
+            return
+        except (AttributeError, OSError):
+            pass
+
+        buf = self.buf or bytearray(_DEFAULT_BUFSIZE)
+        while sz:
+            s = self.f.readinto(buf, min(sz, len(buf)))
+            if not s:
+                break
+            sz -= s
+        self.content_len = self.align = 0
 
 
 class TarInfo:
@@ -80,11 +109,17 @@ class TarInfo:
 
 
 class TarFile:
-    def __init__(self, name=None, mode="r", fileobj=None):
+    def __init__(self, name=None, mode="r", fileobj=None, bufsize=_DEFAULT_BUFSIZE, buf=None):
+        """
+        `buf` (or a newly allocated buffer of `bufsize` bytes) is shared by all
+        the file sections for copying and skipping their content.
+        """
         self.subf = None
         self.mode = mode
         self.offset = 0
         if mode == "r":
+            self.buf = buf if buf is not None else bytearray(bufsize)
+            self._header = bytearray(_BLOCKSIZE)
             if fileobj:
                 self.f = fileobj
             else:
@@ -104,8 +139,8 @@ class TarFile:
     def next(self):
         if self.subf:
             self.subf.skip()
-        buf = self.f.read(_BLOCKSIZE)
-        if not buf:
+        buf = self._header
+        if self.f.readinto(buf) != _BLOCKSIZE:
             return None
 
         h = uctypes.struct(uctypes.addressof(buf), _TAR_HEADER, uctypes.LITTLE_ENDIAN)
@@ -118,7 +153,7 @@ class TarFile:
         self.offset += len(buf)
         d = TarInfo(str(h.name, "utf-8").rstrip("\0"))
         d.size = int(bytes(h.size.replace(b"\x00", b"")), 8)
-        self.subf = d.subf = FileSection(self.f, d.size, _roundup(d.size, _BLOCKSIZE))
+        self.subf = d.subf = FileSection(self.f, d.size, _roundup(d.size, _BLOCKSIZE), self.buf)
         self.offset += _roundup(d.size, _BLOCKSIZE)
         return d
 
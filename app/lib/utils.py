@@ -31,64 +31,108 @@ def singleton(cls):
     return getinstance
 
 
+# All Delay_ms instances are served by this single task. Triggering only updates the
+# instance's end time in place (and wakes the task when the new end time is earlier than
+# the one it sleeps for), so no tasks are created per trigger.
+class _TimerService:
+    def __init__(self):
+        self._timers = []
+        self._flag = asyncio.ThreadSafeFlag()
+        self._deadline = None  # End time the task currently waits for (None == idle)
+        self._task = None
+
+    def register(self, timer):
+        self._timers.append(timer)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def unregister(self, timer):
+        self._timers.remove(timer)
+
+    # May be called from hard ISR
+    def schedule(self, tend):
+        deadline = self._deadline
+        if deadline is None or ticks_diff(tend, deadline) < 0:
+            self._flag.set()
+
+    async def _run(self):
+        while True:
+            # Any trigger during the scan wakes us up again, so none can be missed
+            self._deadline = None
+            now = ticks_ms()
+            deadline = None
+            expired = None
+            for timer in self._timers:
+                if timer._busy:
+                    tend = timer._tend
+                    if ticks_diff(tend, now) <= 0:
+                        if expired is None:
+                            expired = []
+                        expired.append(timer)
+                    elif deadline is None or ticks_diff(tend, deadline) < 0:
+                        deadline = tend
+
+            # Callbacks may (un)register timers, so they are not run while iterating the timers
+            if expired is not None:
+                for timer in expired:
+                    timer._expire()
+
+            self._deadline = deadline
+            if deadline is None:
+                await self._flag.wait()
+                continue
+
+            # Woken either by a trigger or at the deadline, the deadline is recomputed in both cases
+            try:
+                await asyncio.wait_for_ms(self._flag.wait(), max(ticks_diff(deadline, ticks_ms()), 0))
+            except asyncio.TimeoutError:
+                pass
+
+
+_timers = _TimerService()
+
+
 # delay_ms.py Now uses ThreadSafeFlag and has extra .wait() API
 # Usage:
 # from primitives import Delay_ms
 
 # Copyright (c) 2018-2022 Peter Hinch
 # Released under the MIT License (MIT) - see LICENSE file
+# Timeouts are served by the shared _TimerService instead of per-instance tasks.
 
 
 class Delay_ms:
-    class DummyTimer:  # Stand-in for the timer class. Can be cancelled.
-        def cancel(self):
-            pass
-
-    _fake = DummyTimer()
-
     def __init__(self, func=None, args=(), duration=1000):
         self._func = func
         self._args = args
         self._durn = duration  # Default duration
         self._retn = None  # Return value of launched callable
-        self._tend = None  # Stop time (absolute ms).
+        self._tend = 0  # Stop time (absolute ms).
         self._busy = False
-        self._trig = asyncio.ThreadSafeFlag()
         self._tout = asyncio.Event()  # Timeout event
         self.wait = self._tout.wait  # Allow: await wait_ms.wait()
         self.clear = self._tout.clear
         self.set = self._tout.set
-        self._ttask = self._fake  # Timer task
-        self._mtask = asyncio.create_task(self._run())  # Main task
+        self._active = True
+        _timers.register(self)
 
-    async def _run(self):
-        while True:
-            await self._trig.wait()  # Await a trigger
-            self._ttask.cancel()  # Cancel and replace
-            await asyncio.sleep_ms(0)
-            dt = max(ticks_diff(self._tend, ticks_ms()), 0)  # Beware already elapsed.
-            self._ttask = asyncio.create_task(self._timer(dt))
-
-    async def _timer(self, dt):
-        await asyncio.sleep_ms(dt)
-        self._tout.set()  # Only gets here if not cancelled.
+    def _expire(self):
         self._busy = False
+        self._tout.set()
         if self._func is not None:
             self._retn = launch(self._func, self._args)
 
     # API
     # trigger may be called from hard ISR.
     def trigger(self, duration=0):  # Update absolute end time, 0-> ctor default
-        if self._mtask is None:
+        if not self._active:
             raise RuntimeError("Delay_ms.deinit() has run.")
         self._tend = ticks_add(ticks_ms(), duration if duration > 0 else self._durn)
         self._retn = None  # Default in case cancelled.
         self._busy = True
-        self._trig.set()
+        _timers.schedule(self._tend)
 
     def stop(self):
-        self._ttask.cancel()
-        self._ttask = self._fake
         self._busy = False
         self._tout.clear()
 
@@ -106,5 +150,6 @@ class Delay_ms:
 
     def deinit(self):
         self.stop()
-        self._mtask.cancel()
-        self._mtask = None
+        if self._active:
+            _timers.unregister(self)
+            self._active = False
@@ -1,31 +1,117 @@
 import uasyncio as asyncio
 import ulogging as logging
 import gc
+import hal
+import loopmon
+import memmon
+from utime import ticks_ms, ticks_diff
 
-async def main():
+WIFI_TIMEOUT = 30_000  # In milliseconds
+CRASH_LOG_SIZE = 15  # Number of last log records persisted when crashing
+GC_THRESHOLD_FRACTION = 4  # Collect after 1/4 of the free heap was allocated (None disables the threshold)
+LOOP_TASK_TIMING = False  # Record time spent between awaits by the main tasks (see loopmon.timed)
+
+_boot_phases = []
+"""
+List of (phase, timestamp) tuples where timestamp is in milliseconds since reset
+"""
+
+
+def _mark_phase(phase):
+    now = ticks_ms()
+    _boot_phases.append((phase, now))
+    print(f'=> [{now} ms] {phase}')
+
+
+async def _connect_wifi():
     from app import secrets
-    logging.basicConfig(logging.DEBUG, syslog=(secrets.SYSLOG_HOST, secrets.SYSLOG_PORT))
 
-    print("=> Starting MQTT")
-    print('=> Memory free', gc.mem_free())
-    from cabinet import mqtt
-    mq = mqtt.MQTT()
+    wlan = hal.WLAN(hal.STA_IF)
+    if not wlan.isconnected():
+        wlan.active(True)
+        wlan.connect(secrets.WIFI_SSID, secrets.WIFI_PASS)
+
+        start = ticks_ms()
+        while not wlan.isconnected():
+            if ticks_diff(ticks_ms(), start) > WIFI_TIMEOUT:
+                # MQTT client will retry the connection on its own
+                print('=> WiFi: connection timed out')
+                return
+            await asyncio.sleep_ms(100)
+
+    print('=> Network config:', wlan.ifconfig())
+
+
+def _report_crash_log():
+    records = logging.recover_crash_log()
+    if not records:
+        return
+
+    log = logging.getLogger('CrashLog')
+    log.warning('Recovered %d log records from before the last crash', len(records))
+    for level, msg in records:
+        log.log(level, 'Before reset: %s', msg)
+
+    if logging.flush():  # Kept for the next boot when syslog is not reachable
+        logging.clear_crash_log()
+
+
+async def _connect(mq):
+    from app import secrets
+
+    await _connect_wifi()
+    _mark_phase('wifi')
+    logging.basicConfig(logging.DEBUG, syslog=(secrets.SYSLOG_HOST, secrets.SYSLOG_PORT), crash_log=CRASH_LOG_SIZE)
+    _report_crash_log()
+
     await mq.start()
-    gc.collect()
+    _mark_phase('mqtt')
 
-    print("=> Starting cabinet")
+
+async def _start_hardware():
     from cabinet import cabinet
     cab = cabinet.Cabinet()
-    cab.start()
+    await asyncio.sleep_ms(0)
+    await cab.start()
+    gc.collect()
+    return cab
+
+
+async def main():
+    _mark_phase('start')
+    logging.basicConfig(logging.DEBUG, crash_log=CRASH_LOG_SIZE)
+    loopmon.start(task_timing=LOOP_TASK_TIMING)
+
+    if hal.SIMULATED:
+        from cabinet import simulation
+        simulation.CabinetModel().start()
+
+    # The WiFi and MQTT connection runs while the hardware is initialized
+    print("=> Starting WiFi and MQTT")
+    from cabinet import mqtt
+    mq = mqtt.MQTT()
+    connection = asyncio.create_task(_connect(mq))
+    await asyncio.sleep_ms(0)
+
+    print("=> Starting cabinet")
+    await _start_hardware()
+    _mark_phase('hardware')
+    print('=> Memory free', gc.mem_free())
+
+    await connection
     gc.collect()
     print('=> Memory free', gc.mem_free())
 
-    # print("=> Starting HTTP server")
-    # from cabinet import server
-    # server.start()
-    # gc.collect()
-    # print('=> Memory free', gc.mem_free())
+    print("=> Starting HTTP server")
+    from cabinet import server
+    await server.start()
+    _mark_phase('http')
+    gc.collect()
+    print('=> Memory free', gc.mem_free())
 
+    memmon.apply_gc_policy(GC_THRESHOLD_FRACTION)
+    _mark_phase('ready')
+    mq.set_boot_phases(_boot_phases)
     print("Finished bootstrap")
 
     while True:
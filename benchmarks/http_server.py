@@ -0,0 +1,109 @@
+"""
+Measures request latency and heap use of the web UI served by `uhttpd`.
+
+Serves the pre-gzipped page (fresh and revalidated by ETag) and the settings JSON API backed by
+the real PersistentSettings. The heap is collected before every request, so the reported
+allocation is an upper bound of the heap the request needed at its peak.
+
+Build the assets first and run with the MicroPython unix port from the repository root:
+
+    python tools/build_static.py
+    micropython benchmarks/http_server.py
+"""
+
+import sys
+
+sys.path.append('app')
+sys.path.append('app/lib')
+
+import gc
+import ujson
+import uasyncio as asyncio
+from utime import ticks_us, ticks_diff
+
+import uhttpd
+from cabinet import settings
+from cabinet.static_assets import ASSETS
+
+settings.PERSISTENT_SETTINGS_PATH = '/tmp/cabinet_bench/settings.bin'
+settings.LEGACY_SETTINGS_PATH = '/tmp/cabinet_bench/setting.json'
+
+HOST = '127.0.0.1'
+PORT = 8766
+REQUESTS = 50
+STATIC_DIR = 'app/cabinet/static'
+FORM = b'actuator_target=120&actuator_obstacle_current=650&projector_calibration=0.042'
+
+persisted = settings.PersistentSettings()
+app = uhttpd.Server()
+buf = bytearray(1024)
+
+
+@app.route('/')
+async def index(req, writer):
+    name, content_type, etag = ASSETS[req.path]
+    await uhttpd.send_gzipped(req, writer, STATIC_DIR + '/' + name, buf, content_type, etag)
+
+
+@app.route('/api/settings', methods=('GET', 'POST'))
+async def api_settings(req, writer):
+    if req.method == 'POST':
+        with persisted.batch():
+            for key, value in (await req.form()).items():
+                setattr(persisted, key, float(value))
+    data = {key: getattr(persisted, key) for key in persisted.keys()}
+    await uhttpd.send(writer, ujson.dumps({'settings': data, 'errors': []}), content_type='application/json')
+
+
+async def _request(request):
+    reader, writer = await asyncio.open_connection(HOST, PORT)
+    writer.write(request)
+    await writer.drain()
+    size = 0
+    while True:
+        data = await reader.read(1024)
+        if not data:
+            break
+        size += len(data)
+    writer.close()
+    await writer.wait_closed()
+    return size
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, len(values) * pct // 100)]
+
+
+async def _measure(name, request):
+    latencies = []
+    allocs = []
+    size = 0
+    for _ in range(REQUESTS):
+        gc.collect()
+        before = gc.mem_alloc()
+        start = ticks_us()
+        size = await _request(request)
+        latencies.append(ticks_diff(ticks_us(), start))
+        allocs.append(gc.mem_alloc() - before)
+
+    print('%-14s %5d B response: latency p50=%6dus p99=%6dus max=%6dus, heap per request max=%6d B' % (
+        name, size, _percentile(latencies, 50), _percentile(latencies, 99), max(latencies), max(allocs)))
+
+
+async def main():
+    gc.collect()
+    idle = gc.mem_alloc()
+    await app.start(HOST, PORT)
+    gc.collect()
+    print('server idle heap: %d B' % (gc.mem_alloc() - idle))
+
+    etag = ASSETS['/'][2].encode()
+    await _measure('GET /', b'GET / HTTP/1.0\r\nAccept-Encoding: gzip\r\n\r\n')
+    await _measure('GET / (304)', b'GET / HTTP/1.0\r\nAccept-Encoding: gzip\r\nIf-None-Match: %s\r\n\r\n' % etag)
+    await _measure('GET settings', b'GET /api/settings HTTP/1.0\r\n\r\n')
+    await _measure('POST settings', b'POST /api/settings HTTP/1.0\r\nContent-Length: %d\r\n\r\n%s' % (len(FORM), FORM))
+    await app.stop()
+
+
+asyncio.run(main())
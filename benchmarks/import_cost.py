@@ -0,0 +1,60 @@
+"""
+Measures import time and heap usage of every firmware module.
+
+Meant to run on the device (before and after deploying the `.mpy` files built by
+`tools/build_mpy.py`) with a freshly reset board:
+
+    mpremote run benchmarks/import_cost.py
+
+"transient" is the heap growth right after the import, which includes the garbage left by
+compiling `.py` sources, "retained" is what stays allocated after a collection.
+"""
+
+import sys
+
+sys.path.append('/app')
+sys.path.append('/app/lib')
+
+import gc
+from utime import ticks_us, ticks_diff
+
+MODULES = (
+    'ulogging',
+    'utils',
+    'utarfile',
+    'uhttp',
+    'uota',
+    'loopmon',
+    'memmon',
+    'hal',
+    'aadc',
+    'btn',
+    'ina219',
+    'mqtt_as',
+    'cabinet.settings',
+    'cabinet.fan',
+    'cabinet.actuator',
+    'cabinet.cabinet',
+    'cabinet.mqtt',
+)
+
+
+def main():
+    print('%-18s %10s %10s %10s' % ('module', 'time [us]', 'transient', 'retained'))
+    for name in MODULES:
+        gc.collect()
+        before = gc.mem_alloc()
+        start = ticks_us()
+        try:
+            __import__(name)
+        except ImportError as e:
+            print('%-18s failed: %s' % (name, e))
+            continue
+        duration = ticks_diff(ticks_us(), start)
+        transient = gc.mem_alloc() - before
+        gc.collect()
+        retained = gc.mem_alloc() - before
+        print('%-18s %10d %10d %10d' % (name, duration, transient, retained))
+
+
+main()
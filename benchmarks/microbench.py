@@ -0,0 +1,361 @@
+"""
+Microbenchmarks of the hot paths of the firmware with regression baselines.
+
+Runs on the MicroPython unix port, where `hal` uses its simulated backend. The simulated peripherals
+only return the stored readings, so the numbers measure the firmware's own code. Every benchmark runs
+its iterations in `REPEATS` rounds and the fastest round is reported (as microseconds per iteration)
+to filter out the noise of the host.
+
+The results are written to `benchmarks/results.json` together with the setup they were measured on
+(implementation, its version and the machine). When the baseline (`benchmarks/baseline.json` by default)
+was recorded on the same setup, every benchmark slower than the baseline by more than the threshold is
+reported as a regression and the script exits with non-zero code. Timings of other setups are not
+comparable, so the baseline is not committed. Record your own one before the change and compare after it,
+the CI does the same with the base commit. A baseline of other setup is only printed with a warning,
+with `--strict` a missing baseline or one of other setup fails the run.
+
+Run from the repository root:
+
+    micropython benchmarks/microbench.py --save-baseline
+    micropython benchmarks/microbench.py [--threshold=10] [--baseline=path] [--strict] [name ...]
+"""
+
+import sys
+
+sys.path.append('app')
+sys.path.append('app/lib')
+
+import gc
+import io
+import ujson
+import uos
+from utime import ticks_us, ticks_diff
+
+import ulogging as logging
+
+RESULTS_PATH = 'benchmarks/results.json'
+BASELINE_PATH = 'benchmarks/baseline.json'
+SETTINGS_DIR = '/tmp/cabinet_bench'
+DEFAULT_THRESHOLD = 10  # Percents
+REPEATS = 5
+
+_benchmarks = []
+
+
+def bench(iterations):
+    """
+    Registers the benchmark. The decorated function prepares everything the benchmark needs
+    and returns function running the given number of iterations, so only that one is measured.
+    """
+    def decorator(func):
+        _benchmarks.append((func.__name__, func, iterations))
+        return func
+    return decorator
+
+
+def _drive(coro):
+    # Runs the coroutine that never waits for anything to its end, without the event loop
+    try:
+        while True:
+            coro.send(None)
+    except StopIteration as e:
+        return e.value
+
+
+class _NoSleep:
+    """
+    Replaces `uasyncio` in `mqtt_as`, which sleeps after every socket read and write,
+    and in `actuator`, which sleeps between the samples of the obstacle detection.
+    """
+
+    @staticmethod
+    async def sleep_ms(_):
+        pass
+
+
+class _Socket:
+    """
+    Non-blocking socket of the MQTT client that discards the written data and returns
+    the prepared incoming data.
+    """
+
+    def __init__(self, incoming=b''):
+        self.incoming = incoming
+        self.pos = 0
+
+    def write(self, data):
+        return len(data)
+
+    def read(self, n):
+        data = self.incoming[self.pos:self.pos + n]
+        self.pos += len(data)
+        return data or None
+
+    def readinto(self, buf, n):
+        data = self.incoming[self.pos:self.pos + n]
+        buf[:len(data)] = data
+        self.pos += len(data)
+        return len(data) or None
+
+
+class _Sink:
+    def write(self, data):
+        return len(data)
+
+
+def _mqtt_client():
+    import mqtt_as
+    import uasyncio
+    mqtt_as.asyncio = uasyncio
+    config = dict(mqtt_as.config)
+    config['server'] = '127.0.0.1'
+    client = mqtt_as.MQTTClient(config, logging.getLogger('MQTT'))
+    mqtt_as.asyncio = _NoSleep
+    client._in_connect = True  # Makes `isconnected()` skip the WiFi check
+    return client
+
+
+class _Moving:
+    """
+    Finished move event of the obstacle detection that is set after the given number of samples.
+    """
+
+    def __init__(self, samples):
+        self.samples = samples
+
+    def is_set(self):
+        self.samples -= 1
+        return self.samples < 0
+
+
+@bench(2000)
+def obstacle_sample():
+    # Runs the obstacle detection loop itself, the simulated current stays under the obstacle limit
+    import uasyncio
+    from cabinet import actuator
+    act = actuator.Actuator()
+
+    def run(n):
+        actuator.asyncio = _NoSleep
+        try:
+            _drive(act._detect_obstacles(_Moving(n), None))
+        finally:
+            actuator.asyncio = uasyncio
+    return run
+
+
+@bench(2000)
+def mqtt_publish_encode():
+    client = _mqtt_client()
+    client._sock = _Socket()
+    topic = b'homeassistant/sensor/projector_cabinet_temp/state'
+    msg = b'{"temperature": 31.25}'
+
+    def run(n):
+        for _ in range(n):
+            _drive(client._publish(topic, msg, False, 0, 0, 0))
+    return run
+
+
+@bench(2000)
+def mqtt_publish_parse():
+    client = _mqtt_client()
+    topic = b'homeassistant/number/projector_cabinet_extension/set'
+    msg = b'{ "speed": "42"}'
+    packet = bytes((0x30, 2 + len(topic) + len(msg), 0, len(topic))) + topic + msg
+    client._cb = lambda *_: None
+    sock = client._sock = _Socket(packet)
+
+    def run(n):
+        for _ in range(n):
+            sock.pos = 0
+            _drive(client.wait_msg())
+    return run
+
+
+def _tar(files):
+    data = bytearray()
+    for name, size in files:
+        header = bytearray(512)
+        header[:len(name)] = name
+        header[124:135] = b'%011o' % size
+        data += header
+        data += bytes((size + 511) & ~511)
+    return bytes(data + bytes(1024))
+
+
+@bench(50)
+def utarfile_extract():
+    import utarfile
+    archive = _tar([(b'app/lib/file%d.py' % i, 1000 + i * 1500) for i in range(8)])
+    buf = bytearray(1024)
+    sink = _Sink()
+
+    def run(n):
+        for _ in range(n):
+            for entry in utarfile.TarFile(fileobj=io.BytesIO(archive), buf=buf):
+                entry.subf.copyto(sink)
+    return run
+
+
+@bench(2000)
+def ulogging_format():
+    stream = io.StringIO()
+    logging.basicConfig(level=logging.INFO, stream=stream)
+    log = logging.getLogger('Bench')
+
+    def run(n):
+        for _ in range(n):
+            stream.seek(0)
+            log.info('Current %d mA is over the limit %s, position %s cm', 712, 650.0, 42)
+    return run
+
+
+@bench(20000)
+def ulogging_disabled():
+    logging.basicConfig(level=logging.INFO, stream=_Sink())
+    log = logging.getLogger('Bench')
+
+    def run(n):
+        for _ in range(n):
+            log.debug('Current %d mA, average %s', 712, 650.0)
+    return run
+
+
+@bench(20)
+def settings_flush():
+    from cabinet import settings
+    settings.PERSISTENT_SETTINGS_PATH = SETTINGS_DIR + '/settings.bin'
+    settings.LEGACY_SETTINGS_PATH = SETTINGS_DIR + '/setting.json'
+    persisted = settings.PersistentSettings()
+
+    def run(n):
+        for _ in range(n):
+            persisted._dirty = True
+            persisted.flush()
+    return run
+
+
+@bench(500)
+def ha_discovery_json():
+    payload = {
+        "name": "Cabinet fans",
+        "unique_id": "projector_cabinet_fans",
+        "percentage_state_topic": "homeassistant/fan/projector_cabinet_fans/speed/state",
+        "percentage_command_topic": "homeassistant/fan/projector_cabinet_fans/speed/set",
+        "percentage_command_template": '{ "speed": "{{ value }}"}',
+        "speed_range_min": 1,
+        "speed_range_max": 100,
+        "state_topic": "homeassistant/fan/projector_cabinet_fans/state",
+        "command_topic": "homeassistant/fan/projector_cabinet_fans/set",
+        "availability_topic": "homeassistant/projector_cabinet/availability",
+        "device": {
+            "name": "Projector cabinet",
+            "configuration_url": "http://192.168.5.2",
+            "manufacturer": "Adam Uhlir",
+            "identifiers": ["cabinet_device"]
+        },
+    }
+
+    def run(n):
+        for _ in range(n):
+            ujson.dumps(payload)
+    return run
+
+
+def _run(setup, iterations):
+    func = setup()
+    best = None
+    for _ in range(REPEATS):
+        gc.collect()
+        start = ticks_us()
+        func(iterations)
+        elapsed = ticks_diff(ticks_us(), start)
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / iterations
+
+
+def _setup():
+    machine = uos.uname().machine if hasattr(uos, 'uname') else sys.platform
+    return '%s %s %s' % (sys.implementation.name, '.'.join([str(v) for v in sys.implementation.version[:3]]),
+                         machine)
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return ujson.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save(path, setup, results):
+    with open(path, 'w') as f:
+        ujson.dump({'setup': setup, 'results': results}, f)
+        f.write('\n')
+
+
+def main(args):
+    threshold = DEFAULT_THRESHOLD
+    baseline_path = BASELINE_PATH
+    save_baseline = False
+    strict = False
+    names = []
+    for arg in args:
+        if arg == '--save-baseline':
+            save_baseline = True
+        elif arg == '--strict':
+            strict = True
+        elif arg.startswith('--threshold='):
+            threshold = float(arg[12:])
+        elif arg.startswith('--baseline='):
+            baseline_path = arg[11:]
+        else:
+            names.append(arg)
+
+    try:
+        uos.mkdir(SETTINGS_DIR)
+    except OSError:
+        pass
+
+    results = {}
+    for name, func, iterations in _benchmarks:
+        if not names or name in names:
+            results[name] = _run(func, iterations)
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+
+    setup = _setup()
+    _save(RESULTS_PATH, setup, results)
+    if save_baseline:
+        _save(baseline_path, setup, results)
+        print('Baseline saved to', baseline_path)
+
+    baseline = _load(baseline_path) or {'setup': None, 'results': {}}
+    comparable = baseline['setup'] == setup
+    print('Setup:', setup)
+    if baseline['setup'] is None:
+        print('WARNING: No baseline found in %s, regressions are not checked' % baseline_path)
+    elif not comparable:
+        print('WARNING: Baseline was recorded on %s, regressions are not checked' % baseline['setup'])
+
+    regressions = 0
+    for name, value in results.items():
+        base = baseline['results'].get(name)
+        if base is None:
+            print('%-22s %10.2f us' % (name, value))
+            continue
+        change = (value - base) * 100 / base
+        regressed = comparable and change > threshold
+        regressions += regressed
+        print('%-22s %10.2f us  baseline %10.2f us  %+6.1f %%%s' % (
+            name, value, base, change, '  REGRESSION' if regressed else ''))
+
+    if regressions:
+        print('%d benchmark(s) regressed by more than %s %%' % (regressions, threshold))
+        sys.exit(1)
+    if strict and not comparable:
+        sys.exit(2)
+
+
+main(sys.argv[1:])
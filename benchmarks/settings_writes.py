@@ -0,0 +1,88 @@
+"""
+Measures flash writes and event loop stalls caused by saving the settings form.
+
+Compares writing the settings after every assigned field (as the previous implementation did)
+with the debounced writes and with the batch API.
+
+Run with the MicroPython unix port from the repository root:
+
+    micropython benchmarks/settings_writes.py
+"""
+
+import sys
+
+sys.path.append('app')
+sys.path.append('app/lib')
+
+import uasyncio as asyncio
+from utime import ticks_us, ticks_diff
+
+from cabinet import settings
+
+settings.PERSISTENT_SETTINGS_PATH = '/tmp/cabinet_bench/settings.bin'
+settings.LEGACY_SETTINGS_PATH = '/tmp/cabinet_bench/setting.json'
+
+FORM = {
+    'actuator_target': 120,
+    'actuator_obstacle_sma_window': 12,
+    'actuator_obstacle_max_value_coefficient': 1.4,
+    'actuator_obstacle_current': 650,
+    'actuator_obstacle_reverse_distance': 15,
+    'actuator_current_monitoring_interval': 90,
+    'projector_number_of_samples': 1500,
+    'projector_reading_interval_ms': 400,
+    'projector_calibration': 0.042,
+    'projector_sma_window': 5,
+}
+TICK_MS = 5
+
+
+async def _ticker(lags, done):
+    while not done.is_set():
+        start = ticks_us()
+        await asyncio.sleep_ms(TICK_MS)
+        lags.append(ticks_diff(ticks_us(), start) - TICK_MS * 1000)
+
+
+async def _measure(name, persisted, save):
+    lags = []
+    done = asyncio.Event()
+    ticker = asyncio.create_task(_ticker(lags, done))
+    await asyncio.sleep_ms(20)
+
+    writes_before = persisted._writes
+    await save(persisted)
+    await asyncio.sleep_ms(settings.FLUSH_DEBOUNCE_MS + 100)
+    done.set()
+    await ticker
+
+    print('%-12s writes=%2d max loop stall=%6dus' % (name, persisted._writes - writes_before, max(lags)))
+
+
+async def _per_field(persisted):
+    for key, value in FORM.items():
+        setattr(persisted, key, value)
+        persisted.flush()  # Previous behaviour: write on every assignment
+        await asyncio.sleep_ms(0)
+
+
+async def _debounced(persisted):
+    for key, value in FORM.items():
+        setattr(persisted, key, value)
+        await asyncio.sleep_ms(0)
+
+
+async def _batched(persisted):
+    with persisted.batch():
+        for key, value in FORM.items():
+            setattr(persisted, key, value)
+
+
+async def main():
+    persisted = settings.PersistentSettings()
+    await _measure('per field', persisted, _per_field)
+    await _measure('debounced', persisted, _debounced)
+    await _measure('batch', persisted, _batched)
+
+
+asyncio.run(main())
@@ -0,0 +1,83 @@
+"""
+Measures event loop latency while UOta downloads a firmware image.
+
+A local uasyncio HTTP server stands in for GitHub and serves a random payload, while
+a ticker task sleeps in short intervals and records how late it was woken up.
+
+Run with the MicroPython unix port from the repository root:
+
+    micropython benchmarks/uota_download_latency.py
+"""
+
+import sys
+
+sys.path.append('app/lib')
+
+import uasyncio as asyncio
+import uos
+from utime import ticks_ms, ticks_us, ticks_diff
+
+from uota import UOta
+
+HOST = '127.0.0.1'
+PORT = 8765
+PAYLOAD_SIZE = 512 * 1024
+SERVER_CHUNK_SIZE = 1460
+TICK_MS = 10
+TARGET_PATH = '/tmp/uota_bench.tar.gz'
+
+
+async def _serve(reader, writer):
+    while (await reader.readline()) not in (b'\r\n', b''):
+        pass
+
+    writer.write(b'HTTP/1.0 200 OK\r\nContent-Length: %d\r\n\r\n' % PAYLOAD_SIZE)
+    chunk = uos.urandom(SERVER_CHUNK_SIZE)
+    sent = 0
+    while sent < PAYLOAD_SIZE:
+        part = chunk[:min(SERVER_CHUNK_SIZE, PAYLOAD_SIZE - sent)]
+        writer.write(part)
+        await writer.drain()
+        sent += len(part)
+    writer.close()
+    await writer.wait_closed()
+
+
+async def _ticker(lags, done):
+    while not done.is_set():
+        start = ticks_us()
+        await asyncio.sleep_ms(TICK_MS)
+        lags.append(ticks_diff(ticks_us(), start) - TICK_MS * 1000)
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, len(values) * pct // 100)]
+
+
+async def main():
+    server = await asyncio.start_server(_serve, HOST, PORT)
+    ota = UOta('https://github.com/AuHau/projector-cabinet', release_tar_name=TARGET_PATH)
+    info = {"version": "bench", "size": PAYLOAD_SIZE, "sha256": None}
+
+    lags = []
+    done = asyncio.Event()
+    ticker = asyncio.create_task(_ticker(lags, done))
+
+    start = ticks_ms()
+    ok = await ota._download('http://%s:%d/source.tar.gz' % (HOST, PORT), info) and ota._finish_partial(info)
+    duration = ticks_diff(ticks_ms(), start)
+    done.set()
+    await ticker
+
+    server.close()
+    await server.wait_closed()
+    uos.remove(TARGET_PATH)
+
+    print('download ok:', ok)
+    print('downloaded %d B in %d ms (%d kB/s)' % (PAYLOAD_SIZE, duration, PAYLOAD_SIZE // max(duration, 1)))
+    print('loop lag over %d ticks: p50=%dus p99=%dus max=%dus' % (
+        len(lags), _percentile(lags, 50), _percentile(lags, 99), max(lags)))
+
+
+asyncio.run(main())
@@ -0,0 +1,86 @@
+"""
+Measures extraction throughput of a gzipped release tarball with utarfile.
+
+Compares the previous per-chunk `read(512)` copying with the buffered `copyto()` API.
+Build a realistic tarball the same way as the release CI does, e.g.:
+
+    tar -czf /tmp/source.tar.gz main.py version.txt app
+
+and run with the MicroPython unix port from the repository root:
+
+    micropython benchmarks/utarfile_extract.py /tmp/source.tar.gz [bufsize]
+"""
+
+import sys
+
+sys.path.append('app/lib')
+
+import gc
+import uos
+import uzlib
+from utime import ticks_ms, ticks_diff
+
+import utarfile as tarfile
+
+GZDICT_SZ = 31
+OUTPUT_DIR = '/tmp/utarfile_bench'
+
+
+def _mkdir(path):
+    try:
+        uos.mkdir(path)
+    except OSError:
+        pass
+
+
+def _extract_legacy(tar):
+    total = 0
+    for entry in tar:
+        if entry.name.endswith('/'):
+            _mkdir(OUTPUT_DIR + '/' + entry.name[:-1])
+            continue
+        file_obj = tar.extractfile(entry)
+        with open(OUTPUT_DIR + '/' + entry.name, 'wb') as f_out:
+            while True:
+                buf = file_obj.read(512)
+                if not buf:
+                    break
+                total += f_out.write(buf)
+    return total
+
+
+def _extract_buffered(tar):
+    total = 0
+    for entry in tar:
+        if entry.name.endswith('/'):
+            _mkdir(OUTPUT_DIR + '/' + entry.name[:-1])
+            continue
+        with open(OUTPUT_DIR + '/' + entry.name, 'wb') as f_out:
+            total += tar.extractfile(entry).copyto(f_out)
+    return total
+
+
+def _run(name, path, bufsize, extract):
+    _mkdir(OUTPUT_DIR)
+    gc.collect()
+    start = ticks_ms()
+    with open(path, 'rb') as f:
+        tar = tarfile.TarFile(fileobj=uzlib.DecompIO(f, GZDICT_SZ), bufsize=bufsize)
+        total = extract(tar)
+    duration = max(ticks_diff(ticks_ms(), start), 1)
+    print('%-10s %8d B in %5d ms => %6d kB/s' % (name, total, duration, total // duration))
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    path = sys.argv[1]
+    bufsize = int(sys.argv[2]) if len(sys.argv) > 2 else 4096
+
+    _run('read(512)', path, bufsize, _extract_legacy)
+    _run('copyto', path, bufsize, _extract_buffered)
+
+
+main()
@@ -5,36 +5,19 @@ import uasyncio as asyncio
 OTA_REPO = "https://github.com/AuHau/projector-cabinet"
 
 
-def connect_to_wifi():
-    import time, network, gc, app.secrets as secrets
-    time.sleep(1)
-    print("Bootstrapping")
-    print('=> Memory free', gc.mem_free())
-
-    # network.hostname('projector_cabinet')
-    wlan = network.WLAN(network.STA_IF)
-    print(f"=> WiFi: {'connected - ' + wlan.ifconfig()[0] if wlan.isconnected() else 'NOT connected --> connecting'}")
-    if not wlan.isconnected():
-        wlan.active(True)
-        time.sleep(1)
-        wlan.connect(secrets.WIFI_SSID, secrets.WIFI_PASS)
-        while not wlan.isconnected():
-            pass
-
-    print('=> Network config:', wlan.ifconfig())
-
-
 def check_for_update():
-    import machine, gc
+    import hal, gc
     import ulogging as logging
     from uota import UOta
 
+    print("Bootstrapping")
+    print('=> Memory free', gc.mem_free())
     print('=> Checking if new firmware version can be installed')
     ota = UOta(OTA_REPO, logger=logging.getLogger('UOta'))
     has_updated = ota.install_new_firmware()
     if has_updated:
         print('=> New version installed! Restarting!')
-        machine.reset()
+        hal.reset()
     else:
         del ota
         gc.collect()
@@ -49,7 +32,7 @@ def _get_traceback(exception):
 
 def set_global_exception():
     def handle_exception(loop, context):
-        import sys, machine
+        import sys, hal
         import ulogging as logging
         exc = context['exception']
         sys.print_exception(exc)
@@ -58,7 +41,15 @@ def set_global_exception():
         formatted_traceback = _get_traceback(exc).replace('\n', ' ==> ')
         logging.debug(f"Traceback: {formatted_traceback}")
         logging.info("Resetting the machine because of unhandled exception.")
-        machine.reset()
+        settings = sys.modules.get('cabinet.settings')
+        if settings is not None:  # Pending changes would be lost otherwise
+            try:
+                settings.PersistentSettings().flush()
+            except Exception as e:
+                logging.error("Failed to write the settings: %s", e)
+        logging.flush()  # Queued syslog records would be lost otherwise
+        logging.persist_crash_log()  # Reported after reboot in case syslog or WiFi is down
+        hal.reset()
 
     loop = asyncio.get_event_loop()
     loop.set_exception_handler(handle_exception)
@@ -76,8 +67,7 @@ def start_app():
 sys.path.append('/app')
 sys.path.append('/app/lib')
 
-connect_to_wifi()
-check_for_update()
+check_for_update()  # Installs only already downloaded firmware, so no network is needed
 
 try:
     asyncio.run(start_app())
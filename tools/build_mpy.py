@@ -0,0 +1,97 @@
+"""
+Compiles the firmware sources under `app/` into `.mpy` bytecode using `mpy-cross`.
+
+Compiled files are cached in `.mpy_cache/` keyed by the hash of the source (and of the mpy-cross
+version), so only changed modules are recompiled. Cache entries that do not belong to any current
+source are removed. The tool also writes `mpy_manifest.txt` that lists every produced `.mpy` file
+together with its source hash; UOta uses it after installation to clean up stale modules.
+
+Usage (from the repository root):
+
+    python tools/build_mpy.py [--remove-sources]
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+
+SOURCES_DIR = 'app'
+CACHE_DIR = '.mpy_cache'
+MANIFEST_PATH = 'mpy_manifest.txt'
+
+
+def _mpy_cross_version():
+    result = subprocess.run(['mpy-cross', '--version'], check=True, capture_output=True, text=True)
+    return result.stdout.strip()
+
+
+def _sources():
+    for root, _, files in os.walk(SOURCES_DIR):
+        for name in sorted(files):
+            if name.endswith('.py'):
+                yield os.path.join(root, name)
+
+
+def _source_hash(path, compiler_version):
+    digest = hashlib.sha1(compiler_version.encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+
+def build(remove_sources=False):
+    compiler_version = _mpy_cross_version()
+    os.makedirs(CACHE_DIR, exist_ok=True)
+
+    used_entries = set()
+    manifest = []
+    compiled = 0
+
+    for source in _sources():
+        source_hash = _source_hash(source, compiler_version)
+        cached = os.path.join(CACHE_DIR, source_hash + '.mpy')
+        used_entries.add(os.path.basename(cached))
+
+        if not os.path.exists(cached):
+            subprocess.run(['mpy-cross', '-s', source, '-o', cached, source], check=True)
+            compiled += 1
+
+        target = source[:-3] + '.mpy'
+        shutil.copyfile(cached, target)
+        manifest.append((source_hash, target))
+
+        if remove_sources:
+            os.remove(source)
+
+    stale = 0
+    for entry in os.listdir(CACHE_DIR):
+        if entry not in used_entries:
+            os.remove(os.path.join(CACHE_DIR, entry))
+            stale += 1
+
+    with open(MANIFEST_PATH, 'w') as f:
+        for source_hash, target in manifest:
+            f.write(f'{source_hash} {target}\n')
+
+    print(f'{len(manifest)} modules: {compiled} compiled, {len(manifest) - compiled} from cache, '
+          f'{stale} stale cache entries removed')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--remove-sources', action='store_true',
+                        help='remove the .py sources after compilation (used for release builds)')
+    args = parser.parse_args()
+
+    try:
+        build(args.remove_sources)
+    except FileNotFoundError:
+        print('mpy-cross not found, install it with `pip install mpy-cross`', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Pre-compresses the web UI assets (`app/cabinet/static/`) for serving them from the device.
+
+Every asset is stored as `<name>.gz` which the device streams as is with `Content-Encoding: gzip`.
+It is compressed with small window (`WINDOW_BITS`), so the device can also decompress it for clients
+not accepting gzip without allocating the default 32 kB window.
+The tool also generates `app/cabinet/static_assets.py` module mapping URL paths to the compressed
+files, their content types and ETags (hash of the compressed content), so the device never
+compresses nor hashes anything.
+
+Usage (from the repository root):
+
+    python tools/build_static.py [--remove-sources]
+"""
+
+import argparse
+import hashlib
+import os
+import zlib
+
+STATIC_DIR = os.path.join('app', 'cabinet', 'static')
+MANIFEST_PATH = os.path.join('app', 'cabinet', 'static_assets.py')
+INDEX = 'index.html'
+WINDOW_BITS = 10  # Has to match GZIP_WINDOW_BITS of app/lib/uhttpd.py
+CONTENT_TYPES = {
+    '.html': 'text/html',
+    '.js': 'application/javascript',
+    '.css': 'text/css',
+    '.svg': 'image/svg+xml',
+    '.json': 'application/json',
+}
+
+
+def _compress(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    # zlib writes gzip header with zero mtime, so the output (and so the ETag) depends only on the content
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + WINDOW_BITS)
+    compressed = compressor.compress(data) + compressor.flush()
+    with open(path + '.gz', 'wb') as f:
+        f.write(compressed)
+
+    return len(data), compressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--remove-sources', action='store_true', help='remove the uncompressed assets')
+    args = parser.parse_args()
+
+    assets = {}
+    for name in sorted(os.listdir(STATIC_DIR)):
+        path = os.path.join(STATIC_DIR, name)
+        if name.endswith('.gz') or not os.path.isfile(path):
+            continue
+
+        content_type = CONTENT_TYPES.get(os.path.splitext(name)[1], 'application/octet-stream')
+        size, compressed = _compress(path)
+        etag = '"%s"' % hashlib.sha256(compressed).hexdigest()[:16]
+        assets['/' if name == INDEX else '/' + name] = (name + '.gz', content_type, etag)
+        print(f'{name}: {size} B -> {len(compressed)} B')
+
+        if args.remove_sources:
+            os.remove(path)
+
+    with open(MANIFEST_PATH, 'w') as f:
+        f.write('# Generated by tools/build_static.py, do not edit\n\n')
+        f.write('ASSETS = {\n')
+        for url, asset in assets.items():
+            f.write(f'    {url!r}: {asset!r},\n')
+        f.write('}\n')
+        f.write('"""\nURL path -> (compressed file name, content type, ETag)\n"""\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Simulates the fans' temperature regulation against a simple thermal model of the cabinet.
+
+The cabinet is modeled as a single heat capacity heated by the projector and cooled passively
+and by the fans towards the ambient temperature:
+
+    C * dT/dt = P - (H_PASSIVE + H_FANS * duty / 100) * (T - T_AMBIENT)
+
+The regulator (`app/cabinet/fan_regulator.py`) runs with the default settings of `PersistentSettings`
+(parsed from the source, so nothing device specific is imported) on a heat load profile with steps.
+Compared to the previous constant 50 % duty cycle it reports the reached temperatures and the fans'
+effort. With `--check` it exits with non-zero code when the regulation does not hold the temperature.
+
+Usage (from the repository root):
+
+    python tools/fan_simulation.py [--check] [--verbose]
+"""
+
+import argparse
+import ast
+import os
+import sys
+
+sys.path.append(os.path.join('app', 'cabinet'))
+sys.path.append(os.path.join('app', 'lib'))
+
+from fan_regulator import FanRegulator
+
+SETTINGS_PATH = os.path.join('app', 'cabinet', 'settings.py')
+
+STEP = 10  # Regulation interval in seconds, same as FAN_CONTROL_INTERVAL
+HEAT_CAPACITY = 20_000  # J/K
+H_PASSIVE = 3  # W/K
+H_FANS = 25  # W/K at 100 % duty cycle
+T_AMBIENT = 24
+
+PROFILE = (
+    # (duration in minutes, heat load in W)
+    (40, 150),  # Projector playing
+    (40, 80),  # Low brightness scene
+    (60, 200),  # Bright HDR content
+    (20, 0),  # Projector turned off
+)
+
+SETTLE_TIME = 20 * 60  # Seconds after a load change excluded from the tolerance check
+TOLERANCE = 1.5  # °C above target + hysteresis allowed once settled
+
+
+def _default_settings():
+    with open(SETTINGS_PATH) as f:
+        tree = ast.parse(f.read())
+
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and node.name == 'PersistentSettings':
+            return {
+                stmt.targets[0].id: ast.literal_eval(stmt.value)
+                for stmt in node.body
+                if isinstance(stmt, ast.Assign) and stmt.targets[0].id.startswith('fan_')
+            }
+    raise RuntimeError('PersistentSettings not found')
+
+
+def simulate(duty_of, verbose=False):
+    temp = T_AMBIENT
+    elapsed = 0
+    duty = 0
+    results = []  # (elapsed, load, temp, duty, settled)
+    for minutes, load in PROFILE:
+        load_start = elapsed
+        for _ in range(minutes * 60 // STEP):
+            duty = duty_of(temp, duty)
+            cooling = (H_PASSIVE + H_FANS * duty / 100) * (temp - T_AMBIENT)
+            temp += (load - cooling) * STEP / HEAT_CAPACITY
+            elapsed += STEP
+            results.append((elapsed, load, temp, duty, elapsed - load_start > SETTLE_TIME))
+
+            if verbose and elapsed % 300 == 0:
+                print(f'{elapsed // 60:4d} min  load={load:3d} W  temp={temp:5.1f} °C  duty={duty:3d} %')
+    return results
+
+
+def _summary(name, results):
+    effort = sum(duty for *_, duty, _ in results) / len(results)
+    settled = [temp for _, load, temp, _, settled in results if settled and load]
+    toggles = sum(1 for a, b in zip(results, results[1:]) if (a[3] == 0) != (b[3] == 0))
+    print(f'{name:10s} max temp={max(r[2] for r in results):5.1f} °C  settled max={max(settled):5.1f} °C  '
+          f'mean duty={effort:5.1f} %  on/off toggles={toggles}')
+    return max(settled)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--check', action='store_true', help='fail when the regulation does not hold the target')
+    parser.add_argument('--verbose', action='store_true', help='print the temperature course')
+    args = parser.parse_args()
+
+    s = _default_settings()
+    regulator = FanRegulator(s['fan_target_temperature'], s['fan_hysteresis'], s['fan_kp'], s['fan_ki'],
+                             s['fan_kd'], s['fan_min_duty'], s['fan_max_step'])
+
+    print(f'Target {s["fan_target_temperature"]} °C ± {s["fan_hysteresis"]} °C, ambient {T_AMBIENT} °C')
+    settled_max = _summary('regulated', simulate(lambda temp, _: regulator.update(temp, STEP), args.verbose))
+    _summary('constant', simulate(lambda temp, _: 50))
+
+    limit = s['fan_target_temperature'] + s['fan_hysteresis'] + TOLERANCE
+    if args.check and settled_max > limit:
+        sys.exit(f'Settled temperature {settled_max:.1f} °C exceeds {limit:.1f} °C')
+
+
+if __name__ == '__main__':
+    main()
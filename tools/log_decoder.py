@@ -0,0 +1,101 @@
+"""
+Receives syslog datagrams from the cabinet and expands the binary encoded ones back to text.
+
+Binary datagrams are decoded with the message table in `app/lib/log_ids.py` (see tools/log_table.py),
+which has to be the same one as deployed on the device. Text datagrams are passed through.
+The records are printed and optionally forwarded as regular syslog messages to another collector.
+
+Usage (from the repository root):
+
+    python tools/log_decoder.py --port 5140 [--forward syslog.lan:514]
+"""
+
+import argparse
+import runpy
+import socket
+import struct
+import sys
+
+TABLE_PATH = 'app/lib/log_ids.py'
+BINARY_MAGIC = 0xB1
+TEXT_MSG_ID = 0xFFFF
+
+
+def _read_arg(data, offset):
+    tag = data[offset:offset + 1]
+    offset += 1
+    if tag == b'i':
+        return struct.unpack_from('<i', data, offset)[0], offset + 4
+    if tag == b'f':
+        return struct.unpack_from('<f', data, offset)[0], offset + 4
+    if tag == b's':
+        length = data[offset]
+        return data[offset + 1:offset + 1 + length].decode(errors='replace'), offset + 1 + length
+    raise ValueError(f'Unknown argument type {tag!r}')
+
+
+def decode(data, messages, table_hash):
+    """
+    Returns list of (priority, sequence, message) tuples.
+    """
+    if not data or data[0] != BINARY_MAGIC:
+        records = []
+        for line in data.decode(errors='replace').split('\n'):
+            pri, _, rest = line[1:].partition('>')
+            records.append((int(pri) if pri.isdigit() else 0, None, rest))
+        return records
+
+    (datagram_hash,) = struct.unpack_from('<H', data, 1)
+    if datagram_hash != table_hash:
+        print(f'Warning: table hash mismatch (device {datagram_hash}, local {table_hash})', file=sys.stderr)
+
+    records = []
+    offset = 3
+    while offset < len(data):
+        pri, seq, msg_id, args_count = struct.unpack_from('<BIHB', data, offset)
+        offset += 8
+        args = []
+        for _ in range(args_count):
+            arg, offset = _read_arg(data, offset)
+            args.append(arg)
+
+        if msg_id == TEXT_MSG_ID:
+            msg = args[0]
+        elif msg_id < len(messages):
+            try:
+                msg = messages[msg_id] % tuple(args) if args else messages[msg_id]
+            except (TypeError, ValueError):
+                msg = f'{messages[msg_id]!r} % {args!r}'
+        else:
+            msg = f'<unknown message {msg_id}> {args!r}'
+        records.append((pri, seq, f'projector_cabinet: #{seq} {msg}'))
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=514)
+    parser.add_argument('--forward', help='host:port of syslog collector to forward decoded messages to')
+    args = parser.parse_args()
+
+    table = runpy.run_path(TABLE_PATH)
+    messages = [msg for msg, _ in sorted(table['MESSAGE_IDS'].items(), key=lambda item: item[1])]
+
+    forward = None
+    if args.forward:
+        host, port = args.forward.rsplit(':', 1)
+        forward = (host, int(port))
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((args.host, args.port))
+    while True:
+        data, _ = sock.recvfrom(2048)
+        for pri, _, msg in decode(data, messages, table['TABLE_HASH']):
+            print(f'<{pri}>{msg}')
+            if forward:
+                sock.sendto(f'<{pri}>{msg}'.encode(), forward)
+
+
+if __name__ == '__main__':
+    main()
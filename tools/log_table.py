@@ -0,0 +1,60 @@
+"""
+Generates table of log message IDs used by the binary syslog encoding of `ulogging`.
+
+All literal format strings passed to logger calls in `app/` are collected and numbered.
+The result is written as `app/lib/log_ids.py` module, which is deployed with the firmware
+and read by `tools/log_decoder.py` on the host. The table hash is part of every binary
+datagram so the decoder can detect it uses a different table than the device.
+
+Usage (from the repository root):
+
+    python tools/log_table.py
+"""
+
+import ast
+import os
+import zlib
+
+SOURCES_DIR = 'app'
+OUTPUT_PATH = os.path.join('app', 'lib', 'log_ids.py')
+LOG_METHODS = {'debug', 'info', 'warning', 'error', 'critical', 'exception', 'dprint'}
+
+
+def _collect_messages():
+    messages = set()
+    for root, _, files in os.walk(SOURCES_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            if not name.endswith('.py') or path == OUTPUT_PATH:
+                continue
+
+            with open(path) as f:
+                tree = ast.parse(f.read(), path)
+
+            for node in ast.walk(tree):
+                if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                        and node.func.attr in LOG_METHODS and node.args
+                        and isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str)):
+                    messages.add(node.args[0].value)
+    return sorted(messages)
+
+
+def table_hash(messages):
+    return zlib.crc32('\n'.join(messages).encode()) & 0xFFFF
+
+
+def main():
+    messages = _collect_messages()
+    with open(OUTPUT_PATH, 'w') as f:
+        f.write('# Generated by tools/log_table.py, do not edit\n\n')
+        f.write(f'TABLE_HASH = {table_hash(messages)}\n\n')
+        f.write('MESSAGE_IDS = {\n')
+        for msg_id, msg in enumerate(messages):
+            f.write(f'    {msg!r}: {msg_id},\n')
+        f.write('}\n')
+
+    print(f'{len(messages)} log messages written to {OUTPUT_PATH}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Streams firmware image (`source.tar.gz` release asset) to the cabinet over MQTT.
+
+The transfer uses stop-and-wait flow control: the image is announced on the `begin` topic,
+the device answers on the `ack` topic with the sequence number of the chunk it expects next
+and the publisher sends only that chunk. When no acknowledgement arrives in time (e.g. the device
+reconnected), the announcement is repeated and the device resumes from what it already has.
+The device verifies the SHA-256 of the image and then installs it through the standard OTA path.
+
+Requires `paho-mqtt`. Works against any broker, e.g. local `mosquitto -v` stand-in:
+
+    python tools/mqtt_fw_publisher.py --broker localhost source.tar.gz
+
+`tools/sim_run.py --fw-image` runs the whole transfer against the firmware with simulated hardware.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import queue
+import sys
+
+import paho.mqtt.client as mqtt
+
+BEGIN_TOPIC = "projector_cabinet/fw/chunk/begin"
+DATA_TOPIC = "projector_cabinet/fw/chunk/data"
+ACK_TOPIC = "projector_cabinet/fw/chunk/ack"
+
+DEFAULT_CHUNK_SIZE = 2048
+ACK_TIMEOUT = 10  # In seconds
+MAX_RETRIES = 30
+
+
+def _read_image(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def publish(client, acks, image, chunk_size, version):
+    info = {
+        "version": version,
+        "size": len(image),
+        "sha256": hashlib.sha256(image).hexdigest(),
+        "chunk_size": chunk_size,
+    }
+    chunks_count = (len(image) + chunk_size - 1) // chunk_size
+    print(f'Publishing {len(image)} B in {chunks_count} chunks of {chunk_size} B')
+
+    client.publish(BEGIN_TOPIC, json.dumps(info), qos=1)
+    retries = 0
+    last_seq = -1
+    while True:
+        try:
+            ack = acks.get(timeout=ACK_TIMEOUT)
+        except queue.Empty:
+            retries += 1
+            if retries > MAX_RETRIES:
+                print('Device does not respond, giving up', file=sys.stderr)
+                return False
+            print('No acknowledgement, announcing the image again to resume')
+            last_seq = -1
+            client.publish(BEGIN_TOPIC, json.dumps(info), qos=1)
+            continue
+
+        retries = 0
+        status = ack.get("status")
+        if status == "done":
+            print('Device verified the image and is restarting to install it')
+            return True
+        if status is not None:
+            print(f'Device refused the image: {status}', file=sys.stderr)
+            return False
+
+        seq = ack["next"]
+        # Duplicate acknowledgements must not trigger duplicate chunks, otherwise they would multiply
+        if seq <= last_seq or seq >= chunks_count:
+            continue
+        last_seq = seq
+
+        chunk = image[seq * chunk_size:(seq + 1) * chunk_size]
+        client.publish(DATA_TOPIC, seq.to_bytes(4, 'big') + chunk, qos=1)
+        print(f'\rSent chunk {seq + 1}/{chunks_count}', end='', flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('image', help='path to the firmware tarball')
+    parser.add_argument('--broker', required=True)
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--user')
+    parser.add_argument('--password')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--version', help='version of the image, defaults to the content of version.txt')
+    args = parser.parse_args()
+
+    version = args.version
+    if version is None and os.path.exists('version.txt'):
+        version = _read_image('version.txt').decode().strip()
+
+    acks = queue.Queue()
+    client = mqtt.Client()
+    if args.user:
+        client.username_pw_set(args.user, args.password)
+    client.on_connect = lambda c, *_: c.subscribe(ACK_TOPIC, qos=1)
+    client.on_message = lambda c, userdata, msg: acks.put(json.loads(msg.payload))
+    client.connect(args.broker, args.port)
+    client.loop_start()
+
+    try:
+        ok = publish(client, acks, _read_image(args.image), args.chunk_size, version)
+    finally:
+        client.loop_stop()
+        client.disconnect()
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+"""
+Runs the firmware with the simulated hardware (see `app/lib/hal_sim.py`) on the MicroPython unix port
+against a local MQTT broker and checks that it works end to end.
+
+The firmware runs in a temporary copy of the repository with generated `app/secrets.py`, so neither
+the settings nor a received firmware touch the working tree. Unless `--broker` is given, the minimal
+MQTT broker of this script (a stand-in for `mosquitto` serving only what the firmware and the tools use)
+listens on the port 1883, syslog records are received on UDP port 5514.
+
+Smoke run, passes once the firmware finishes the bootstrap and keeps running for the settle period
+(`--settle`, by default long enough for the first firmware version check) without exiting, resetting
+or printing a traceback:
+
+    python tools/sim_run.py
+
+Firmware transfer over MQTT with `tools/mqtt_fw_publisher.py` (requires `paho-mqtt`), passes once
+the firmware verified the image, restarted and installed it:
+
+    tar -czf /tmp/source.tar.gz main.py app
+    python tools/sim_run.py --fw-image /tmp/source.tar.gz
+"""
+
+import argparse
+import hashlib
+import os
+import queue
+import shutil
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+MQTT_PORT = 1883
+SYSLOG_PORT = 5514
+BOOT_MARKER = 'Finished bootstrap'
+INSTALL_MARKER = 'New version installed'
+RESET_MARKER = 'Reset of the simulated hardware'
+TRACEBACK_MARKER = 'Traceback'
+
+SECRETS = f'''WIFI_SSID = "simulated"
+WIFI_PASS = ""
+MQTT_BROKER = "{{broker}}"
+MQTT_USER = ""
+MQTT_PASS = ""
+SYSLOG_HOST = "127.0.0.1"
+SYSLOG_PORT = {SYSLOG_PORT}
+'''
+
+
+# Broker
+
+def _topic_matches(topic_filter, topic):
+    filter_levels = topic_filter.split('/')
+    levels = topic.split('/')
+    for i, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if i >= len(levels) or (level != '+' and level != levels[i]):
+            return False
+    return len(filter_levels) == len(levels)
+
+
+def _packet(packet_type, body):
+    header = bytearray([packet_type])
+    length = len(body)
+    while True:
+        byte = length & 0x7F
+        length >>= 7
+        header.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(header) + body
+
+
+class _BrokerHandler(socketserver.BaseRequestHandler):
+    """
+    MQTT 3.1.1 session. Messages are delivered with QoS 0 and sessions are never persisted.
+    """
+
+    def setup(self):
+        self.subscriptions = []
+        self.lock = threading.Lock()
+
+    def send(self, data):
+        with self.lock:
+            self.request.sendall(data)
+
+    def _read(self, n):
+        data = b''
+        while len(data) < n:
+            chunk = self.request.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError
+            data += chunk
+        return data
+
+    def _read_packet(self):
+        packet_type = self._read(1)[0]
+        length = 0
+        shift = 0
+        while True:
+            byte = self._read(1)[0]
+            length |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                return packet_type, self._read(length)
+
+    def handle(self):
+        broker = self.server
+        with broker.lock:
+            broker.sessions.append(self)
+        try:
+            while True:
+                packet_type, body = self._read_packet()
+                kind = packet_type >> 4
+                if kind == 1:  # CONNECT
+                    self.send(b'\x20\x02\x00\x00')
+                elif kind == 3:  # PUBLISH
+                    topic_len = struct.unpack('!H', body[:2])[0]
+                    topic = body[2:2 + topic_len].decode()
+                    offset = 2 + topic_len
+                    if packet_type & 0x06:
+                        self.send(b'\x40\x02' + body[offset:offset + 2])  # PUBACK
+                        offset += 2
+                    broker.publish(topic, body[offset:], bool(packet_type & 0x01))
+                elif kind == 8:  # SUBSCRIBE
+                    pid = body[:2]
+                    offset = 2
+                    filters = []
+                    while offset < len(body):
+                        filter_len = struct.unpack('!H', body[offset:offset + 2])[0]
+                        filters.append(body[offset + 2:offset + 2 + filter_len].decode())
+                        offset += 3 + filter_len
+                    self.send(_packet(0x90, pid + bytes(len(filters))))
+                    with broker.lock:
+                        self.subscriptions.extend(filters)
+                        retained = list(broker.retained.items())
+                    for topic, payload in retained:
+                        if any(_topic_matches(f, topic) for f in filters):
+                            self.send(broker.publish_packet(topic, payload, True))
+                elif kind == 10:  # UNSUBSCRIBE
+                    self.send(_packet(0xB0, body[:2]))
+                elif kind == 12:  # PINGREQ
+                    self.send(b'\xd0\x00')
+                elif kind == 14:  # DISCONNECT
+                    return
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            with broker.lock:
+                broker.sessions.remove(self)
+
+
+class Broker(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port):
+        super().__init__(('127.0.0.1', port), _BrokerHandler)
+        self.lock = threading.Lock()
+        self.sessions = []
+        self.retained = {}
+
+    @staticmethod
+    def publish_packet(topic, payload, retain=False):
+        topic = topic.encode()
+        return _packet(0x31 if retain else 0x30, struct.pack('!H', len(topic)) + topic + payload)
+
+    def publish(self, topic, payload, retain):
+        with self.lock:
+            if retain:
+                if payload:
+                    self.retained[topic] = payload
+                else:
+                    self.retained.pop(topic, None)
+            receivers = [s for s in self.sessions if any(_topic_matches(f, topic) for f in s.subscriptions)]
+        packet = self.publish_packet(topic, payload)
+        for session in receivers:
+            try:
+                session.send(packet)
+            except OSError:
+                pass
+
+
+def _syslog_sink(sock, verbose):
+    while True:
+        data = sock.recv(2048)
+        if verbose:
+            print('[syslog]', data[:200])
+
+
+# Firmware
+
+class Firmware:
+    def __init__(self, workdir, micropython, verbose):
+        self.workdir = workdir
+        self.micropython = micropython
+        self.verbose = verbose
+        self.lines = queue.Queue()
+        self.process = None
+        self.tracebacks = 0
+
+    def start(self):
+        env = dict(os.environ, MICROPYPATH='.frozen:app:app/lib')
+        self.process = subprocess.Popen([self.micropython, 'main.py'], cwd=self.workdir, env=env,
+                                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+        threading.Thread(target=self._read_output, daemon=True).start()
+
+    def _read_output(self):
+        for line in self.process.stdout:
+            if self.verbose:
+                print('[firmware]', line, end='')
+            if TRACEBACK_MARKER in line:
+                self.tracebacks += 1
+            self.lines.put(line)
+        self.lines.put(None)
+
+    def wait_for(self, marker, timeout):
+        """
+        Returns True once the firmware prints line containing the marker, False when it exits or times out.
+        """
+        while True:
+            try:
+                line = self.lines.get(timeout=timeout)
+            except queue.Empty:
+                return False
+            if line is None:
+                return False
+            if marker in line:
+                return True
+
+    def settle(self, seconds):
+        """
+        Keeps the firmware running for the given time, returns the reason when it exits, resets
+        or prints a traceback (also before this call) meanwhile, otherwise None.
+        """
+        deadline = time.monotonic() + seconds
+        while True:
+            if self.tracebacks:
+                return 'firmware printed a traceback'
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                line = self.lines.get(timeout=remaining)
+            except queue.Empty:
+                continue
+            if line is None:
+                return f'firmware exited with code {self.process.wait()}'
+            if RESET_MARKER in line:
+                return 'firmware reset'
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+        if self.process is not None:
+            self.process.wait()
+
+
+def _prepare_workdir(broker):
+    workdir = tempfile.mkdtemp(prefix='cabinet_sim_')
+    shutil.copy('main.py', workdir)
+    shutil.copytree('app', os.path.join(workdir, 'app'), ignore=shutil.ignore_patterns('__pycache__', 'secrets.py'))
+    if os.path.exists('version.txt'):
+        shutil.copy('version.txt', workdir)
+    with open(os.path.join(workdir, 'app', 'secrets.py'), 'w') as f:
+        f.write(SECRETS.format(broker=broker))
+    return workdir
+
+
+def _sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _transfer(args, firmware, workdir):
+    publisher = subprocess.run([sys.executable, os.path.join('tools', 'mqtt_fw_publisher.py'),
+                                '--broker', args.broker or '127.0.0.1', args.fw_image], timeout=args.timeout)
+    if publisher.returncode:
+        return 'publisher failed'
+    if not firmware.wait_for(RESET_MARKER, args.timeout):
+        return 'firmware did not restart after the transfer'
+    firmware.stop()
+
+    received = os.path.join(workdir, 'source.tar.gz')
+    if not os.path.exists(received) or _sha256(received) != _sha256(args.fw_image):
+        return 'received image differs from the published one'
+
+    firmware.start()
+    if not firmware.wait_for(INSTALL_MARKER, args.timeout):
+        return 'firmware did not install the received image'
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--micropython', default='micropython', help='path to the unix port executable')
+    parser.add_argument('--broker', help='use this broker (port 1883) instead of the built-in one')
+    parser.add_argument('--fw-image', help='transfer the firmware tarball over MQTT after the boot')
+    parser.add_argument('--timeout', type=int, default=60, help='seconds to wait for every step')
+    parser.add_argument('--settle', type=int, default=70, help='seconds the firmware has to keep running after the boot')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary copy of the firmware')
+    parser.add_argument('--verbose', action='store_true', help='print the output of the firmware')
+    args = parser.parse_args()
+
+    if args.broker is None:
+        broker = Broker(MQTT_PORT)
+        threading.Thread(target=broker.serve_forever, daemon=True).start()
+    syslog = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    syslog.bind(('127.0.0.1', SYSLOG_PORT))
+    threading.Thread(target=_syslog_sink, args=(syslog, args.verbose), daemon=True).start()
+
+    workdir = _prepare_workdir(args.broker or '127.0.0.1')
+    firmware = Firmware(workdir, args.micropython, args.verbose)
+    try:
+        firmware.start()
+        if not firmware.wait_for(BOOT_MARKER, args.timeout):
+            error = 'firmware did not finish the bootstrap'
+        else:
+            error = firmware.settle(args.settle)
+            if error is None and args.fw_image:
+                error = _transfer(args, firmware, workdir)
+    finally:
+        firmware.stop()
+        if args.keep:
+            print('Firmware files kept in', workdir)
+        else:
+            shutil.rmtree(workdir)
+
+    if error:
+        sys.exit(f'FAILED: {error}')
+    print('OK')
+
+
+if __name__ == '__main__':
+    main()